@@ -23,7 +23,8 @@ in the Roguelike genre.
         package_dir={'':'src'},
         packages=['parole'],
 
-        scripts=['src/scripts/parolestart.py', 'src/scripts/parolenew.py'],
+        scripts=['src/scripts/parolestart.py', 'src/scripts/parolenew.py',
+                 'src/scripts/parolebench.py'],
 
         package_data = {'parole': ['data/*.cfg',
                                    'data/template/config.cfg',
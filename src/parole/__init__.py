@@ -59,6 +59,13 @@ from parole.shader import Shader, Pass
 import parole.sim
 import parole.map
 import parole.fov
+import parole.pathfind
+import parole.los
+import parole.spatial
+import parole.registry
+import parole.regions
+import parole.journal
+import parole.fields
 
 __version__ = versionStr
 
@@ -50,11 +50,23 @@ class Scene(pygame.sprite.OrderedUpdates):
     An ordered collection of L{Shader} objects to be updated and displayed each
     frame. The L{display} module maintains a global instance (L{scene}) of this
     class as the primary user interface for displaying shaders.
+
+    Each frame, L{render} repaints only the parts of the screen that have
+    changed: the old and new rectangles of shaders that were dirty, got a
+    new image, moved, or were added or removed. Everything overlapping
+    those rectangles, below or above, is repainted in order. Code that
+    draws on the display surface behind the scene's back should call
+    L{damage}.
+
+    @ivar drawn: For each shader, the C{(rect, image)} it was last drawn
+    with.
     """
     def __init__(self):
         super(Scene, self).__init__()
         self.positionOf = {}
         self.removalQueue = set()
+        self.drawn = {}
+        self.__damaged = [None]     # None stands for the whole screen
 
     def add(self, *shaders, **kwargs):
         """
@@ -93,8 +105,85 @@ class Scene(pygame.sprite.OrderedUpdates):
                 del self.positionOf[shader]
             except KeyError:
                 pass
+            drawn = self.drawn.pop(shader, None)
+            if drawn:
+                self.__damaged.append(drawn[0])
         self.removalQueue.clear()
 
+    def damage(self, rect=None):
+        """
+        Marks C{rect} of the screen (by default, all of it) to be repainted
+        in the next frame.
+        """
+        if rect is not None:
+            rect = pygame.Rect(rect)
+        self.__damaged.append(rect)
+
+    def render(self, surf):
+        """
+        Updates the scene's shaders and repaints the parts of C{surf} that
+        have changed since the last call (see L{Scene}).
+
+        @return: The list of repainted rectangles, none overlapping another.
+        """
+        shaders = self.sprites()
+        wasDirty = [sdr.dirty for sdr in shaders]
+        self.update()
+
+        damaged, self.__damaged = self.__damaged, []
+        drawn = self.drawn
+        visible = []    # (shader, rect, image), bottom first
+        for sdr, dirty in zip(shaders, wasDirty):
+            sdr.setBlittingParent(self)
+            image = sdr.image
+            old = drawn.get(sdr)
+            if image is None:
+                if old:
+                    damaged.append(old[0])
+                    del drawn[sdr]
+                continue
+            rect = pygame.Rect(sdr.rect.topleft, image.get_size())
+            if old is None or dirty or old[0] != rect or old[1] is not image:
+                if old and old[0] != rect:
+                    damaged.append(old[0])
+                damaged.append(rect)
+            drawn[sdr] = (rect, image)
+            visible.append((sdr, rect, image))
+
+        screen = surf.get_rect()
+        if None in damaged:
+            damaged = [screen]
+        rects = mergeRects([r.clip(screen) for r in damaged])
+
+        for r in rects:
+            clearSurface(surf, r)
+            for sdr, rect, image in visible:
+                if rect.colliderect(r):
+                    part = rect.clip(r)
+                    surf.blit(image, part.topleft,
+                              part.move(-rect.x, -rect.y))
+        return rects
+
+#==============================================================================
+
+def mergeRects(rects):
+    """
+    Merges overlapping rectangles into their unions until none of them
+    overlap, dropping empty ones.
+
+    @return: A list of C{pygame.Rect}s.
+    """
+    merged = []
+    for r in rects:
+        if not (r.w > 0 and r.h > 0):
+            continue
+        i = r.collidelist(merged)
+        while i != -1:
+            r = r.union(merged.pop(i))
+            i = r.collidelist(merged)
+        merged.append(r)
+    return merged
+
 #==============================================================================
 
 __lastModeConfs = {}
@@ -115,6 +204,8 @@ def __onConfigChange(conf):
 
         __clearColor = parseColor(conf.display.clearColor)
         parole.info('Display clear color: %s', __clearColor)
+        if scene is not None:
+            scene.damage()
         
         if __modeDirty:
             parole.debug('Config changed; mode dirty')
@@ -204,6 +295,8 @@ def __setMode():
         
     parole.info('New mode: %s %s %sx%sx%s', hw and 'HW' or 'SW',
         fs and 'Fullscreen' or 'Window', resolution[0], resolution[1], depth)
+    if scene is not None:
+        scene.damage()
     
 
 #==============================================================================
@@ -220,50 +313,29 @@ def getSurface():
 def update():
     """
     Called once per frame by the engine's main loop to update the display.
-    Updates and draws any shaders in the scene list, in order. User programs may
+    Updates any shaders in the scene list, in order, and repaints the parts of
+    the screen that changed (see L{Scene.render}). User programs may
     call this safely, but generally shouldn't need to, unless they want to force
     an immediate display update without waiting for a another loop through the
     engine.
     """
-    rectangels = None
+    rectangles = []
 
     if parole.haveModule['shader']:
-        surf = getSurface()
-        #for sdr in scene:
-        #    sdr.update()
-        #    sdr.draw(surf)
-        
-        # TODO: only clear/blit dirty shaders, and reblit shaders underneath
-        scene.clear(surf, clearSurface)
-        scene.update()
-        for p in scene:
-            p.setBlittingParent(scene)
-        rectangles = scene.draw(surf)
-        #for sdr in scene:
-        #    sdr.update()
-        #    
-        #    # shader-wide alpha and blend functions
-        #    if sdr.alpha < 255 and sdr.alpha > 0:
-        #        # the surface-wide alpha is < 255, but it also has per-pixel
-        #        # alpha. SDL won't combine surface-wide and per-pixel
-        #        # alphas, so we have to do it ourselves
-        #        alphaSubtractor = pygame.Surface(sdr.size).convert_alpha()
-        #        alphaSubtractor.fill((0,0,0, 255 - p.alpha))
-        #        # TODO: is it bad that we do this every frame? shouldn't the
-        #        # shader just do this itself whenever its alpha changes?
-        #        sdr.image.blit(alphaSubtractor, (0,0), 
-        #                special_flags=pygame.locals.BLEND_SUB)
-        #                       
-        #    surf.blit(sdr.image, scene.positionOf[sdr])
+        # Only what changed is repainted, and only that is sent to the
+        # screen; a frame in which nothing changed costs next to nothing.
+        rectangles = scene.render(getSurface())
 
         # Flushed queued removals from the scene
         scene.flushRemovals()
 
-    if __workSurf is not None:
-        __workSurf.blit(__displaySurf, (0,0))
-        pygame.display.flip()
-    else:
-        pygame.display.update(rectangles)
+    if rectangles:
+        if __workSurf is not None:
+            # Double-buffered: the back buffer needs the whole frame
+            __displaySurf.blit(__workSurf, (0,0))
+            pygame.display.flip()
+        else:
+            pygame.display.update(rectangles)
     __fpsClock.tick()
     if __modeDirty:
         __setMode()
@@ -0,0 +1,244 @@
+#Python Advanced Roguelike Engine (Parole)
+#Copyright (C) 2006-2012 Max Bane
+#
+#This program is free software; you can redistribute it and/or
+#modify it under the terms of the GNU General Public License
+#as published by the Free Software Foundation; either version 2
+#of the License, or (at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Diffusing scalar fields over a grid -- scent, noise, threat, influence --
+used by L{parole.map.Map2D.fieldLayer}. As in L{pathfind}, the grid is
+described by its dimensions and a flat, row-major sequence of blocking
+flags; values never spread into or through blocked cells.
+
+Each turn, a field's sources add to it, then every open cell passes a
+fraction of its value to each of its open 4-neighbors, and the whole field
+decays. A blocked cell can still be a source (e.g., the cell of an actor
+that blocks movement): what it's given passes whole to its open
+4-neighbors. The update works on whole shifted copies of the grid rather than
+cell by cell, and costs the same whether one actor or hundreds follow the
+field; following it is then a matter of looking at the 8 neighbors of a
+cell (L{FieldLayer.ascend}).
+"""
+
+import array
+
+# Offsets of the cells an actor may step to, as in Map2D.neighborsOf
+NEIGHBORS = ((1,0), (-1,0), (0,1), (0,-1), (1,1), (1,-1), (-1,1), (-1,-1))
+
+#==============================================================================
+
+class FieldLayer(object):
+    """
+    A field of floating point values over a grid, one per cell. See the
+    module documentation.
+
+    @ivar values: The value of each cell, as a flat, row-major C{array};
+    always 0 in blocked cells after a L{step}.
+    @ivar decay: The factor every value is multiplied by each turn.
+    @ivar diffusion: The fraction of its value a cell passes on each turn,
+    split evenly among its four sides; the shares that would cross into a
+    blocked cell or off the grid stay put.
+    @ivar sources: A dictionary mapping cell indices to the amount added to
+    them every turn. See L{setSource}.
+    """
+
+    def __init__(self, cols, rows, blocked, decay=0.9, diffusion=0.5):
+        """
+        @param blocked: The grid's blocking flags, which the field keeps a
+        reference to; call L{touch} whenever one changes.
+        """
+        if not 0.0 <= decay <= 1.0:
+            raise ValueError('decay must be between 0 and 1.')
+        if not 0.0 <= diffusion <= 1.0:
+            raise ValueError('diffusion must be between 0 and 1.')
+        self.cols, self.rows = cols, rows
+        self.blocked = blocked
+        self.decay = decay
+        self.diffusion = diffusion
+        self.values = array.array('d', [0.0]) * (cols*rows)
+        self.sources = {}
+        self.__open = None      # 1.0 for each open cell, 0.0 for blocked
+        self.__openSides = None # number of open 4-neighbors of each cell
+        self.__coeffs = None    # (decay, diffusion, scale, keep, give)
+
+    def __repr__(self):
+        return 'FieldLayer(%r, %r, ..., decay=%r, diffusion=%r)' % \
+                (self.cols, self.rows, self.decay, self.diffusion)
+
+    def __getitem__(self, (x, y)):
+        return self.values[y*self.cols + x]
+
+    def copy(self, blocked):
+        """
+        Returns an independent copy of this field over C{blocked}, which must
+        currently hold the same blocking flags.
+        """
+        other = FieldLayer(self.cols, self.rows, blocked, self.decay,
+                           self.diffusion)
+        other.values = self.values[:]
+        other.sources = self.sources.copy()
+        return other
+
+    def clear(self):
+        """
+        Sets every value to 0. Sources are kept.
+        """
+        self.values = array.array('d', [0.0]) * (self.cols*self.rows)
+
+    def inject(self, (x, y), amount):
+        """
+        Adds C{amount} to the value of cell C{(x,y)} once.
+        """
+        self.values[y*self.cols + x] += amount
+
+    def setSource(self, (x, y), amount):
+        """
+        Makes cell C{(x,y)} add C{amount} to itself every turn, e.g., for the
+        scent trail of a standing actor; an C{amount} of 0 or C{None} stops
+        it.
+
+        If the cell is blocked (as an actor that blocks movement blocks its
+        own), the whole C{amount} is split evenly among its open 4-neighbors
+        instead, so that the field around it is the same as around an open
+        source; a blocked cell with no open neighbors gives nothing. The
+        same goes for an amount L{inject}ed into a blocked cell.
+        """
+        i = y*self.cols + x
+        if amount:
+            self.sources[i] = amount
+        else:
+            self.sources.pop(i, None)
+
+    def rebuild(self):
+        """
+        Recomputes the field's record of which cells are open from
+        C{blocked}. Called automatically when needed.
+        """
+        cols, rows = self.cols, self.rows
+        n = cols*rows
+        opened = [not b and 1.0 or 0.0 for b in self.blocked]
+        self.__open = opened
+        self.__openSides = [self.__countSides(i) for i in xrange(n)]
+        self.__coeffs = None
+        self.values = array.array('d', [o*v for o, v in
+                                        zip(opened, self.values)])
+
+    def __countSides(self, i):
+        cols, opened = self.cols, self.__open
+        x, y = i % cols, i // cols
+        count = 0.0
+        if x > 0: count += opened[i-1]
+        if x < cols-1: count += opened[i+1]
+        if y > 0: count += opened[i-cols]
+        if y < self.rows-1: count += opened[i+cols]
+        return count
+
+    def touch(self, x, y):
+        """
+        Notes that the blocking state of cell C{(x,y)} has changed.
+        """
+        if self.__open is None:
+            return
+        cols, opened, sides = self.cols, self.__open, self.__openSides
+        self.__coeffs = None
+        i = y*cols + x
+        if self.blocked[i]:
+            opened[i] = 0.0
+            self.values[i] = 0.0
+        else:
+            opened[i] = 1.0
+        for dx, dy in NEIGHBORS[:4]:
+            nx, ny = x+dx, y+dy
+            if 0 <= nx < cols and 0 <= ny < self.rows:
+                j = ny*cols + nx
+                sides[j] = self.__countSides(j)
+
+    def step(self, turns=1):
+        """
+        Advances the field by the given number of turns: adds the sources,
+        diffuses and decays.
+        """
+        if self.__open is None:
+            self.rebuild()
+        cols, n = self.cols, self.cols*self.rows
+        share = self.diffusion / 4.0
+        coeffs = self.__coeffs
+        if coeffs is None or coeffs[:2] != (self.decay, self.diffusion):
+            # What each cell's value is multiplied by after the shares have
+            # moved (the decay, or 0 if blocked), the fraction of its value
+            # it keeps, and the fraction it gives each side: a blocked cell
+            # gives all it has to its open sides.
+            scale = [o*self.decay for o in self.__open]
+            keep = [1.0 - k*share for k in self.__openSides]
+            give = [share if o else (1.0/k if k else 0.0) for o, k in
+                    zip(self.__open, self.__openSides)]
+            coeffs = self.__coeffs = (self.decay, self.diffusion, scale, keep,
+                                      give)
+        decay, diffusion, scale, keep, give = coeffs
+        zero = [0.0]
+        for turn in xrange(turns):
+            v = self.values
+            for i, amount in self.sources.iteritems():
+                v[i] += amount
+            # Each cell's share for each side, and the shares arriving from
+            # each side, by shifting the whole grid one cell.
+            s = [x*g for x, g in zip(v, give)]
+            fromW = zero + s[:-1]
+            fromE = s[1:] + zero
+            for i in xrange(0, n, cols):
+                fromW[i] = 0.0
+                fromE[i+cols-1] = 0.0
+            fromN = zero*cols + s[:-cols]
+            fromS = s[cols:] + zero*cols
+            # Blocked cells only have a value here if they're sources (or
+            # were injected into), and give it all away; their scale of 0
+            # discards what's sent to them, and what they held.
+            self.values = array.array('d', [
+                a*(x*k + w + e + nn + ss) for a, x, k, w, e, nn, ss in
+                zip(scale, v, keep, fromW, fromE, fromN, fromS)])
+
+    def __best(self, x, y, sign):
+        cols, rows, values, blocked = self.cols, self.rows, self.values, \
+                self.blocked
+        best = None
+        bestValue = sign*values[y*cols + x]
+        for dx, dy in NEIGHBORS:
+            nx, ny = x+dx, y+dy
+            if 0 <= nx < cols and 0 <= ny < rows:
+                j = ny*cols + nx
+                if not blocked[j] and sign*values[j] > bestValue:
+                    best, bestValue = (nx, ny), sign*values[j]
+        return best
+
+    def ascend(self, (x, y)):
+        """
+        Returns the open 8-neighbor of cell C{(x,y)} with the greatest value,
+        if it's greater than that of C{(x,y)} itself, or C{None}: the next
+        step for an actor following the field toward its sources.
+        """
+        return self.__best(x, y, 1.0)
+
+    def descend(self, (x, y)):
+        """
+        Like L{ascend}, but returns the neighbor with the least value: the
+        next step for an actor fleeing the field's sources.
+        """
+        return self.__best(x, y, -1.0)
+
+    def ascendMany(self, positions):
+        """
+        Returns the result of L{ascend} for each of C{positions}.
+        """
+        best = self.__best
+        return [best(x, y, 1.0) for x, y in positions]
@@ -0,0 +1,202 @@
+#Python Advanced Roguelike Engine (Parole)
+#Copyright (C) 2006-2012 Max Bane
+#
+#This program is free software; you can redistribute it and/or
+#modify it under the terms of the GNU General Public License
+#as published by the Free Software Foundation; either version 2
+#of the License, or (at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+A journal of the changes made to the cells of a grid, used by
+L{parole.map.Map2D} so that lighting, rendering, saving and so on can ask
+"what changed here since version N?" and redo only that much work.
+
+Every change is of one of the kinds L{CONTENTS}, L{BLOCKING} or L{LIGHT}, and
+is stamped with a version number from a counter kept by the caller, which
+must only ever increase. For each kind the journal remembers the version of
+the latest change to every cell and, as a summary, to every
+C{regionSize}-by-C{regionSize} block of cells, so a query only examines the
+cells of blocks that changed. It also keeps a log of the most recent changes
+in the order they happened.
+"""
+
+import array
+from collections import deque
+
+# Kinds of change; combine them with | to query several at once.
+CONTENTS = 1    # an object was added to or removed from the cell
+BLOCKING = 2    # the cell became passable or impassable, or opaque or clear
+LIGHT = 4       # the light available in the cell changed
+ALL = CONTENTS | BLOCKING | LIGHT
+KINDS = (CONTENTS, BLOCKING, LIGHT)
+
+#==============================================================================
+
+class ChangeJournal(object):
+    """
+    Records changes to the cells of a C{cols}-by-C{rows} grid. See the module
+    documentation.
+
+    @ivar cellVersions: A dictionary mapping each kind to a flat, row-major
+    C{array} of the version of the latest change of that kind to each cell
+    (0 if none).
+    @ivar regionVersions: A dictionary mapping each kind to a row-major
+    C{array} of the version of the latest change of that kind to any cell of
+    each block.
+    @ivar events: The most recent changes, oldest first, as
+    C{(version, x, y, kind)} tuples; at most C{capacity} are kept.
+    @ivar logStart: Every change with a version greater than this is in
+    L{events}.
+    """
+
+    def __init__(self, cols, rows, regionSize=16, capacity=4096, version=0):
+        """
+        @param regionSize: The width and height of the blocks summarized.
+        @param capacity: The number of changes to keep in L{events}; 0 to
+        keep no log.
+        @param version: The current version of the grid; the journal knows
+        nothing of changes up to it.
+        """
+        self.cols, self.rows = cols, rows
+        self.regionSize = regionSize
+        self.regionCols = (cols + regionSize - 1) // regionSize
+        self.regionRows = (rows + regionSize - 1) // regionSize
+        self.cellVersions = {}
+        self.regionVersions = {}
+        for kind in KINDS:
+            self.cellVersions[kind] = array.array('L', [0]) * (cols*rows)
+            self.regionVersions[kind] = array.array('L', [0]) * \
+                    (self.regionCols*self.regionRows)
+        self.capacity = capacity
+        self.events = deque()
+        self.logStart = version
+
+    def copy(self):
+        """
+        Returns an independent copy of the journal.
+        """
+        j = ChangeJournal.__new__(ChangeJournal)
+        j.__dict__.update(self.__dict__)
+        j.cellVersions = dict([(k, a[:]) for k, a in
+                               self.cellVersions.iteritems()])
+        j.regionVersions = dict([(k, a[:]) for k, a in
+                                 self.regionVersions.iteritems()])
+        j.events = deque(self.events)
+        return j
+
+    def record(self, x, y, kind, version):
+        """
+        Records a change of the given kind to cell C{(x,y)} at C{version}.
+        """
+        rs = self.regionSize
+        self.cellVersions[kind][y*self.cols + x] = version
+        self.regionVersions[kind][(y//rs)*self.regionCols + x//rs] = version
+        if self.capacity:
+            events = self.events
+            while len(events) >= self.capacity:
+                self.logStart = events.popleft()[0]
+            events.append((version, x, y, kind))
+
+    def __regionBox(self, rect):
+        # The blocks (bx0, by0, bx1, by1), inclusive, overlapping rect
+        rs = self.regionSize
+        if rect is None:
+            return 0, 0, self.regionCols - 1, self.regionRows - 1
+        x, y, w, h = rect
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, self.cols) - 1, min(y + h, self.rows) - 1
+        return x0//rs, y0//rs, x1//rs, y1//rs
+
+    def changedRegions(self, sinceVersion, kinds=ALL, rect=None):
+        """
+        Returns a list of the C{(bx, by)} coordinates (in blocks) of the
+        blocks with a change of any of the given kinds after C{sinceVersion},
+        overlapping C{rect} if it's given.
+        """
+        regionCols = self.regionCols
+        arrays = [self.regionVersions[k] for k in KINDS if k & kinds]
+        bx0, by0, bx1, by1 = self.__regionBox(rect)
+        found = []
+        for by in xrange(by0, by1+1):
+            for bx in xrange(bx0, bx1+1):
+                i = by*regionCols + bx
+                for a in arrays:
+                    if a[i] > sinceVersion:
+                        found.append((bx, by))
+                        break
+        return found
+
+    def changedCells(self, sinceVersion, kinds=ALL, rect=None):
+        """
+        Returns a list of the C{(x,y)} cells with a change of any of the
+        given kinds after C{sinceVersion}, in C{rect} if it's given, in
+        row-major order within each block. Only the cells of changed blocks
+        are examined.
+        """
+        cols, rows, rs = self.cols, self.rows, self.regionSize
+        arrays = [self.cellVersions[k] for k in KINDS if k & kinds]
+        if rect is None:
+            rx0, ry0, rx1, ry1 = 0, 0, cols, rows
+        else:
+            rx0, ry0 = max(rect[0], 0), max(rect[1], 0)
+            rx1 = min(rect[0] + rect[2], cols)
+            ry1 = min(rect[1] + rect[3], rows)
+        found = []
+        for bx, by in self.changedRegions(sinceVersion, kinds, rect):
+            x0, y0 = max(bx*rs, rx0), max(by*rs, ry0)
+            x1, y1 = min(bx*rs + rs, rx1), min(by*rs + rs, ry1)
+            for y in xrange(y0, y1):
+                for x in xrange(x0, x1):
+                    i = y*cols + x
+                    for a in arrays:
+                        if a[i] > sinceVersion:
+                            found.append((x, y))
+                            break
+        return found
+
+    def kindsAt(self, x, y, sinceVersion):
+        """
+        Returns the kinds (|'d together) of the changes to cell C{(x,y)}
+        after C{sinceVersion}.
+        """
+        i = y*self.cols + x
+        kinds = 0
+        for k in KINDS:
+            if self.cellVersions[k][i] > sinceVersion:
+                kinds |= k
+        return kinds
+
+    def eventsSince(self, sinceVersion, kinds=ALL, rect=None):
+        """
+        Returns a list of the C{(version, x, y, kind)} changes of the given
+        kinds after C{sinceVersion}, in C{rect} if it's given, oldest first,
+        or C{None} if some of them have already left the log (see
+        L{logStart}); the caller should then fall back on L{changedCells}.
+        """
+        if sinceVersion < self.logStart:
+            return None
+        if rect is not None:
+            rx, ry, rw, rh = rect
+        found = []
+        # The log is in version order, so walk back only as far as needed
+        for event in reversed(self.events):
+            version, x, y, kind = event
+            if version <= sinceVersion:
+                break
+            if not kind & kinds:
+                continue
+            if rect is not None and not (rx <= x < rx + rw and
+                                         ry <= y < ry + rh):
+                continue
+            found.append(event)
+        found.reverse()
+        return found
@@ -0,0 +1,185 @@
+#Python Advanced Roguelike Engine (Parole)
+#Copyright (C) 2006-2012 Max Bane
+#
+#This program is free software; you can redistribute it and/or
+#modify it under the terms of the GNU General Public License
+#as published by the Free Software Foundation; either version 2
+#of the License, or (at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Batch line-of-sight tests used by L{parole.map.Map2D}. Like L{pathfind},
+this module knows nothing about L{Tile}s: it works on the dimensions of a
+grid and a flat, row-major sequence of blocking flags, where
+C{blocked[y*cols + x]} is nonzero iff the cell at C{(x,y)} blocks line of
+sight.
+
+Lines are traced by the same Bresenham algorithm as
+L{parole.map.bresenhamPoints}, and a target is visible iff none of the cells
+on the line before it is blocked, exactly as with L{Map2D.testLOS}: the
+target itself may be blocked (a wall is visible), but the origin may not.
+
+A Bresenham line depends only on the offset between its endpoints, so the
+lines from an origin to every offset form a tree: lines toward nearby
+targets in similar directions share their first cells. L{RayTree} builds
+that tree once and keeps it, and a batch of tests from one origin examines
+each cell of the union of the lines just once, stopping along every branch
+at the first blocked cell.
+"""
+
+#==============================================================================
+
+def bresenhamOffsets(dx, dy):
+    """
+    Returns the list of C{(x,y)} offsets traced by a Bresenham line from
+    C{(0,0)} to C{(dx,dy)} inclusive, in that order. The same points as
+    L{parole.map.bresenhamPoints} returns for the segment, which doesn't
+    always trace from the first endpoint.
+    """
+    x0, y0, x1, y1 = 0, 0, dx, dy
+    steep = abs(y1 - y0) > abs(x1 - x0)
+    if steep:
+        x0, y0, x1, y1 = y0, x0, y1, x1
+    if x0 > x1:
+        x0, y0, x1, y1 = x1, y1, x0, y0
+    deltax = x1 - x0
+    deltay = abs(y1 - y0)
+    error = deltax / 2
+    y = y0
+    ystep = (y0 < y1) and 1 or -1
+    points = []
+    for x in xrange(x0, x1+1):
+        if steep:
+            points.append((y,x))
+        else:
+            points.append((x,y))
+        error -= deltay
+        if error < 0:
+            y += ystep
+            error += deltax
+    if points[0] != (0,0):
+        points.reverse()
+    return points
+
+class RayTree(object):
+    """
+    The Bresenham lines from an origin, as a tree of their shared prefixes.
+    Node 0 is the origin itself; every other node is a cell offset reached
+    from its parent by one step of some line. Lines are added lazily, the
+    first time a target at their offset is tested, so the tree only grows to
+    cover the offsets actually used. It doesn't depend on any particular
+    grid, and can be shared by every map.
+
+    @ivar parent: The parent of each node (-1 for the root).
+    @ivar offset: The C{(x,y)} offset of each node from the origin.
+    """
+
+    def __init__(self):
+        self.parent = [-1]
+        self.offset = [(0,0)]
+        self.__children = {}    # (node, offset) -> node
+        self.__lastCell = {}    # target offset -> node before the target
+
+    def __len__(self):
+        return len(self.parent)
+
+    def lastCell(self, dx, dy):
+        """
+        Returns the node of the last cell before the target on the line to
+        offset C{(dx,dy)}, which must not be C{(0,0)}. The target is
+        visible iff neither that cell nor any of its ancestors is blocked.
+        """
+        node = self.__lastCell.get((dx,dy))
+        if node is None:
+            children, parent, offset = self.__children, self.parent, \
+                    self.offset
+            node = 0
+            for p in bresenhamOffsets(dx, dy)[1:-1]:
+                child = children.get((node, p))
+                if child is None:
+                    child = len(parent)
+                    parent.append(node)
+                    offset.append(p)
+                    children[node, p] = child
+                node = child
+            self.__lastCell[dx,dy] = node
+        return node
+
+    def testFrom(self, cols, rows, blocked, origin, targets):
+        """
+        Tests line of sight from C{origin} to each of C{targets}.
+
+        @return: A list of booleans, one per target. Targets outside the
+        grid are never visible.
+        """
+        ox, oy = origin
+        base = oy*cols + ox
+        parent, offset = self.parent, self.offset
+        # clear[node] is True iff no cell from the origin up to node is
+        # blocked
+        clear = {0: not blocked[base]}
+        results = []
+        for tx, ty in targets:
+            if not (0 <= tx < cols and 0 <= ty < rows):
+                results.append(False)
+                continue
+            if tx == ox and ty == oy:
+                results.append(True)
+                continue
+            node = self.lastCell(tx - ox, ty - oy)
+            path = []
+            while node not in clear:
+                path.append(node)
+                node = parent[node]
+            visible = clear[node]
+            while path:
+                node = path.pop()
+                if visible:
+                    x, y = offset[node]
+                    visible = not blocked[base + y*cols + x]
+                clear[node] = visible
+            results.append(visible)
+        return results
+
+    def testPairs(self, cols, rows, blocked, pairs):
+        """
+        Tests line of sight for each C{(origin, target)} pair in C{pairs},
+        sharing the work among pairs with the same origin.
+
+        @return: A list of booleans, one per pair.
+        """
+        byOrigin = {}
+        for i, (origin, target) in enumerate(pairs):
+            byOrigin.setdefault(tuple(origin), []).append((i, target))
+        results = [False] * len(pairs)
+        for origin, entries in byOrigin.iteritems():
+            visible = self.testFrom(cols, rows, blocked, origin,
+                                    [t for i, t in entries])
+            for (i, t), v in zip(entries, visible):
+                results[i] = v
+        return results
+
+# The tree used by Map2D; lines don't depend on the grid, so one will do.
+defaultRayTree = RayTree()
+
+def testLOSFrom(cols, rows, blocked, origin, targets):
+    """
+    Tests line of sight from C{origin} to each of C{targets} using
+    L{defaultRayTree}. See L{RayTree.testFrom}.
+    """
+    return defaultRayTree.testFrom(cols, rows, blocked, origin, targets)
+
+def testLOSPairs(cols, rows, blocked, pairs):
+    """
+    Tests line of sight for each C{(origin, target)} pair using
+    L{defaultRayTree}. See L{RayTree.testPairs}.
+    """
+    return defaultRayTree.testPairs(cols, rows, blocked, pairs)
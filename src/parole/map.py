@@ -22,10 +22,20 @@ TODO: Map library docs.
 import parole, shader, resource, pygame
 from pygame import Rect
 from colornames import colors
-import gc, random, math, random, pprint
-import fov, perlin
+import gc, random, math, random, pprint, array, copy, weakref
+import os, types, zlib, hashlib, cPickle
+import fov, perlin, pathfind, los, spatial, registry, regions, journal
+import fields
 from shader import clampRGB
-import sys
+import sys, time
+
+try:
+    import multiprocessing
+    from multiprocessing import sharedctypes
+except ImportError:
+    # Python 2.5; no SharedMapSnapshot, and ChunkedGeneration runs
+    # in-process
+    multiprocessing = sharedctypes = None
 
 #==============================================================================
 
@@ -84,6 +94,25 @@ def __unload():
 #==============================================================================
 #{ Representation and implementation of 2D maps
 
+# Key of the deepcopy memo that tells MapObjects to copy themselves detached
+_DETACH = object()
+
+def detachedCopies(objs, map=None):
+    """
+    Returns a list of deep copies of the L{MapObject}s C{objs} with no links
+    back to a map: they aren't on any tile and have no position, and their
+    shaders aren't passes of the tiles' (nor in any sprite group). Other
+    L{MapObject}s they refer to are copied the same way, and references to
+    C{map}, if given, become C{None}. The originals are left untouched.
+    Used by L{Map2D.saveDelta}.
+    """
+    memo = {_DETACH: True}
+    if map is not None:
+        memo[id(map)] = None
+    return copy.deepcopy(list(objs), memo)
+
+#==============================================================================
+
 class MapObject(object):
     """
     Any game object contained within a L{Tile} must be an instance of
@@ -103,27 +132,74 @@ class MapObject(object):
     @param blocksLOS: Whether this object blocks line of sight through the
                       tile containing it. This affects both FOV and LOS
                       calculations performed by the L{Map2D} containing the
-                      object.
+                      object, which keeps count of LOS blockers per tile
+                      (see L{Map2D.losBlockers}).
     @type blocksMove: C{bool}
     @param blocksMove: Whether this object blocks movement through the
-                      tile containing it. No engine code is affected by this,
-                      but it is included as most user code will want something
-                      like it for their L{MapObject}s.
+                      tile containing it. The containing L{Map2D} keeps count
+                      of move blockers per tile (see L{Map2D.moveBlockers}) for
+                      use by its path-finding methods.
+
+    @ivar moveCost: Additional cost of moving into the tile containing this
+    object, for terrain-aware path-finders and simulations. 0 by default.
+    @ivar typeId: A small integer identifying what kind of object this is,
+    for code that sees the map only through compact numeric layers (see
+    L{SharedMapSnapshot}). Games assign their own ids, usually per class;
+    0 means unspecified.
+    @ivar tags: A sequence of hashable tags (e.g. strings) under which this
+    object can be found by L{Map2D}'s spatial queries, in addition to its
+    class. Read when the object is added to a L{Tile}.
     """
     
     layer = 0
     shader = None
+    blocksLOS = False
+    blocksMove = False
+    moveCost = 0
+    typeId = 0
+    tags = ()
     
     def __init__(self, layer, shader, blocksLOS=False, blocksMove=False):
         self._layer = layer
         self._shader = shader
         self.pos = None
         self.parentTile = None
-        self.blocksLOS = blocksLOS
-        self.blocksMove = blocksMove
+        self._blocksLOS = blocksLOS
+        self._blocksMove = blocksMove
         
     def __repr__(self):
         return "MapObject(%s, %s)" % (self.layer, self.shader)
+
+    def __setstate__(self, state):
+        """
+        Sets the state of a new L{MapObject} while unpickling. Accepts the
+        state of L{MapObject}s pickled before C{blocksMove} and C{blocksLOS}
+        became properties.
+        """
+        if 'blocksMove' in state:
+            state['_blocksMove'] = state.pop('blocksMove')
+        if 'blocksLOS' in state:
+            state['_blocksLOS'] = state.pop('blocksLOS')
+        self.__dict__.update(state)
+
+    def __deepcopy__(self, memo):
+        # Copies by the usual protocol (so subclasses' __getstate__ and
+        # __setstate__ are respected); but when the copy is being detached
+        # from the map (see detachedCopies), it gets no tile or position,
+        # and its shader isn't a pass of anything.
+        rv = self.__reduce_ex__(2)
+        if memo.get(_DETACH) and isinstance(rv[2], dict):
+            state = rv[2].copy()
+            state['parentTile'] = None
+            state['pos'] = None
+            shader = self._shader
+            if shader is not None:
+                memo.setdefault(id(shader.parents), set())
+                groups = getattr(shader, '_Sprite__g', None)
+                if groups is not None:
+                    memo.setdefault(id(groups), {})
+            rv = rv[:2] + (state,) + rv[3:]
+        return copy._reconstruct(self, rv, 1, memo)
         
     @parole.Property
     def layer():
@@ -165,6 +241,46 @@ class MapObject(object):
             if parent:
                 parent.add(self)
 
+    @parole.Property
+    def blocksLOS():
+        """
+        Whether this L{MapObject} blocks line of sight through its L{Tile}.
+        Setting this property keeps the containing L{Map2D}'s LOS blocker
+        counts up to date.
+        """
+        def fget(self):
+            return self._blocksLOS
+
+        def fset(self, val):
+            parent = self.parentTile
+            if parent:
+                parent.map._beforeTileChange(parent)
+            if parent and bool(val) != bool(self._blocksLOS):
+                parent.map.changeLOSBlockers(parent, val and 1 or -1)
+            self._blocksLOS = val
+            if parent:
+                parent.map.onObjectChange(self)
+
+    @parole.Property
+    def blocksMove():
+        """
+        Whether this L{MapObject} blocks movement through its L{Tile}. Setting
+        this property keeps the containing L{Map2D}'s move blocker counts up
+        to date.
+        """
+        def fget(self):
+            return self._blocksMove
+
+        def fset(self, val):
+            parent = self.parentTile
+            if parent:
+                parent.map._beforeTileChange(parent)
+            if parent and bool(val) != bool(self._blocksMove):
+                parent.map.changeMoveBlockers(parent, val and 1 or -1)
+            self._blocksMove = val
+            if parent:
+                parent.map.onObjectChange(self)
+
     def applyLight(self, availLight):
         self.shader.applyLight(availLight)
             
@@ -411,6 +527,7 @@ class Tile(shader.Shader):
         if not isinstance(obj, MapObject):
             raise TypeError, "Only a MapObject may be added to a Tile."
         
+        self.map._beforeTileChange(self)
         #super(Tile, self).add(obj)
         self.contents.add(obj)
         obj.parentTile = self
@@ -425,11 +542,33 @@ class Tile(shader.Shader):
         #parole.debug('Added %r to %s', obj, self)
         self.resetPasses()
         return self
+
+    def addMany(self, objs):
+        """
+        Adds each of a sequence of C{MapObject}s to this C{Tile}, like L{add},
+        but recomputes how the tile is displayed only once, at the end.
+        """
+        self.map._beforeTileChange(self)
+        highest = self.getHighestLayer()
+        for obj in objs:
+            if not isinstance(obj, MapObject):
+                raise TypeError, "Only a MapObject may be added to a Tile."
+            self.contents.add(obj)
+            obj.parentTile = self
+            obj.pos = (self.col, self.row)
+            self.applyLight(obj)
+            if obj.layer > highest:
+                self._highestObject = obj
+                highest = obj.layer
+            self.map.onAdd(self, obj)
+        self.resetPasses()
+        return self
         
     def remove(self, obj):
         """
         Removes a C{MapObject} from this C{Tile}.
         """
+        self.map._beforeTileChange(self)
         self.map.onRemove(self, obj)
 
         #super(Tile, self).remove(obj)
@@ -460,9 +599,32 @@ class Tile(shader.Shader):
         Updates the contents of the L{Tile} to be the union of its contents with
         those of the given sequence of L{MapObject}s.
         """
+        self.map._beforeTileChange(self)
         #set.update(self, otherSet)
         self.contents.update(otherSet)
 
+    def copyContentsFrom(self, other):
+        """
+        Fills this (empty) L{Tile} with shallow copies of the L{MapObject}s
+        in the L{Tile} C{other}, and gives it the same light, without
+        notifying the L{Map2D}. Used by L{Map2D.clone}, whose blocker counts
+        already include the objects.
+
+        @return: A dictionary mapping each of C{other}'s objects to its copy.
+        """
+        copies = {}
+        for obj in other.contents:
+            c = copy.copy(obj)
+            c.parentTile = self
+            c.pos = (self.col, self.row)
+            self.contents.add(c)
+            copies[obj] = c
+        self.highestObject = copies.get(other.highestObject)
+        self.availLight = other.availLight
+        self.lightIntensity = other.lightIntensity
+        self.resetPasses()
+        return copies
+
     def hasLOSBlocker(self):
         """
         Returns C{True} iff the tile contains a L{MapObject} whose
@@ -484,12 +646,14 @@ class Tile(shader.Shader):
         return False
 
     def addLight(self, (r,g,b), intensity):
+        self.map._beforeTileChange(self)
         aR, aG, aB = self.availLight
         self.availLight = (aR + int(intensity*r), 
                            aG + int(intensity*g),
                            aB + int(intensity*b))
         self.map.tilesWithDirtyLight.add(self)
         self.lightIntensity += intensity
+        self.map.markChanged(self.col, self.row, journal.LIGHT)
 
     def removeLight(self, rgb, intensity):
         """
@@ -501,9 +665,11 @@ class Tile(shader.Shader):
         """
         Remove all available light at this L{Tile}.
         """
+        self.map._beforeTileChange(self)
         self.availLight = (0,0,0)
         self.lightIntensity = self.map.ambientIntensity
         self.map.tilesWithDirtyLight.add(self)
+        self.map.markChanged(self.col, self.row, journal.LIGHT)
 
     def applyLight(self, obj=None):
         availRGB = shader.clampRGB(self.availLight)
@@ -580,6 +746,86 @@ class NoAStarPathError(Exception):
 
 #==============================================================================
 
+class _CopyOnWriteRow(object):
+    # A row of a cloned Map2D's tiles. Until the clone or its source changes
+    # a tile, the row has no Tile of its own there, and reading it gives a
+    # _SharedTile view of the source's; then it holds the clone's own copy.
+    # See Map2D.clone.
+
+    def __init__(self, map, y):
+        self.map = map
+        self.y = y
+        self.tiles = {}     # x -> the clone's own Tile
+
+    def __len__(self):
+        return self.map.cols
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            return [self[i] for i in xrange(*x.indices(self.map.cols))]
+        if x < 0:
+            x += self.map.cols
+        tile = self.tiles.get(x)
+        if tile is None:
+            if not 0 <= x < self.map.cols:
+                raise IndexError(x)
+            return _SharedTile(self.map, x, self.y)
+        return tile
+
+    def __iter__(self):
+        for x in xrange(self.map.cols):
+            yield self[x]
+
+# The Tile methods that change it, which a _SharedTile hands to a copy
+_TILE_MUTATORS = frozenset(['add', 'addMany', 'remove', 'clear',
+        'updateContents', 'copyContentsFrom', 'addLight', 'removeLight',
+        'clearLight', 'applyLight', 'resetPasses', 'addOverlay',
+        'removeOverlay', 'clearOverlays', 'frozenShader',
+        'clearFrozenShader'])
+
+class _SharedTile(object):
+    # A cloned Map2D's view of a tile it shares with its source: reads go
+    # to the source's Tile (or to the clone's own, once it has one), while
+    # the Tile methods that change it, and setting attributes, first make
+    # the clone copy the tile. MapObjects passed to those methods are
+    # translated to the clone's copies. See Map2D.clone.
+    __slots__ = ('map', 'col', 'row')
+
+    def __init__(self, map, col, row):
+        object.__setattr__(self, 'map', map)
+        object.__setattr__(self, 'col', col)
+        object.__setattr__(self, 'row', row)
+
+    def __target(self):
+        return self.map._realTile(self.col, self.row)
+
+    def __own(self):
+        return self.map._ownTile(self.col, self.row)
+
+    def __getattr__(self, name):
+        if name not in _TILE_MUTATORS:
+            return getattr(self.__target(), name)
+        method = getattr(self.__own(), name)
+        counterparts = self.map.counterparts
+        def mutator(*args):
+            return method(*[isinstance(a, MapObject) and
+                            counterparts.get(a, a) or a for a in args])
+        return mutator
+
+    def __setattr__(self, name, value):
+        setattr(self.__own(), name, value)
+
+    def __iter__(self):
+        return iter(self.__target())
+
+    def __contains__(self, obj):
+        return obj in self.__target()
+
+    def __repr__(self):
+        return repr(self.__target())
+
+#==============================================================================
+
 class Map2D(object):
     """
     A two-dimensional array of L{Tile} objects, along with varioius utility
@@ -592,7 +838,49 @@ class Map2D(object):
 
     A L{Map2D} object can also be iterated over, which has the effect of
     iterating through all the L{Tile}s contained in it, in column-major order.
+
+    @ivar moveBlockers: The number of move-blocking L{MapObject}s in each
+    L{Tile}, as a flat, row-major C{array} (the count for C{(x,y)} is at index
+    C{y*cols + x}). Maintained automatically as objects are added and removed;
+    used by the path-finding methods, and by anything else that wants to test
+    passability without looking at L{Tile} contents.
+    @type moveBlockers: C{array.array}
+    @ivar losBlockers: The number of LOS-blocking L{MapObject}s in each
+    L{Tile}, laid out like L{moveBlockers}; used by the line-of-sight and
+    field-of-view methods.
+    @type losBlockers: C{array.array}
+    @ivar clusterGraph: The L{pathfind.ClusterGraph} used by L{getHPAPath},
+    or C{None} if hierarchical path-finding hasn't been used on this map.
+    @ivar connectivity: The L{pathfind.ConnectivityIndex} of this map's
+    passable tiles, or C{None} if it hasn't been needed yet. See
+    L{isReachable}.
+    @ivar objectIndex: The L{spatial.SpatialIndex} of this map's
+    L{MapObject}s, or C{None} if it hasn't been needed yet. See
+    L{objectsInRect}, L{objectsInRadius} and L{nearestObjects}.
+    @ivar registry: The L{registry.ObjectRegistry} of this map's
+    L{MapObject}s by kind, or C{None} if it hasn't been needed yet. See
+    L{objectRegistry}.
+    @ivar regions: The L{regions.RegionIndex} labeling this map's tiles by
+    room or area, or C{None} if it hasn't been needed yet. See L{regionAt}.
+    @ivar version: A counter incremented by every change to the contents or
+    light of a L{Tile} (see L{markChanged}).
+    @type version: C{int}
+    @ivar regionVersions: For each C{regionSize}-by-C{regionSize} block of
+    tiles, in row-major order, the L{version} of the most recent change to
+    any tile in it. See L{changedRegions}.
+    @type regionVersions: C{array.array}
+    @ivar journal: The L{journal.ChangeJournal} recording, by kind, which
+    tiles changed at which L{version}. See L{changedCells},
+    L{changeEvents} and L{saveDelta}.
+    @ivar fields: A dictionary mapping names to the L{fields.FieldLayer}s
+    (scent, threat, ...) over this map. See L{fieldLayer}.
+    @ivar cloneSource: The map this one is a L{clone} of, or C{None}.
     """
+
+    regionSize = 16
+    cloneSource = None
+    clones = ()     # weak references to live clones; see clone
+
     def __init__(self, name, (cols, rows), tileType=Tile):
         """
         Create a L{Map2D} instance with the given name and dimenions.
@@ -617,6 +905,16 @@ class Map2D(object):
             raise ValueError('Map2D must have nonzero dimensions.')
         self.rows, self.cols = rows, cols
 
+        self.moveBlockers = array.array('H', [0]) * (cols*rows)
+        self.losBlockers = array.array('H', [0]) * (cols*rows)
+        self.clusterGraph = None
+        self.connectivity = None
+        self.objectIndex = None
+        self.registry = None
+        self.regions = None
+        self.fields = {}
+        self.resetRegionVersions()
+
         self.tiles = [[tileType(self, (col,row)) for \
                 col in range(cols)] for row in range(rows)]
         if not isinstance(self.tiles[0][0], Tile):
@@ -635,6 +933,36 @@ class Map2D(object):
     def __repr__(self):
         return 'Map2D(%r, (%r,%r))' % (self.name, self.cols, self.rows) 
 
+    def __getstate__(self):
+        """
+        Returns the state of a L{Map2D} instance for pickling. Its clones
+        (see L{clone}) are not preserved.
+        """
+        state = self.__dict__.copy()
+        state.pop('clones', None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Sets the state of a new L{Map2D} instance while unpickling. Maps
+        pickled without move or LOS blocker counts have them recounted.
+        """
+        self.__dict__.update(state)
+        self.__dict__.setdefault('connectivity', None)
+        self.__dict__.setdefault('objectIndex', None)
+        self.__dict__.setdefault('registry', None)
+        self.__dict__.setdefault('regions', None)
+        self.__dict__.setdefault('fields', {})
+        if 'moveBlockers' not in state:
+            self.recountMoveBlockers()
+        if 'losBlockers' not in state:
+            self.recountLOSBlockers()
+        if 'regionVersions' not in state:
+            self.resetRegionVersions()
+        elif 'journal' not in state:
+            self.journal = journal.ChangeJournal(self.cols, self.rows,
+                    self.regionSize, version=self.version)
+
     def __getitem__(self, (x,y)):
         return self.tiles[y][x]
 
@@ -782,11 +1110,537 @@ class Map2D(object):
         return tile
 
     def onAdd(self, tile, obj):
+        if obj.blocksMove:
+            self.changeMoveBlockers(tile, 1)
+        if obj.blocksLOS:
+            self.changeLOSBlockers(tile, 1)
+        if self.objectIndex is not None:
+            self.objectIndex.add(obj, (tile.col, tile.row))
+        if self.registry is not None:
+            self.registry.add(obj)
+        self.markChanged(tile.col, tile.row)
         self.notifyMonitors(obj)
     
     def onRemove(self, tile, obj):
+        if obj.blocksMove:
+            self.changeMoveBlockers(tile, -1)
+        if obj.blocksLOS:
+            self.changeLOSBlockers(tile, -1)
+        if self.objectIndex is not None and obj in self.objectIndex:
+            self.objectIndex.remove(obj)
+        if self.registry is not None and obj in self.registry:
+            self.registry.remove(obj)
+        self.markChanged(tile.col, tile.row)
         self.notifyMonitors(obj)
+
+    def onObjectChange(self, obj):
+        """
+        Called when an attribute of a L{MapObject} on this map that isn't
+        covered by L{onAdd} and L{onRemove} (i.e., C{blocksLOS} or
+        C{blocksMove}) is set, so that the L{registry} columns stay current.
+        """
+        if self.registry is not None:
+            self.registry.refresh(obj)
+
+    def markChanged(self, x, y, kind=journal.CONTENTS):
+        """
+        Records a change to the tile at C{(x,y)} by incrementing L{version},
+        stamping the tile's region with it, and entering it in the
+        L{journal}. Called automatically when objects are added or removed
+        (C{journal.CONTENTS}), when move or LOS blocking changes
+        (C{journal.BLOCKING}), and when light is added or cleared
+        (C{journal.LIGHT}); call it yourself after changing anything else
+        about a tile that readers of L{changedRegions} care about.
+        """
+        self.version += 1
+        rs = self.regionSize
+        self.regionVersions[(y//rs)*self.regionCols + x//rs] = self.version
+        self.journal.record(x, y, kind, self.version)
+
+    def changedRegions(self, sinceVersion, kinds=journal.ALL, rect=None):
+        """
+        Returns a list of C{Rect}s (in tiles, clipped to the map) covering
+        every region containing a tile changed after L{version}
+        C{sinceVersion}. Takes time proportional to the number of regions,
+        not tiles, so it's cheap to call every turn.
+
+        @param kinds: The kinds of change to consider (see L{journal}),
+        |'d together.
+        @param rect: If given, only regions overlapping this C{Rect} are
+        returned.
+        """
+        rs = self.regionSize
+        if kinds == journal.ALL and rect is None:
+            regionCols = self.regionCols
+            blocks = [(i % regionCols, i // regionCols) for i, v in
+                      enumerate(self.regionVersions) if v > sinceVersion]
+        else:
+            blocks = self.journal.changedRegions(sinceVersion, kinds, rect)
+        rects = []
+        for bx, by in blocks:
+            x, y = bx*rs, by*rs
+            rects.append(Rect(x, y, min(rs, self.cols - x),
+                              min(rs, self.rows - y)))
+        return rects
+
+    def changedCells(self, sinceVersion, kinds=journal.ALL, rect=None):
+        """
+        Returns a list of the C{(x,y)} positions of the tiles with a change
+        of any of the given kinds after L{version} C{sinceVersion}, in
+        C{rect} (a C{Rect}) if it's given. Only the tiles of regions that
+        changed are examined, so a subsystem that remembers the version it
+        last caught up to can redo just the work that's needed::
+
+            for x, y in map.changedCells(self.seen, journal.LIGHT, view):
+                self.redraw(x, y)
+            self.seen = map.version
+        """
+        return self.journal.changedCells(sinceVersion, kinds, rect)
+
+    def changeEvents(self, sinceVersion, kinds=journal.ALL, rect=None):
+        """
+        Returns the changes of the given kinds after L{version}
+        C{sinceVersion}, in C{rect} if it's given, as a list of
+        C{(version, x, y, kind)} tuples in the order they happened; or
+        C{None} if the L{journal}'s log no longer goes back that far, in
+        which case use L{changedCells}.
+        """
+        return self.journal.eventsSince(sinceVersion, kinds, rect)
+
+    def saveDelta(self, sinceVersion, rect=None):
+        """
+        Returns a L{MapDelta} holding the current state of every tile that
+        changed after L{version} C{sinceVersion}, which can be pickled
+        (without the rest of the map) and applied to a copy of this map as
+        it was at C{sinceVersion} with L{applyDelta}: a cheap incremental
+        save, or an update for a replica.
+        """
+        cells = []
+        for x, y in self.changedCells(sinceVersion, journal.ALL, rect):
+            tile = self.tiles[y][x]
+            objs = detachedCopies(tile, self)
+            cells.append((x, y, objs, tile.availLight, tile.lightIntensity))
+        return MapDelta((self.cols, self.rows), sinceVersion, self.version,
+                        cells)
+
+    def applyDelta(self, delta):
+        """
+        Brings the tiles in a L{MapDelta} (see L{saveDelta}) up to date:
+        each tile's objects are replaced with deep copies of those in the
+        delta (so a delta can be applied to several maps), and its light is
+        set to theirs. Monitors and indexes are notified as usual.
+        """
+        if delta.size != (self.cols, self.rows):
+            raise ValueError('%s cannot apply a delta for a %sx%s map.' % \
+                    (self, delta.size[0], delta.size[1]))
+        for x, y, objs, availLight, lightIntensity in delta.cells:
+            tile = self.tiles[y][x]
+            for obj in list(tile):
+                tile.remove(obj)
+            for obj in copy.deepcopy(objs):
+                tile.add(obj)
+            tile.availLight = availLight
+            tile.lightIntensity = lightIntensity
+            self.tilesWithDirtyLight.add(tile)
+            self.markChanged(x, y, journal.LIGHT)
+
+    def resetRegionVersions(self):
+        """
+        Sets L{version} to 0 and allocates L{regionVersions} for the current
+        L{regionSize}. Readers holding old versions should start over.
+        """
+        rs = self.regionSize
+        self.regionCols = (self.cols + rs - 1) // rs
+        self.regionRows = (self.rows + rs - 1) // rs
+        self.version = 0
+        self.regionVersions = array.array('L', [0]) * \
+                (self.regionCols*self.regionRows)
+        self.journal = journal.ChangeJournal(self.cols, self.rows, rs)
+
+    def changeMoveBlockers(self, tile, delta):
+        """
+        Adjusts the move blocker count of the given L{Tile} by C{delta}. Called
+        automatically when move-blocking L{MapObject}s come and go; calls
+        L{onMoveBlockingChange} if the tile becomes passable or impassable.
+        """
+        i = tile.row*self.cols + tile.col
+        before = self.moveBlockers[i]
+        self.moveBlockers[i] = before + delta
+        if bool(before) != bool(before + delta):
+            self.markChanged(tile.col, tile.row, journal.BLOCKING)
+            self.onMoveBlockingChange(tile.col, tile.row)
+
+    def onMoveBlockingChange(self, x, y):
+        """
+        Called whenever the tile at C{(x,y)} becomes passable or impassable, so
+        that path-finding structures can be kept up to date.
+        """
+        if self.clusterGraph:
+            self.clusterGraph.touch(x, y)
+        if self.connectivity:
+            self.connectivity.touch(x, y)
+        if self.regions is not None:
+            self.regions.touch(x, y)
+        for field in self.fields.itervalues():
+            field.touch(x, y)
+
+    def recountMoveBlockers(self):
+        """
+        Recomputes L{moveBlockers} from scratch by examining the contents of
+        every L{Tile}. Only needed if objects have been put into tiles behind
+        the map's back (e.g., via L{Tile.updateContents}).
+        """
+        blockers = array.array('H', [0]) * (self.cols*self.rows)
+        for y in xrange(self.rows):
+            for x in xrange(self.cols):
+                for obj in self.tiles[y][x]:
+                    if obj.blocksMove:
+                        blockers[y*self.cols + x] += 1
+        self.moveBlockers = blockers
+        self.clusterGraph = None
+        self.connectivity = None
+        if self.regions is not None:
+            self.regions.blocked = blockers
+            self.regions.rebuild()
+        for field in self.fields.itervalues():
+            field.blocked = blockers
+            field.rebuild()
+
+    def changeLOSBlockers(self, tile, delta):
+        """
+        Adjusts the LOS blocker count of the given L{Tile} by C{delta}, like
+        L{changeMoveBlockers}.
+        """
+        i = tile.row*self.cols + tile.col
+        before = self.losBlockers[i]
+        self.losBlockers[i] = before + delta
+        if bool(before) != bool(before + delta):
+            self.markChanged(tile.col, tile.row, journal.BLOCKING)
+
+    def recountLOSBlockers(self):
+        """
+        Recomputes L{losBlockers} from scratch, like L{recountMoveBlockers}.
+        """
+        blockers = array.array('H', [0]) * (self.cols*self.rows)
+        for y in xrange(self.rows):
+            for x in xrange(self.cols):
+                for obj in self.tiles[y][x]:
+                    if obj.blocksLOS:
+                        blockers[y*self.cols + x] += 1
+        self.losBlockers = blockers
+
+    def isPassable(self, (x,y)):
+        """
+        Returns C{True} iff the tile at C{(x,y)} contains no move blockers.
+        Equivalent to C{not self[x,y].hasMoveBlocker()}, but doesn't examine
+        the tile's contents.
+        """
+        return not self.moveBlockers[y*self.cols + x]
+
+    def connectivityIndex(self):
+        """
+        Returns the L{pathfind.ConnectivityIndex} labeling the connected
+        regions of passable tiles in this map, creating it if necessary. It
+        is kept up to date automatically as move blockers come and go.
+        """
+        if not self.connectivity:
+            self.connectivity = pathfind.ConnectivityIndex(self.cols,
+                    self.rows, self.moveBlockers)
+        return self.connectivity
+
+    def isReachable(self, start, goal):
+        """
+        Returns C{True} iff a path of passable tiles leads from C{start} to
+        C{goal} (the C{start} tile itself may hold a move blocker). This is
+        what L{getAStarPath} and L{getHPAPath} check before searching, so
+        that an unreachable goal fails immediately rather than after
+        exploring every reachable tile. The first call labels the whole map;
+        after that, calls take constant time.
+        """
+        if not (self.pointIsInBounds(start) and self.pointIsInBounds(goal)):
+            return False
+        return self.connectivityIndex().reachable(start, goal)
     
+    def clone(self, name=None):
+        """
+        Returns a scratch copy of this map for AI look-ahead, "what if"
+        previews and other speculative simulation, which can be changed
+        freely without affecting this one, and which this one can go on
+        changing without affecting. Cloning costs a copy of the compact
+        layers (L{moveBlockers}, L{losBlockers}, ...) and of the
+        L{connectivity} index, but no L{Tile}s: the clone shares every tile
+        with this map until one of them changes it (copy on write). Only
+        then does the clone get its own copy of the tile, with shallow
+        copies of its L{MapObject}s; when this map is the one changing it,
+        the copy is made first, so the clone keeps the tile as it was. Use
+        L{counterpart} to find the clone's copy of an object.
+
+        Reading a shared tile of the clone gives a view of this map's tile
+        rather than a L{Tile} (it's no C{isinstance} of one), through which
+        the L{Tile} methods that change it, and setting its attributes,
+        copy it first. The objects seen through it are this map's own, so
+        to change one, change its L{counterpart}. Changes to objects' own
+        attributes, other than through L{Tile} methods and L{MapObject}
+        properties, aren't noticed, and show through tiles still shared.
+
+        Shaders are shared with the original, and the clone has no monitors
+        or lazily built indexes (which would have to visit every tile).
+        """
+        c = Map2D.__new__(type(self))
+        c.__dict__.update(self.__dict__)
+        c.name = name or self.name
+        c.moveBlockers = self.moveBlockers[:]
+        c.losBlockers = self.losBlockers[:]
+        c.regionVersions = self.regionVersions[:]
+        c.journal = self.journal.copy()
+        c.clusterGraph = None
+        c.connectivity = self.connectivity and \
+                self.connectivity.copy(c.moveBlockers)
+        c.objectIndex = None
+        c.registry = None
+        c.regions = None
+        c.fields = dict([(name, field.copy(c.moveBlockers)) for name, field
+                         in self.fields.iteritems()])
+        c.distMonObjs = {}
+        c.dirtyDistMonObjs = {}
+        c.tilesWithDirtyLight = set()
+        c.tiles = [_CopyOnWriteRow(c, y) for y in xrange(self.rows)]
+        c.cloneSource = self
+        c.cloneVersion = self.version
+        c.counterparts = {}
+        c.clones = ()
+        self.clones = [ref for ref in self.clones if ref() is not None] + \
+                [weakref.ref(c)]
+        return c
+
+    def isStale(self, rect=None):
+        """
+        Returns C{True} iff this map is a L{clone} whose source has changed
+        since it was cloned (in a region overlapping C{rect}, if given): the
+        clone still shows the source as it was then, so clone again for an
+        up-to-date copy. Always C{False} for a map that isn't a clone.
+        """
+        source = self.cloneSource
+        if source is None or source.version == self.cloneVersion:
+            return False
+        if rect is None:
+            return True
+        return bool(source.changedRegions(self.cloneVersion, journal.ALL,
+                                          rect))
+
+    def _realTile(self, x, y):
+        # The Tile at (x,y): this map's own, or the one it shares with the
+        # map it's a clone of
+        tile = self.tiles[y][x]
+        if isinstance(tile, _SharedTile):
+            return self.cloneSource._realTile(x, y)
+        return tile
+
+    def _ownTile(self, x, y):
+        # Gives a clone its own copy of the tile at (x,y), if it hasn't
+        # got one yet, and returns it
+        row = self.tiles[y]
+        tile = row.tiles.get(x)
+        if tile is None:
+            source = self.cloneSource._realTile(x, y)
+            tile = row.tiles[x] = type(source)(self, (x, y))
+            self.counterparts.update(tile.copyContentsFrom(source))
+        return tile
+
+    def _beforeTileChange(self, tile):
+        """
+        Called by L{Tile} and L{MapObject} just before they change C{tile}
+        of this map, so that clones still sharing it copy it as it is. See
+        L{clone}.
+        """
+        if not self.clones:
+            return
+        live = []
+        x, y = tile.col, tile.row
+        for ref in self.clones:
+            c = ref()
+            if c is not None:
+                live.append(ref)
+                if x not in c.tiles[y].tiles:
+                    c._ownTile(x, y)
+        self.clones = live
+
+    def counterpart(self, obj):
+        """
+        Returns the copy, in this clone (see L{clone}), of the given
+        L{MapObject} of the original map, copying its tile if needed, or
+        C{None} if the object isn't on the original map.
+        """
+        if obj not in self.counterparts:
+            if obj.parentTile is None or \
+                    obj.parentTile.map is not self.cloneSource:
+                return None
+            self._ownTile(*obj.pos)
+        return self.counterparts.get(obj)
+
+    def view(self, rect):
+        """
+        Returns a L{MapView} of the given C{Rect} of this map (clipped to
+        it), through which it can be addressed in local coordinates without
+        copying anything.
+        """
+        return MapView(self, rect)
+
+    def regionIndex(self):
+        """
+        Returns the L{regions.RegionIndex} labeling the tiles of this map by
+        region, creating it if necessary. Its regions are those defined with
+        L{defineRegion} (e.g., the rooms laid by a
+        L{RoomsAndCorridorsGenerator}), plus the connected areas of passable
+        tiles outside them, which are kept up to date automatically as move
+        blockers come and go.
+        """
+        if self.regions is None:
+            self.regions = regions.RegionIndex(self.cols, self.rows,
+                    self.moveBlockers)
+        return self.regions
+
+    def defineRegion(self, cells, name=None, data=None):
+        """
+        Defines an explicit region of this map, such as a room. See
+        L{regions.RegionIndex.defineRegion}.
+
+        @param cells: A C{Rect} of tiles, or a sequence of C{(col,row)}
+        positions.
+        @return: The new L{regions.Region}.
+        """
+        return self.regionIndex().defineRegion(cells, name, data)
+
+    def regionAt(self, (x,y)):
+        """
+        Returns the L{regions.Region} containing the tile at C{(x,y)}, or
+        C{None} if the tile is impassable and in no explicit region. After
+        the first call, takes constant time; e.g., to wake everything in the
+        player's room::
+
+            for tile in map.regionTiles(map.regionAt(player.pos)):
+                for obj in tile:
+                    if isinstance(obj, Monster):
+                        obj.wake()
+        """
+        return self.regionIndex().regionAt(x, y)
+
+    def regionTiles(self, region):
+        """
+        Returns a list of the L{Tile}s in the given L{regions.Region}.
+        """
+        return [self.tiles[y][x] for x, y in
+                self.regionIndex().cellsOf(region)]
+
+    def fieldLayer(self, name, decay=0.9, diffusion=0.5):
+        """
+        Returns the L{fields.FieldLayer} called C{name}, first creating it
+        with the given C{decay} and C{diffusion} if there isn't one. The
+        field's values spread only through passable tiles, and follow changes
+        to L{moveBlockers}. For example, a scent that monsters track::
+
+            scent = map.fieldLayer('scent', decay=0.95)
+            scent.setSource(player.pos, 10.0)
+            map.stepFields()
+            for monster in monsters:
+                step = scent.ascend(monster.pos)
+        """
+        field = self.fields.get(name)
+        if field is None:
+            field = self.fields[name] = fields.FieldLayer(self.cols,
+                    self.rows, self.moveBlockers, decay, diffusion)
+        return field
+
+    def removeFieldLayer(self, name):
+        """
+        Removes the L{fields.FieldLayer} called C{name}.
+        """
+        del self.fields[name]
+
+    def stepFields(self, turns=1):
+        """
+        Advances every field layer (see L{fieldLayer}) by the given number of
+        turns. Call it once per game turn.
+        """
+        for field in self.fields.itervalues():
+            field.step(turns)
+
+    def spatialIndex(self):
+        """
+        Returns the L{spatial.SpatialIndex} of the L{MapObject}s in this map,
+        filing each under its class (and base classes) and its C{tags}. The
+        first call indexes the whole map; after that the index is kept up to
+        date as objects are added and removed.
+        """
+        if self.objectIndex is None:
+            index = spatial.SpatialIndex()
+            for y in xrange(self.rows):
+                for x in xrange(self.cols):
+                    for obj in self.tiles[y][x]:
+                        index.add(obj, (x,y))
+            self.objectIndex = index
+        return self.objectIndex
+
+    def objectRegistry(self, columns=None):
+        """
+        Returns the L{registry.ObjectRegistry} of the L{MapObject}s in this
+        map, which keeps a dense table of the objects of each class and tag,
+        with columns of their hot attributes, so that per-turn systems can
+        visit just the objects they care about::
+
+            for monster in map.objectRegistry().members(Monster):
+                monster.act()
+
+        The first call registers every object in the map (with the given
+        column specifications, if any; see L{registry.ObjectRegistry}); after
+        that the registry is kept up to date automatically.
+        """
+        if self.registry is None:
+            reg = registry.ObjectRegistry(columns=columns)
+            for y in xrange(self.rows):
+                for x in xrange(self.cols):
+                    for obj in self.tiles[y][x]:
+                        reg.add(obj)
+            self.registry = reg
+        return self.registry
+
+    def objectsOfKind(self, key=MapObject):
+        """
+        Returns a list of the L{MapObject}s in this map that are instances of
+        class C{key}, or have C{key} among their C{tags}, without looking at
+        any L{Tile}s. See L{objectRegistry}.
+        """
+        return self.objectRegistry().members(key)
+
+    def objectsInRect(self, rect, key=MapObject):
+        """
+        Returns a list of the L{MapObject}s in the given C{Rect} of tiles
+        that are instances of class C{key}, or have C{key} among their
+        C{tags}. Only tiles near such objects are looked at; see
+        L{spatialIndex}.
+        """
+        return self.spatialIndex().inRect(key, rect)
+
+    def objectsInRadius(self, pos, radius, key=MapObject):
+        """
+        Returns a list of the L{MapObject}s within distance C{radius} (as
+        measured by L{dist}) of C{pos} that are instances of class C{key}, or
+        have C{key} among their C{tags}; e.g., for an area effect::
+
+            for monster in map.objectsInRadius(blast.pos, 3, Monster):
+                monster.hurt(10)
+        """
+        return self.spatialIndex().inRadius(key, pos, radius)
+
+    def nearestObjects(self, pos, key=MapObject, k=1, maxDist=None):
+        """
+        Returns a list of the (up to) C{k} L{MapObject}s nearest to C{pos}
+        that are instances of class C{key}, or have C{key} among their
+        C{tags}, nearest first, optionally ignoring any farther away than
+        C{maxDist}.
+        """
+        return self.spatialIndex().nearest(key, pos, k, maxDist)
+
     def applyGenerator(self, generator, rect=None):
         """
         Applies a map generator to the given region of this map, or to the
@@ -794,6 +1648,22 @@ class Map2D(object):
         """
         generator.apply(self, rect)
 
+    def generate(self, steps):
+        """
+        Applies a sequence of C{(generator, rect)} steps (C{rect} may be
+        C{None} for the whole map) to a L{GenerationGrid} the size of this
+        map, then materializes the result into this map in one pass. Later
+        steps may overwrite earlier ones without the overwritten objects ever
+        being added to a L{Tile}, or, for L{MapObjectGenerator}s, even made.
+
+        @return: The L{GenerationGrid}.
+        """
+        grid = GenerationGrid((self.cols, self.rows))
+        for generator, rect in steps:
+            generator.apply(grid, rect)
+        grid.materialize(self)
+        return grid
+
     def setAmbientLight(self, rgb, intensity):
         for x in range(self.cols):
             for y in range(self.rows):
@@ -810,11 +1680,9 @@ class Map2D(object):
             return
 
         time = parole.time()
+        cols, losBlockers = self.cols, self.losBlockers
         def defaultIsBlocked(x, y):
-            for obj in self[x,y]:
-                if obj.blocksLOS:
-                    return True
-            return False
+            return losBlockers[y*cols + x]
 
         fov.fieldOfView(pos[0], pos[1], self.cols, self.rows, radius,
                 visitFunc, isBlocked or defaultIsBlocked, quadrants=quadrants)
@@ -947,13 +1815,55 @@ class Map2D(object):
         """
         Tests whether a Bresenham ray can be cast from one tile to another.
         C{p1} and C{p2} can either be the C{Tile} objects (in this C{Map2D})
-        themselves, or C{(col,row)}-tuples.
+        themselves, or C{(col,row)}-tuples. Gives the same result as tracing
+        the ray with L{traceLOS}, but only looks at L{losBlockers}.
         """
-        if isinstance(p2, Tile):
-            destT = p2
-        else:
-            destT = self[p2]
-        return self.traceLOS(p1, p2, None) is destT
+        return self.testLOSMany(p1, [p2])[0]
+
+    def __losPosition(self, p):
+        if isinstance(p, Tile):
+            if p.map is not self:
+                raise ValueError('Tiles not in this Map2D instance.')
+            return (p.col, p.row)
+        if not self.pointIsInBounds(p):
+            raise ValueError('Position %r not in this Map2D instance.' % \
+                    (p,))
+        return tuple(p)
+
+    def testLOSMany(self, origin, targets):
+        """
+        Tests line of sight from one tile to each of many, as if by calling
+        L{testLOS} on each, in a single call; e.g., to find which of a list
+        of monsters the player can see::
+
+            visible = [m for m, v in zip(monsters,
+                       map.testLOSMany(player.pos, [m.pos for m in monsters]))
+                       if v]
+
+        The rays toward the targets are traced through a tree of their
+        shared prefixes (see L{los.RayTree}), so each tile between the
+        origin and the targets is examined at most once, and only
+        L{losBlockers} is consulted.
+
+        @param origin: A L{Tile} or C{(col,row)}-tuple.
+        @param targets: A sequence of L{Tile}s or C{(col,row)}-tuples.
+        @return: A list of booleans, one per target.
+        """
+        return los.testLOSFrom(self.cols, self.rows, self.losBlockers,
+                self.__losPosition(origin),
+                [self.__losPosition(t) for t in targets])
+
+    def testLOSPairs(self, pairs):
+        """
+        Like L{testLOSMany}, but for a sequence of C{(origin, target)}
+        pairs, each member of which is a L{Tile} or C{(col,row)}-tuple.
+        Pairs with the same origin share their work.
+
+        @return: A list of booleans, one per pair.
+        """
+        pos = self.__losPosition
+        return los.testLOSPairs(self.cols, self.rows, self.losBlockers,
+                [(pos(o), pos(t)) for o, t in pairs])
 
     def defaultAStarHeuristicDistance(self, pos1, pos2):
         """
@@ -968,10 +1878,11 @@ class Map2D(object):
         Default function for determining the actual distance/cost/penalty
         of the sequence C{pos1 -> pos2} for two neighboring C{(col,row)}-tuples
         in a path, for use with L{getAStarPath}. If the L{Tile} at C{pos2}
-        contains a move blocker (L{Tile.hasMoveBlocker}), returns C{sys.maxint};
-        otherwise returns the Euclidean distance between C{pos1} and C{pos2}.
+        contains a move blocker (according to L{moveBlockers}), returns
+        C{sys.maxint}; otherwise returns the Euclidean distance between C{pos1}
+        and C{pos2}.
         """
-        if self[pos2].hasMoveBlocker():
+        if self.moveBlockers[pos2[1]*self.cols + pos2[0]]:
             return sys.maxint
         return self.dist(pos1, pos2) 
 
@@ -983,13 +1894,53 @@ class Map2D(object):
             return [current_node]
 
     def getAStarPath(self, start, goal, heurDist=None, neighborDist=None,
-            neighborFunc=None):
+            neighborFunc=None, jump=False, maxExpansions=None, maxTime=None,
+            bidirectional=False):
         """
         Constructs and returns a list of C{(col,row)}-tuples describing the
         shortest path from the given C{start} position to the given C{goal}
         position according to the A* heuristic shortest path algorithm. If no
         path is possible, raises L{NoAStarPathError}.
-        """
+
+        If C{jump} is true and neither C{neighborDist} nor C{neighborFunc} is
+        given (i.e., movement is 8-connected and uniform-cost), the path is
+        found by Jump Point Search over L{moveBlockers} instead (see
+        L{pathfind.jumpPointSearch}), which gives an equally short path while
+        expanding far fewer nodes on open ground. C{heurDist} is ignored in
+        that case. With a custom C{neighborDist} or C{neighborFunc}, C{jump}
+        has no effect.
+
+        Unless a custom C{neighborDist} or C{neighborFunc} is given, the goal
+        is first checked with L{isReachable}, and L{NoAStarPathError} is
+        raised at once if it can't be reached.
+
+        If C{maxExpansions} or C{maxTime} (in milliseconds) is given, the
+        search gives up after expanding that many nodes or after that much
+        time has passed, and returns the best partial path found so far: one
+        leading to the explored position that looks closest to the goal (so
+        check whether the last position is C{goal}). If C{bidirectional} is
+        true, the search proceeds from both ends at once (see
+        L{pathfind.BidirectionalPathSearch}), which assumes that
+        C{neighborFunc} and C{neighborDist} describe the same moves in both
+        directions. In any of these cases C{jump} is ignored. See
+        L{pathSearch} for a search that can be continued later.
+        """
+        if not (neighborDist or neighborFunc):
+            if not self.isReachable(start, goal):
+                raise NoAStarPathError()
+        if maxExpansions is not None or maxTime is not None or bidirectional:
+            search = self.pathSearch(start, goal, heurDist, neighborDist,
+                    neighborFunc, bidirectional)
+            search.step(maxExpansions, maxTime)
+            path = search.bestPath()
+            if path is None:
+                raise NoAStarPathError()
+            return path
+        if not (neighborDist or neighborFunc):
+            if jump:
+                return pathfind.jumpPointSearch(self.cols, self.rows,
+                        self.moveBlockers, start, goal)
+
         # default parameters
         heurDist = heurDist or self.defaultAStarHeuristicDistance
         neighborDist = neighborDist or self.defaultAStarNeighborDistance
@@ -1046,95 +1997,402 @@ class Map2D(object):
                     f_score[y] = g_score[y] + h_score[y]
 
         raise NoAStarPathError()
+
+    def pathSearch(self, start, goal, heurDist=None, neighborDist=None,
+            neighborFunc=None, bidirectional=False):
+        """
+        Returns a L{pathfind.PathSearch} (or, if C{bidirectional} is true, a
+        L{pathfind.BidirectionalPathSearch}) from C{start} to C{goal}, set up
+        with the same meaning of the remaining arguments as in
+        L{getAStarPath}. The search hasn't begun; advance it with its C{step}
+        method, e.g. for a couple of milliseconds each frame, until C{step}
+        returns C{True}, and then take the path from its C{bestPath} method::
+
+            search = map.pathSearch(monster.pos, player.pos)
+            ...
+            # each frame:
+            if search.step(maxTime=2):
+                path = search.bestPath() # None if there is no path
+
+        The search reads the map as it is when each step is taken, so it is
+        best not to leave one unfinished across many changes to the map.
+        """
+        heurDist = heurDist or pathfind.octile
+        if neighborDist or neighborFunc:
+            neighborDist = neighborDist or self.defaultAStarNeighborDistance
+            neighborFunc = neighborFunc or self.neighborsOf
+            def successors(x):
+                for y in neighborFunc(x):
+                    if self.pointIsInBounds(y):
+                        cost = neighborDist(x, y)
+                        if cost < sys.maxint:
+                            yield y, cost
+            def predecessors(y):
+                for x in neighborFunc(y):
+                    if self.pointIsInBounds(x):
+                        cost = neighborDist(x, y)
+                        if cost < sys.maxint:
+                            yield x, cost
+        else:
+            successors = pathfind.gridSuccessors(self.cols, self.rows,
+                    self.moveBlockers)
+            predecessors = pathfind.gridPredecessors(self.cols, self.rows,
+                    self.moveBlockers, start)
+        if bidirectional:
+            return pathfind.BidirectionalPathSearch(start, goal, successors,
+                    predecessors, heurDist)
+        return pathfind.PathSearch(start, goal, successors, heurDist)
+
+    def hierarchicalGraph(self, clusterSize=16):
+        """
+        Returns the L{pathfind.ClusterGraph} used by L{getHPAPath}, creating
+        it (or recreating it, if C{clusterSize} differs from the current
+        graph's) as necessary. The graph is kept up to date incrementally as
+        move blockers come and go; call its C{prepare} method ahead of time
+        (e.g. while a level loads) to have even the first query be fast.
+        """
+        if not self.clusterGraph or \
+                self.clusterGraph.clusterSize != clusterSize:
+            self.clusterGraph = pathfind.ClusterGraph(self.cols, self.rows,
+                    self.moveBlockers, clusterSize)
+        return self.clusterGraph
+
+    def getHPAPath(self, start, goal, clusterSize=16):
+        """
+        Like L{getAStarPath}, but searches an abstract graph of
+        C{clusterSize}-square clusters of the map (see L{hierarchicalGraph})
+        and then refines the result into a list of C{(col,row)}-tuples, so
+        that long paths across large maps are found quickly. A tile is
+        passable iff it contains no move blocker (the start tile excepted),
+        and steps cost their Euclidean length, as with the default
+        L{getAStarPath} parameters. The path found may be slightly longer than
+        the shortest one. If no path is possible (see L{isReachable}), raises
+        L{NoAStarPathError}.
+        """
+        if not self.isReachable(start, goal):
+            raise NoAStarPathError()
+        path = self.hierarchicalGraph(clusterSize).findPath(start, goal)
+        if path is None:
+            raise NoAStarPathError()
+        return path
  
 #==============================================================================
 
-class LightSource(object):
-    minIntensity = 0.03
+class LayerView(object):
+    """
+    A read-only window onto a rectangle of one of a L{Map2D}'s flat,
+    row-major layers (such as L{Map2D.moveBlockers}), indexed as if it were
+    a flat layer of just that rectangle: element C{y*cols + x} is the value
+    at local position C{(x,y)}. Nothing is copied, so it can be handed to
+    the functions of L{pathfind} or L{los} directly; L{row} and L{toArray}
+    give fast bulk access.
+    """
 
-    def __init__(self, rgb, intensity, fallOff=1.0, blockTest=None):
-        self.rgb = rgb
-        self.intensity = intensity
-        self.radius = 0
-        self.distIntensities = {}
-        self.fallOff = fallOff
-        self.appliedTiles = {}
-        self.pos = None
-        self.blockTest = blockTest or objectBlocksLOS
-        self.calcRadius()
+    def __init__(self, layer, mapCols, (x0, y0, cols, rows)):
+        self.layer = layer
+        self.mapCols = mapCols
+        self.x0, self.y0, self.cols, self.rows = x0, y0, cols, rows
 
-    def copy(self):
-        return LightSource(self.rgb, self.intensity, self.fallOff)
+    def __len__(self):
+        return self.cols*self.rows
 
-    def calcRadius(self):
-        self.radius = int(math.sqrt(abs(self.intensity / (self.fallOff * \
-            self.minIntensity))))
-        #parole.debug('LightSource: intensity = %, fallOff = %s, radius = %s',
-        #        self.intensity, self.fallOff, self.radius)
+    def __getitem__(self, i):
+        cols = self.cols
+        if i < 0:
+            i += cols*self.rows
+        if not 0 <= i < cols*self.rows:
+            raise IndexError('LayerView index out of range')
+        return self.layer[(self.y0 + i//cols)*self.mapCols + self.x0 + \
+                i%cols]
 
-    def setRGB(self, rgb):
-        for pos, intensity in self.appliedTiles.iteritems():
-            t = map[pos]
-            t.removeLight(self.rgb, intensity)
-            t.addLight(rgb, intensity)
-        self.rgb = rgb
+    def row(self, y):
+        """
+        Returns a copy of local row C{y} of the layer, as a slice of the
+        underlying C{array}.
+        """
+        i = (self.y0 + y)*self.mapCols + self.x0
+        return self.layer[i:i+self.cols]
 
-    def setIntensity(self, intensity):
+    def toArray(self):
         """
-        Be sure to remove before changing intensity!
+        Returns a compact copy of the whole window, one row slice at a time.
         """
-        self.intensity = intensity
-        self.calcRadius()
-        self.distIntensities = {}
+        if not self.rows:
+            return self.layer[0:0]
+        rows = [self.row(y) for y in xrange(self.rows)]
+        compact = rows[0]
+        for r in rows[1:]:
+            compact.extend(r)
+        return compact
 
-    def apply(self, map, pos):
-        time = parole.time()
-        def visit(x, y):
-            t = map[x,y]
-            if pos == (x,y):
-                if pos not in self.appliedTiles:
-                    self.appliedTiles[pos] = 0.0
-                self.appliedTiles[pos] += self.intensity
-                t.addLight(self.rgb, self.intensity)
-                #t.applyLight()
-                return
+class MapView(object):
+    """
+    A rectangular window onto a L{Map2D}, addressed in local coordinates:
+    C{view[0,0]} is the L{Tile} at the view's top-left corner. Nothing is
+    copied, and the tiles are the map's own (so they keep their map
+    coordinates in C{col} and C{row}). Views support enough of the
+    L{Map2D} interface -- indexing, iteration, C{rect()}, L{add} and
+    L{remove}, field of view, line of sight and path-finding -- that
+    generators and other routines written against a whole map can be run on
+    just part of one::
+
+        generator.apply(map.view(Rect(10, 10, 20, 20)))
+
+    Everything is confined to the view: paths never leave it, and field of
+    view stops at its edges.
+
+    @ivar map: The underlying L{Map2D}.
+    @ivar x0: The map column of the view's left edge.
+    @ivar y0: The map row of the view's top edge.
+    """
 
-            dist = map.dist(pos, (x,y))
-            if dist not in self.distIntensities:
-                intensity = self.intensity / (self.fallOff * (dist)**2)
-                self.distIntensities[dist] = intensity
-            intensity = self.distIntensities[dist]
+    def __init__(self, map, rect):
+        """
+        @param map: The L{Map2D} (or L{MapView}, in which case C{rect} is in
+        its local coordinates) to view.
+        @param rect: The rectangle of tiles to view; clipped to C{map}.
+        """
+        rect = Rect(rect).clip(map.rect())
+        if not rect.w or not rect.h:
+            raise ValueError('MapView must have nonzero dimensions.')
+        if isinstance(map, MapView):
+            rect.move_ip(map.x0, map.y0)
+            map = map.map
+        self.map = map
+        self.x0, self.y0 = rect.x, rect.y
+        self.cols, self.rows = rect.w, rect.h
 
-            if (x,y) not in self.appliedTiles:
-                self.appliedTiles[(x,y)] = 0.0
-            self.appliedTiles[(x,y)] += intensity
-            t.addLight(self.rgb, intensity)
-            #t.applyLight()
+    def __repr__(self):
+        return 'MapView(%r, %r)' % (self.map, self.mapRect())
 
-        def tileBlocked(x,y):
-            t = map[x,y]
-            for obj in t:
-                if self.blockTest(obj):
-                    return True
-            return False
+    def __getitem__(self, (x,y)):
+        if not (0 <= x < self.cols and 0 <= y < self.rows):
+            raise IndexError('Position %r not in %r.' % ((x,y), self))
+        return self.map.tiles[self.y0 + y][self.x0 + x]
 
-        map.fieldOfView(pos, self.radius, visit, isBlocked=tileBlocked)
-        map.monitorNearby(map[pos], self.radius, self, self.blockTest)
-        self.pos = pos
-        #parole.debug('LightSource.apply: time = %sms', parole.time() - time)
+    tileAt = __getitem__
 
-    def remove(self, map):
-        time = parole.time()
-        if self.pos:
-            map.unmonitorNearby(map[self.pos])
-            self.pos = None
-        else:
-            parole.warn("Removing LightSource that wasn't previously added")
-        for pos, intensity in self.appliedTiles.iteritems():
-            t = map[pos]
-            t.removeLight(self.rgb, intensity)
-            #t.applyLight()
-        self.appliedTiles = {}
+    def __iter__(self):
+        return self.iterTiles()
+
+    def iterTiles(self, rect=None):
+        """
+        Like L{Map2D.iterTiles}, in local coordinates.
+        """
+        rect = rect and Rect(rect).clip(self.rect()) or self.rect()
+        tiles, x0, y0 = self.map.tiles, self.x0, self.y0
+        for x in xrange(rect.x, rect.x + rect.w):
+            for y in xrange(rect.y, rect.y + rect.h):
+                yield tiles[y0 + y][x0 + x]
+
+    def rect(self):
+        """
+        Returns a C{Rect} of this view's dimensions, at the origin.
+        """
+        return Rect(0, 0, self.cols, self.rows)
+
+    def mapRect(self):
+        """
+        Returns the C{Rect} of the underlying map covered by this view.
+        """
+        return Rect(self.x0, self.y0, self.cols, self.rows)
+
+    def view(self, rect):
+        """
+        Returns a L{MapView} of the given local rectangle of this view.
+        """
+        return MapView(self, rect)
+
+    def toMap(self, (x,y)):
+        """
+        Converts a local position to map coordinates.
+        """
+        return (x + self.x0, y + self.y0)
+
+    def toLocal(self, (x,y)):
+        """
+        Converts a map position to local coordinates.
+        """
+        return (x - self.x0, y - self.y0)
+
+    def pointIsInBounds(self, (x,y)):
+        return 0 <= x < self.cols and 0 <= y < self.rows
+
+    def dist(self, p1, p2):
+        return self.map.dist(p1, p2)
+
+    def add(self, pos, *objs):
+        """
+        Like L{Map2D.add}, in local coordinates.
+        """
+        tile = self[pos]
+        for obj in objs:
+            tile.add(obj)
+        return tile
+
+    def remove(self, pos, *objs):
+        """
+        Like L{Map2D.remove}, in local coordinates.
+        """
+        tile = self[pos]
+        for obj in objs:
+            tile.remove(obj)
+        return tile
+
+    def layer(self, name):
+        """
+        Returns a L{LayerView} of the named flat layer of the map (e.g.,
+        C{'moveBlockers'} or C{'losBlockers'}) covering this view.
+        """
+        return LayerView(getattr(self.map, name), self.map.cols,
+                (self.x0, self.y0, self.cols, self.rows))
+
+    def isPassable(self, (x,y)):
+        return self.map.isPassable(self.toMap((x,y)))
+
+    def defineRegion(self, cells, name=None, data=None):
+        """
+        Like L{Map2D.defineRegion}, in local coordinates.
+        """
+        if hasattr(cells, 'colliderect'):
+            cells = Rect(cells).clip(self.rect()).move(self.x0, self.y0)
+        else:
+            cells = [self.toMap(p) for p in cells if self.pointIsInBounds(p)]
+        return self.map.defineRegion(cells, name, data)
+
+    def fieldOfView(self, pos, radius, visitFunc, isBlocked=None,
+            quadrants=None):
+        """
+        Like L{Map2D.fieldOfView}, in local coordinates, and stopping at the
+        view's edges.
+        """
+        if isBlocked is None:
+            blocked = self.layer('losBlockers')
+            cols = self.cols
+            isBlocked = lambda x, y: blocked[y*cols + x]
+        fov.fieldOfView(pos[0], pos[1], self.cols, self.rows, radius,
+                visitFunc, isBlocked, quadrants=quadrants)
+
+    def testLOS(self, p1, p2):
+        """
+        Like L{Map2D.testLOS}, in local coordinates.
+        """
+        return self.testLOSMany(p1, [p2])[0]
+
+    def testLOSMany(self, origin, targets):
+        """
+        Like L{Map2D.testLOSMany}, in local coordinates. Rays between
+        positions in a rectangle never leave it.
+        """
+        return los.testLOSFrom(self.cols, self.rows,
+                self.layer('losBlockers'), origin, targets)
+
+    def getAStarPath(self, start, goal):
+        """
+        Returns the shortest path of passable tiles from C{start} to C{goal}
+        that stays within the view, in local coordinates, or raises
+        L{NoAStarPathError}. Costs and conventions are those of
+        L{Map2D.getAStarPath} with the default distance functions.
+        """
+        if not (self.pointIsInBounds(start) and self.pointIsInBounds(goal)):
+            raise NoAStarPathError()
+        x0, y0 = self.x0, self.y0
+        path = pathfind.gridAStar(self.map.cols, self.map.rows,
+                self.map.moveBlockers, (start[0]+x0, start[1]+y0),
+                (goal[0]+x0, goal[1]+y0),
+                (x0, y0, x0 + self.cols, y0 + self.rows))
+        if path is None:
+            raise NoAStarPathError()
+        return [(x - x0, y - y0) for x, y in path]
+
+#==============================================================================
+
+class LightSource(object):
+    minIntensity = 0.03
+
+    def __init__(self, rgb, intensity, fallOff=1.0, blockTest=None):
+        self.rgb = rgb
+        self.intensity = intensity
+        self.radius = 0
+        self.distIntensities = {}
+        self.fallOff = fallOff
+        self.appliedTiles = {}
+        self.pos = None
+        self.blockTest = blockTest or objectBlocksLOS
+        self.calcRadius()
+
+    def copy(self):
+        return LightSource(self.rgb, self.intensity, self.fallOff)
+
+    def calcRadius(self):
+        self.radius = int(math.sqrt(abs(self.intensity / (self.fallOff * \
+            self.minIntensity))))
+        #parole.debug('LightSource: intensity = %, fallOff = %s, radius = %s',
+        #        self.intensity, self.fallOff, self.radius)
+
+    def setRGB(self, rgb):
+        for pos, intensity in self.appliedTiles.iteritems():
+            t = map[pos]
+            t.removeLight(self.rgb, intensity)
+            t.addLight(rgb, intensity)
+        self.rgb = rgb
+
+    def setIntensity(self, intensity):
+        """
+        Be sure to remove before changing intensity!
+        """
+        self.intensity = intensity
+        self.calcRadius()
+        self.distIntensities = {}
+
+    def apply(self, map, pos):
+        time = parole.time()
+        def visit(x, y):
+            t = map[x,y]
+            if pos == (x,y):
+                if pos not in self.appliedTiles:
+                    self.appliedTiles[pos] = 0.0
+                self.appliedTiles[pos] += self.intensity
+                t.addLight(self.rgb, self.intensity)
+                #t.applyLight()
+                return
+
+            dist = map.dist(pos, (x,y))
+            if dist not in self.distIntensities:
+                intensity = self.intensity / (self.fallOff * (dist)**2)
+                self.distIntensities[dist] = intensity
+            intensity = self.distIntensities[dist]
+
+            if (x,y) not in self.appliedTiles:
+                self.appliedTiles[(x,y)] = 0.0
+            self.appliedTiles[(x,y)] += intensity
+            t.addLight(self.rgb, intensity)
+            #t.applyLight()
+
+        def tileBlocked(x,y):
+            t = map[x,y]
+            for obj in t:
+                if self.blockTest(obj):
+                    return True
+            return False
+
+        map.fieldOfView(pos, self.radius, visit, isBlocked=tileBlocked)
+        map.monitorNearby(map[pos], self.radius, self, self.blockTest)
+        self.pos = pos
+        #parole.debug('LightSource.apply: time = %sms', parole.time() - time)
+
+    def remove(self, map):
+        time = parole.time()
+        if self.pos:
+            map.unmonitorNearby(map[self.pos])
+            self.pos = None
+        else:
+            parole.warn("Removing LightSource that wasn't previously added")
+        for pos, intensity in self.appliedTiles.iteritems():
+            t = map[pos]
+            t.removeLight(self.rgb, intensity)
+            #t.applyLight()
+        self.appliedTiles = {}
         #parole.debug('LightSource.remove: time = %sms', parole.time() - time)
 
     def __call__(self, tile, objsPos):
@@ -1146,15 +2404,224 @@ class LightSource(object):
         self.remove(tile.map)
         self.apply(tile.map, (tile.col, tile.row))
 
+#==============================================================================
+
+class MapDelta(object):
+    """
+    The state of the tiles of a L{Map2D} that changed between two versions,
+    made by L{Map2D.saveDelta} and applied with L{Map2D.applyDelta}. Holds
+    deep copies of the tiles' L{MapObject}s, detached from the map, so
+    pickling a delta doesn't pickle the map.
+
+    @ivar size: The C{(cols, rows)} of the map.
+    @ivar fromVersion: The version the delta starts from.
+    @ivar toVersion: The map's version when the delta was made.
+    @ivar cells: A list of C{(x, y, objects, availLight, lightIntensity)}.
+    """
+
+    def __init__(self, size, fromVersion, toVersion, cells):
+        self.size = size
+        self.fromVersion = fromVersion
+        self.toVersion = toVersion
+        self.cells = cells
+
+    def __repr__(self):
+        return 'MapDelta(%r, %r, %r, <%d cells>)' % (self.size,
+                self.fromVersion, self.toVersion, len(self.cells))
+
+#==============================================================================
+
+def _tileLight(tile):
+    return tile.lightIntensity
+
+def _tileMoveCost(tile):
+    cost = 0
+    for obj in tile:
+        cost += obj.moveCost
+    return cost
+
+def _tileTypeId(tile):
+    obj = tile.highestObject
+    return obj and obj.typeId or 0
+
+class SharedMapSnapshot(object):
+    """
+    A copy of a L{Map2D}'s compact per-tile layers in shared memory, for
+    worker processes (path-finding, perception, simulation) that need to read
+    the world without having it pickled and sent to them. Each layer is a
+    flat, row-major C{sharedctypes.RawArray} with one element per tile, just
+    like L{Map2D.moveBlockers}; the default layers are:
+
+        - C{'moveBlockers'} (C{'H'}): L{Map2D.moveBlockers}.
+        - C{'losBlockers'} (C{'H'}): L{Map2D.losBlockers}.
+        - C{'light'} (C{'f'}): each tile's C{lightIntensity}.
+        - C{'moveCost'} (C{'f'}): the sum of the C{moveCost}s of its objects.
+        - C{'objectType'} (C{'l'}): the C{typeId} of its highest object.
+
+    Worker processes get the snapshot by inheritance, i.e. by passing it to
+    C{multiprocessing.Process} or as a C{Pool} initializer argument (it can't
+    be pickled any other way), after which they read the same memory the
+    main process writes: nothing is copied. Once a turn, the main process
+    calls L{publish}, which rewrites only the regions of the map that have
+    changed since the last publication (see L{Map2D.changedRegions}).
+
+    The snapshot begins with a header of C{long}s: a magic number, the
+    format version, the map's dimensions, a sequence number that is odd
+    while a publication is in progress, the L{Map2D.version} last published,
+    and the number of publications. Workers that may run concurrently with
+    L{publish} should read through L{read}, which retries until it sees a
+    consistent snapshot.
+    """
+
+    MAGIC = 0x50524c53
+    FORMAT = 1
+
+    # Header slots
+    H_MAGIC, H_FORMAT, H_COLS, H_ROWS, H_SEQUENCE, H_VERSION, \
+            H_PUBLICATIONS = range(7)
+
+    # (name, typecode, cellFunc): cellFunc(tile) gives a tile's value; if
+    # None, the layer is copied from the map attribute of the same name.
+    defaultLayers = [('moveBlockers', 'H', None),
+                     ('losBlockers', 'H', None),
+                     ('light', 'f', _tileLight),
+                     ('moveCost', 'f', _tileMoveCost),
+                     ('objectType', 'l', _tileTypeId)]
+
+    def __init__(self, map, layers=None):
+        """
+        Allocates the shared memory for a snapshot of C{map} and publishes
+        it in full.
+
+        @param map: The L{Map2D} to share.
+        @param layers: A list of C{(name, typecode, cellFunc)} layer
+        specifications to use instead of L{defaultLayers}. C{cellFunc} is
+        called with each L{Tile} to get its value, or, if C{None}, the layer
+        is copied from the flat C{array} attribute of C{map} named C{name}.
+        """
+        if sharedctypes is None:
+            raise RuntimeError('SharedMapSnapshot requires multiprocessing.')
+        self.cols, self.rows = map.cols, map.rows
+        if layers is None:
+            layers = self.defaultLayers
+        self.layerSpecs = list(layers)
+        self.header = sharedctypes.RawArray('l', 7)
+        self.header[self.H_MAGIC] = self.MAGIC
+        self.header[self.H_FORMAT] = self.FORMAT
+        self.header[self.H_COLS] = map.cols
+        self.header[self.H_ROWS] = map.rows
+        self.layers = {}
+        for name, typecode, cellFunc in self.layerSpecs:
+            self.layers[name] = sharedctypes.RawArray(typecode,
+                    map.cols*map.rows)
+        self.__mapId = None
+        self.__published = 0
+        self.publish(map)
+
+    def __repr__(self):
+        return 'SharedMapSnapshot(%sx%s, layers=%r, version=%r)' % \
+                (self.cols, self.rows, [l[0] for l in self.layerSpecs],
+                 self.version())
+
+    def publish(self, map, full=False):
+        """
+        Brings the snapshot up to date with C{map}, rewriting only the
+        regions changed since the last publication -- or everything, if
+        C{full} is true or C{map} isn't the map last published.
+
+        @return: The list of C{Rect}s (in tiles) that were rewritten.
+        """
+        if (map.cols, map.rows) != (self.cols, self.rows):
+            raise ValueError('Cannot publish a %sx%s map to a %sx%s '
+                             'snapshot.' % (map.cols, map.rows, self.cols,
+                             self.rows))
+        if full or self.__mapId != id(map) or map.version < self.__published:
+            rects = [map.rect()]
+        else:
+            rects = map.changedRegions(self.__published)
+            if not rects:
+                return rects
+
+        header = self.header
+        header[self.H_SEQUENCE] += 1
+        try:
+            for rect in rects:
+                self.__copyRect(map, rect)
+            header[self.H_VERSION] = map.version
+            header[self.H_PUBLICATIONS] += 1
+        finally:
+            header[self.H_SEQUENCE] += 1
+        self.__mapId = id(map)
+        self.__published = map.version
+        return rects
+
+    def __copyRect(self, map, rect):
+        cols, x0, x1 = self.cols, rect.x, rect.x + rect.w
+        for name, typecode, cellFunc in self.layerSpecs:
+            dest = self.layers[name]
+            if cellFunc is None:
+                src = getattr(map, name)
+                for y in xrange(rect.y, rect.y + rect.h):
+                    i = y*cols
+                    dest[i+x0:i+x1] = src[i+x0:i+x1]
+            else:
+                for y in xrange(rect.y, rect.y + rect.h):
+                    i = y*cols
+                    dest[i+x0:i+x1] = [cellFunc(t) for t in
+                                       map.tiles[y][x0:x1]]
+
+    def layer(self, name):
+        """
+        Returns the shared array for the named layer.
+        """
+        return self.layers[name]
+
+    def version(self):
+        """
+        Returns the L{Map2D.version} most recently published.
+        """
+        return self.header[self.H_VERSION]
+
+    def validate(self):
+        """
+        Raises C{ValueError} unless the header identifies this as a snapshot
+        in the current format with the expected dimensions. Workers may call
+        this after attaching.
+        """
+        h = self.header
+        if h[self.H_MAGIC] != self.MAGIC or h[self.H_FORMAT] != self.FORMAT:
+            raise ValueError('Not a format %s SharedMapSnapshot.' % \
+                    self.FORMAT)
+        if (h[self.H_COLS], h[self.H_ROWS]) != (self.cols, self.rows):
+            raise ValueError('SharedMapSnapshot header has wrong dimensions.')
+
+    def read(self, func, *args):
+        """
+        Returns C{func(self, *args)}, calling it again as often as necessary
+        until no publication has happened during the call, so that what
+        C{func} reads from the layers is consistent.
+        """
+        header = self.header
+        while True:
+            sequence = header[self.H_SEQUENCE]
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            result = func(self, *args)
+            if header[self.H_SEQUENCE] == sequence:
+                return result
+
 #==============================================================================
 #{ Displaying 2D maps
 
 class MapFrame(shader.Frame):
     """
     A L{Frame} for displaying a view of a L{Map2D}. Provides a scrollable grid of
-    shaders for displaying the tiles of the map. The tile size must be known
-    in advance, when the C{MapFrame} is created, and must agree with the actual
-    size of the shaders offered by the tiles of the map.
+    shaders for displaying the tiles of the map (a L{shader.GridView}, which
+    only draws and updates the tiles in or near the view, however large the
+    map). The tile size must be known in advance, when the C{MapFrame} is
+    created, and must agree with the actual size of the shaders offered by the
+    tiles of the map.
     """
 
     defaultAnnoteLineRGB = (255, 255, 0)
@@ -1171,10 +2638,9 @@ class MapFrame(shader.Frame):
         """
         super(MapFrame, self).__init__(borders, size=size, name=name)
         # private attributes
-        self.__grid = None
+        self.__view = None
         self.__map = None
         self.__tileSize = tileSize or AsciiTile.characterSize()
-        self.__scroll = None
         self.__lastScrollOffset = None
         self.fovObj = None
         self.fovRad = None
@@ -1214,11 +2680,6 @@ class MapFrame(shader.Frame):
         invokes self.resetGrid(), dirtying the Frame so that it is ready to be
         rendered on the next update. Pass None to stop displaying anything.
         """
-        if self.__map and self.__grid:
-            for tile in self.__map:
-                if tile in self.__grid.passes:
-                    self.__grid.remPass(tile)
-                self.__grid[tile.col, tile.row] = None
         if not map:
             self.bindVisibilityToFOV(None, None)
         self.__map = map
@@ -1242,20 +2703,16 @@ class MapFrame(shader.Frame):
         MapFrame is rendering, and you want to reset it. Has no effect if the
         current map is not set.
         """
-        if self.__scroll in self.passes:
-            if self.__grid:
-                self.__scroll.remPass(self.__grid)
-            self.remPass(self.__scroll)
-
-        if self.__grid:
-            self.__grid.clearPasses()
+        if self.__view:
+            self.__view.clearCells()
+            if self.__view in self.passes:
+                self.remPass(self.__view)
 
         if not self.__map:
             return
 
-        self.__grid = shader.ShaderGrid((self.__map.cols, self.__map.rows),
-                self.tileSize)
-        self.__scroll = shader.ScrollView(self.size)
+        self.__view = shader.GridView(self.size, (self.__map.cols,
+            self.__map.rows), self.tileSize)
         self.__lastScrollOffset = None
         
         for x in range(self.__map.cols):
@@ -1263,26 +2720,24 @@ class MapFrame(shader.Frame):
                 tile = self.__map[x,y]
                 tile.size = self.tileSize
                 tile.overlayShader().size = self.tileSize
-                tile.touch()
-                self.__grid[x,y] = tile
+                self.__view[x,y] = tile
 
-        self.__scroll.addPass(self.__grid, pos=(0,0))
-        self.addPass(self.__scroll, pos=(0,0))
+        self.addPass(self.__view, pos=(0,0))
         self.__annotationsAt = {}
 
     def scrollPixels(self, dx, dy):
         """
         Translates the view of the map by the given displacement in pixels.
         """
-        if self.__scroll:
-            self.__scroll.scrollPixels(dx, dy)
+        if self.__view:
+            self.__view.scrollPixels(dx, dy)
 
     def scrollTiles(self, dx, dy):
         """
         Translates the view of the map by the given displacement in tiles.
         """
-        if self.__scroll:
-            self.__scroll.scrollPixels(dx*self.__tileSize[0],
+        if self.__view:
+            self.__view.scrollPixels(dx*self.__tileSize[0],
                                      dy*self.__tileSize[1])
 
     def pixelPosToTile(self, posOrX, y=None):
@@ -1309,7 +2764,7 @@ class MapFrame(shader.Frame):
         the given tile location.
         """
         col, row = type(posOrCol) is tuple and posOrCol or (posOrCol, row)
-        self.__scroll.offset = self.tilePosToPixel(col,row)
+        self.__view.offset = self.tilePosToPixel(col,row)
 
     def centerAtTile(self, posOrCol, row=None):
         """
@@ -1320,26 +2775,26 @@ class MapFrame(shader.Frame):
         tw, th = self.tileSize
         cx, cy = cx + tw/2, cy + th/2
         vx, vy = (cx-self.width/2, cy-self.height/2)
-        if vx + self.width > self.__grid.width:
-            vx = self.__grid.width - self.width
-        if vy + self.height > self.__grid.height:
-            vy = self.__grid.height - self.height
-        self.__scroll.offset = (vx, vy)
+        mapWidth, mapHeight = self.__view.contentsSize()
+        if vx + self.width > mapWidth:
+            vx = mapWidth - self.width
+        if vy + self.height > mapHeight:
+            vy = mapHeight - self.height
+        self.__view.offset = (vx, vy)
 
     def viewRectPixels(self):
         """
         Returns the rectangle of map pixels currently contained in the Frame's
         view. 
         """
-        return self.__scroll.visibleRect()
+        return self.__view.visibleRect()
 
     def viewRectTiles(self):
         """
         Returns the (ceiling of the) rectangle of map tiles currently
         contained in the Frame's view.  
-        TODO: viewRectTiles()
         """
-        pass
+        return self.__view.visibleCells()
 
     def bindVisibilityToFOV(self, obj, radius, remember=True,
             inFOVCallback=None, leaveFOVCallback=None, fovCondition=None):
@@ -1388,14 +2843,14 @@ class MapFrame(shader.Frame):
             for x in xrange(self.__map.cols):
                 for y in xrange(self.__map.rows):
                     #self.__grid.disable(x, y)
-                    self.__grid[x,y] = self.__map[x,y].overlayShader()
+                    self.__view[x,y] = self.__map[x,y].overlayShader()
 
     def __enableAll(self):
         if self.__map:
             for x in xrange(self.__map.cols):
                 for y in xrange(self.__map.rows):
                     #self.__grid.enable(x, y)
-                    self.__grid[x,y] = self.__map[x,y]
+                    self.__view[x,y] = self.__map[x,y]
 
     def __blocksLOS(self, obj):
         #parole.debug('checking if blocks los')
@@ -1427,11 +2882,11 @@ class MapFrame(shader.Frame):
             t = parole.time()
             self.__updateFOV()
             parole.debug('update fov time = %sms', parole.time()-t)
-        if self.__scroll and self.__annotationsAt and \
-                self.__scroll.offset != self.__lastScrollOffset:
+        if self.__view and self.__annotationsAt and \
+                self.__view.offset != self.__lastScrollOffset:
             self.__updateAnnotations()
-        if self.__scroll:
-            self.__lastScrollOffset = self.__scroll.offset
+        if self.__view:
+            self.__lastScrollOffset = self.__view.offset
         super(MapFrame, self).update(*args, **kwargs)
 
     def __updateFOV(self):
@@ -1442,7 +2897,7 @@ class MapFrame(shader.Frame):
             if self.fovCondition and not self.fovCondition(tile):
                 return
             if (x,y) not in self.visibleTiles:
-                self.__grid[x,y] = tile
+                self.__view[x,y] = tile
                 if self.__rememberSeenTiles:
                     self.rememberedTiles.add((x,y))
             newVisibleTiles.add((x,y))
@@ -1457,11 +2912,11 @@ class MapFrame(shader.Frame):
         for (x,y) in formerlyVisibleTiles:
             if self.__rememberSeenTiles:
                 self.__map[x,y].clearFrozenShader()
-                self.__grid[x,y] = self.__map[x,y].frozenShader()
+                self.__view[x,y] = self.__map[x,y].frozenShader()
             else:
                 # but what about overlays?
                 #self.__grid.disable(x, y)
-                self.__grid[x,y] = self.__map[x,y].overlayShader()
+                self.__view[x,y] = self.__map[x,y].overlayShader()
 
         self.visibleTiles = newVisibleTiles
         self.__dirtyFovQuads.clear()
@@ -1611,8 +3066,8 @@ class MapFrame(shader.Frame):
             self.__annotationsAt[tile] = []
 
         # Now figure out where to display the annotation...
-        visibleRect = self.__scroll.visibleRect()
-        tileRect = self.__grid.rectOf((tile.col, tile.row))
+        visibleRect = self.__view.visibleRect()
+        tileRect = self.__view.rectOf((tile.col, tile.row))
         if visibleRect.contains(tileRect):
             # tile is on screen; find a free cardinal direction around the
             # tile to place the annotation at
@@ -1669,9 +3124,9 @@ class MapFrame(shader.Frame):
         if not self.inFOV(tile):
             if self.__rememberSeenTiles and self.remembered(tile):
                 tile.clearFrozenShader()
-                self.__grid[tile.col,tile.row] = tile.frozenShader()
+                self.__view[tile.col,tile.row] = tile.frozenShader()
             else:
-                self.__grid[tile.col,tile.row] = tile.overlayShader()
+                self.__view[tile.col,tile.row] = tile.overlayShader()
 
     def __placeAnnotation(self, tile, ann, rect):
         # Prepare the annotations list for this tile if necessary
@@ -1680,7 +3135,7 @@ class MapFrame(shader.Frame):
 
         # Since we add the annotation to our own passes (rather than to the
         # scroll or grid), we need to account for the scroll offset
-        ox, oy = self.__scroll.offset
+        ox, oy = self.__view.offset
         annRect = rect.move(-ox, -oy)
 
         # place the annotation
@@ -1697,12 +3152,12 @@ class MapFrame(shader.Frame):
             if self.__rememberSeenTiles and self.remembered(tile):
                 # make sure the reticle appears on unseen but remembered tiles
                 tile.clearFrozenShader()
-                self.__grid[tile.col,tile.row] = tile.frozenShader()
+                self.__view[tile.col,tile.row] = tile.frozenShader()
             else:
-                self.__grid[tile.col,tile.row] = tile.overlayShader()
+                self.__view[tile.col,tile.row] = tile.overlayShader()
 
         # and a line linking the annotation to the tile 
-        tileRect = self.__grid.rectOf((tile.col, tile.row)).move(-ox, -oy)
+        tileRect = self.__view.rectOf((tile.col, tile.row)).move(-ox, -oy)
         # annote above tile
         if annRect.bottom < tileRect.top:
             lineTileY = tileRect.top
@@ -1747,7 +3202,7 @@ class MapFrame(shader.Frame):
 
     def __updateAnnotations(self):
         parole.debug('annotations: %r', self.__annotationsAt)
-        visibleRect = self.__scroll.visibleRect()
+        visibleRect = self.__view.visibleRect()
         for tile, anns in self.__annotationsAt.iteritems():
             for ann in anns:
                 self.removeAnnotation(ann)
@@ -1760,7 +3215,7 @@ class MapFrame(shader.Frame):
         dist = 10.0
         diagComp = int(math.sqrt((dist**2)/2))
         dist = int(dist)
-        tileRect = self.__grid.rectOf((tile.col, tile.row))
+        tileRect = self.__view.rectOf((tile.col, tile.row))
         annoteRect = Rect((0,0), shaderSize)
 
         annoteRect.bottomright = tileRect.topleft
@@ -1979,15 +3434,54 @@ class Generator(object):
     """
     A base clase for objects that generate content for, or apply changes to, a
     portion of a L{Map2D}. Various generators can be applied one after
-    another to different, possibly overlapping regions of a map. 
+    another to different, possibly overlapping regions of a map. A generator
+    can also be applied to a L{MapView}, which confines it to the view and
+    lets it work in the view's local coordinates, or to a L{GenerationGrid},
+    which records what it would do for L{Map2D.generate} to carry out later.
+
+    Generators draw their random numbers from L{rng}, a C{random.Random} (or
+    anything with the same methods) given with L{setRNG}; by default, the
+    C{random} module itself. Giving a generator an RNG seeded the same way
+    makes it generate the same content every time (as long as any callbacks
+    it's given are deterministic too; see L{GenerationCache}).
+
+    @ivar rng: The generator's source of random numbers, or C{None} for the
+    C{random} module. Use L{getRNG} to draw from it.
     """
-    def __init__(self, name, clearFirst=False):
+
+    rng = None
+
+    def __init__(self, name, clearFirst=False, rng=None):
         self.name = name
         self.clearFirst = clearFirst
+        self.rng = rng
 
     def __repr__(self):
         return "Generator(%s)" % (repr(self.name),)
 
+    def getRNG(self):
+        """
+        Returns L{rng}, or the C{random} module if it's C{None}.
+        """
+        return self.rng or random
+
+    def setRNG(self, rng):
+        """
+        Sets L{rng} for this generator and, recursively, for those it uses
+        (see L{subGenerators}), so that they all draw from one stream.
+        """
+        self.rng = rng
+        for generator in self.subGenerators():
+            generator.setRNG(rng)
+
+    def subGenerators(self):
+        """
+        Returns a list of the generators this one applies in turn (e.g., a
+        L{CellularAutomataGenerator}'s conditions). Subclasses that use other
+        generators override this.
+        """
+        return []
+
     def apply(self, map, rect=None):
         """
         Subclasses override this to apply the generator to the given region
@@ -1995,6 +3489,1044 @@ class Generator(object):
         """
         pass
 
+    def applyCells(self, map, cells):
+        """
+        Applies the generator to each of the given C{(x,y)} cells of the
+        map, as if to a 1x1 rectangle at each. Generators that place content
+        cell by cell override this to skip making the rectangles; it's how
+        L{CellularAutomataGenerator} hands all the cells meeting a condition
+        to a generator at once.
+        """
+        for x, y in cells:
+            self.apply(map, pygame.Rect((x,y), (1,1)))
+
+def _generatorsIn(thing):
+    # The Generators in thing, which may be one, or a list, tuple or
+    # dictionary (by key) of them, nested, in a fixed order.
+    if isinstance(thing, Generator):
+        return [thing]
+    if isinstance(thing, dict):
+        thing = [v for k, v in sorted(thing.iteritems())]
+    if isinstance(thing, (list, tuple)):
+        found = []
+        for t in thing:
+            found.extend(_generatorsIn(t))
+        return found
+    return []
+
+def _generatorTree(generators):
+    # The given generators and every one they use, recursively, each once,
+    # in a fixed order.
+    tree, seen = [], set()
+    stack = list(reversed(generators))
+    while stack:
+        generator = stack.pop()
+        if id(generator) in seen:
+            continue
+        seen.add(id(generator))
+        tree.append(generator)
+        stack.extend(reversed(generator.subGenerators()))
+    return tree
+
+#==============================================================================
+
+class _GridCell(object):
+    # What GenerationGrid.__getitem__ returns, so that generators written
+    # for Map2Ds can add objects to and clear a cell of a GenerationGrid.
+    __slots__ = ('grid', 'col', 'row')
+
+    def __init__(self, grid, col, row):
+        self.grid, self.col, self.row = grid, col, row
+
+    def add(self, obj):
+        self.grid.place(self.col, self.row, self.grid.OBJECT, obj)
+        return self
+
+    def clear(self):
+        self.grid.clear(self.col, self.row)
+
+class GenerationGrid(object):
+    """
+    A compact stand-in for a L{Map2D} that generators can be applied to
+    instead, so that a stack of generators, each overwriting parts of the
+    last one's work, pays for L{Tile} updates (shaders, light, monitors,
+    indexes) only for what survives. L{materialize} then creates the
+    L{MapObject}s and adds them to a map in one pass, tile by tile::
+
+        grid = GenerationGrid((map.cols, map.rows))
+        grassGenerator.apply(grid)
+        roadGenerator.apply(grid, roadRect)     # clears what's under it
+        grid.materialize(map)
+
+    Each cell holds a stack of small integer ids, one per object to come,
+    in C{array} planes (the first id of every cell in the first plane, and
+    so on); the planes hold 16-bit ids until the palette outgrows them, and
+    32-bit ones after. An id stands for an entry of the grid's palette: a factory
+    called with no arguments (what L{MapObjectGenerator} records, so the
+    objects it would have made and that get cleared are never made at all),
+    a factory called with the tile at materialization time
+    (L{MapObjectAtGenerator}), or a L{MapObject} already made (anything
+    that adds objects through C{grid[x,y].add}). Factories of generators
+    with C{clearFirst} are recorded as clearing kinds: as when the
+    generator is applied directly, the tile is cleared (of what it held and
+    of the objects made for the cell so far) only if the factory does
+    return a L{MapObject}.
+
+    Generators that only add objects to tiles and clear them work on a grid;
+    those that inspect tile contents (e.g., L{RoomsAndCorridorsGenerator})
+    need a real map.
+
+    A grid may cover just part of a map, starting at C{origin}: it is then
+    addressed in map coordinates, and generators applied to it are confined
+    to its L{rect}, as with a L{MapView}. See L{ChunkedGeneration}.
+    """
+
+    # Kinds of palette entries
+    FACTORY, FACTORY_AT, OBJECT, CLEARING_FACTORY, CLEARING_FACTORY_AT = \
+            range(5)
+
+    def __init__(self, (cols, rows), origin=(0, 0)):
+        if cols < 1 or rows < 1:
+            raise ValueError('GenerationGrid must have nonzero dimensions.')
+        self.cols, self.rows = cols, rows
+        self.origin = tuple(origin)
+        self.planes = []
+        self.depth = array.array('B', [0]) * (cols*rows)
+        self.cleared = array.array('B', [0]) * (cols*rows)
+        self.palette = [None]   # id -> (kind, thing); id 0 is unused
+        self.typecode = 'H'     # of the planes; 'I' once ids pass 0xffff
+        self.__ids = {}         # (kind, factory or id(object)) -> id
+
+    def __repr__(self):
+        return 'GenerationGrid((%r,%r), origin=%r)' % (self.cols, self.rows,
+                self.origin)
+
+    def __getitem__(self, (x,y)):
+        return _GridCell(self, x, y)
+
+    def rect(self):
+        """
+        Returns a pygame C{Rect} of the part of the map the grid covers.
+        """
+        return pygame.Rect(self.origin, (self.cols, self.rows))
+
+    def pointIsInBounds(self, (x, y)):
+        ox, oy = self.origin
+        return 0 <= x - ox < self.cols and 0 <= y - oy < self.rows
+
+    def paletteId(self, kind, thing):
+        """
+        Returns the id standing for the given palette entry, adding it if
+        needed. Factories and objects are given one id each, however many
+        cells they're placed in. Once there are more ids than fit in 16 bits,
+        the planes are widened to 32.
+        """
+        key = self.__key(kind, thing)
+        i = self.__ids.get(key)
+        if i is None:
+            i = len(self.palette)
+            if i > 0xffff and self.typecode == 'H':
+                self.__widen()
+            elif i > 0xffffffffL:
+                raise ValueError('%r has too many palette entries.' % self)
+            self.palette.append((kind, thing))
+            self.__ids[key] = i
+        return i
+
+    def __key(self, kind, thing):
+        # Objects are told apart by identity, as they needn't be hashable.
+        if kind == self.OBJECT:
+            return (kind, id(thing))
+        return (kind, thing)
+
+    def __setstate__(self, state):
+        # Object ids don't survive pickling (e.g., to and from the workers of
+        # a ChunkedGeneration), so the palette index is rebuilt.
+        self.__dict__.update(state)
+        self.__ids = {}
+        for i in xrange(1, len(self.palette)):
+            self.__ids[self.__key(*self.palette[i])] = i
+
+    def __widen(self):
+        self.typecode = 'I'
+        planes = self.planes
+        for d in xrange(len(planes)):
+            planes[d] = array.array('I', planes[d])
+
+    def __newPlane(self):
+        return array.array(self.typecode, [0]) * (self.cols*self.rows)
+
+    def compact(self):
+        """
+        Drops the palette entries no cell refers to any more (e.g., objects
+        whose cells were cleared), renumbering the rest, and narrows the
+        planes back to 16 bits if they now fit. Ids obtained earlier from
+        L{paletteId} are no longer valid afterwards.
+        """
+        depth, planes = self.depth, self.planes
+        used = set()
+        for d, plane in enumerate(planes):
+            used.update([plane[i] for i in xrange(len(plane)) if depth[i] > d])
+        used.discard(0)
+        ids = [0] * len(self.palette)
+        palette, self.palette, self.__ids = self.palette, [None], {}
+        self.typecode = 'H'
+        for old in sorted(used):
+            kind, thing = palette[old]
+            self.palette.append((kind, thing))
+            ids[old] = self.__ids[self.__key(kind, thing)] = \
+                    len(self.palette) - 1
+        if len(self.palette) > 0x10000:
+            self.typecode = 'I'
+        for d in xrange(len(planes)):
+            planes[d] = array.array(self.typecode, [ids[j] for j in
+                                                     planes[d]])
+
+    def place(self, x, y, kind, thing):
+        """
+        Pushes the palette entry C{(kind, thing)} onto cell C{(x,y)}.
+        """
+        self.placeCells([(x, y)], kind, thing)
+
+    def placeCells(self, cells, kind, thing, clearFirst=False):
+        """
+        Pushes the palette entry C{(kind, thing)} onto each of the given
+        C{(x,y)} cells, first clearing each if C{clearFirst}. A factory
+        given C{clearFirst} is recorded as the corresponding clearing kind
+        instead, as whether it clears depends on what it returns.
+        """
+        if clearFirst and kind in (self.FACTORY, self.FACTORY_AT):
+            kind = kind == self.FACTORY and self.CLEARING_FACTORY or \
+                    self.CLEARING_FACTORY_AT
+            clearFirst = False
+        id = self.paletteId(kind, thing)
+        cols, planes, depth = self.cols, self.planes, self.depth
+        ox, oy = self.origin
+        for x, y in cells:
+            i = (y - oy)*cols + x - ox
+            if clearFirst:
+                depth[i] = 0
+                self.cleared[i] = 1
+            d = depth[i]
+            if d == len(planes):
+                planes.append(self.__newPlane())
+            planes[d][i] = id
+            depth[i] = d + 1
+
+    def clear(self, x, y):
+        """
+        Empties cell C{(x,y)}; when materialized, the tile there will be
+        cleared too.
+        """
+        i = (y - self.origin[1])*self.cols + x - self.origin[0]
+        self.depth[i] = 0
+        self.cleared[i] = 1
+
+    def idsAt(self, x, y):
+        """
+        Returns a list of the ids stacked in cell C{(x,y)}, bottom first.
+        """
+        i = (y - self.origin[1])*self.cols + x - self.origin[0]
+        return [self.planes[d][i] for d in xrange(self.depth[i])]
+
+    def paste(self, other):
+        """
+        Copies the cells of the grid C{other} (e.g., a chunk built
+        separately) into this one, at C{other}'s origin, replacing what was
+        there. Both grids' palettes must hold the same factories, not just
+        equal ones, for ids to be shared; objects are carried over as they
+        are.
+        """
+        ids = [0] + [self.paletteId(kind, thing) for kind, thing in
+                     other.palette[1:]]
+        cols, planes, depth, cleared = self.cols, self.planes, self.depth, \
+                self.cleared
+        dx = other.origin[0] - self.origin[0]
+        dy = other.origin[1] - self.origin[1]
+        for y in xrange(other.rows):
+            if not 0 <= y + dy < self.rows:
+                continue
+            for x in xrange(other.cols):
+                if not 0 <= x + dx < cols:
+                    continue
+                j = y*other.cols + x
+                i = (y + dy)*cols + x + dx
+                n = other.depth[j]
+                while len(planes) < n:
+                    planes.append(self.__newPlane())
+                for d in xrange(n):
+                    planes[d][i] = ids[other.planes[d][j]]
+                depth[i] = n
+                cleared[i] = other.cleared[j]
+
+    def materialize(self, map, (x0, y0)=(0, 0)):
+        """
+        Creates the objects of every cell and adds them to the tile of
+        C{map} at the cell's position (in map coordinates) offset by
+        C{(x0, y0)}, with L{Tile.addMany}. Tiles of cleared cells are cleared
+        first, and tiles where a clearing factory returns an object are
+        cleared before it's added.
+        """
+        x0 += self.origin[0]
+        y0 += self.origin[1]
+        cols, planes, depth, cleared = self.cols, self.planes, self.depth, \
+                self.cleared
+        palette = self.palette
+        OBJECT, CLEARING_FACTORY = self.OBJECT, self.CLEARING_FACTORY
+        makers = (self.FACTORY, CLEARING_FACTORY)
+        clearing = (CLEARING_FACTORY, self.CLEARING_FACTORY_AT)
+        for y in xrange(self.rows):
+            for x in xrange(cols):
+                i = y*cols + x
+                n = depth[i]
+                if not n and not cleared[i]:
+                    continue
+                tile = map[x0 + x, y0 + y]
+                if cleared[i]:
+                    tile.clear()
+                objs = []
+                for d in xrange(n):
+                    kind, thing = palette[planes[d][i]]
+                    if kind in makers:
+                        obj = thing()
+                    elif kind == OBJECT:
+                        obj = thing
+                    else:
+                        obj = thing(tile)
+                    if obj and isinstance(obj, MapObject):
+                        if kind in clearing:
+                            tile.clear()
+                            objs = []
+                        objs.append(obj)
+                if objs:
+                    tile.addMany(objs)
+
+#==============================================================================
+
+def _buildChunk(builder, (x, y, w, h), seed):
+    # Runs in the workers (or in-process): builds one chunk of a
+    # ChunkedGeneration, with the random module, and the RNG of every
+    # generator of the steps, seeded for the chunk.
+    if callable(builder):
+        tree = []
+    else:
+        tree = _generatorTree([generator for generator, r in builder])
+    rngs = [generator.rng for generator in tree]
+    rng = random.Random(seed)
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        for generator in tree:
+            generator.rng = rng
+        grid = GenerationGrid((w, h), (x, y))
+        if callable(builder):
+            builder(grid, grid.rect())
+        else:
+            for generator, rect in builder:
+                generator.apply(grid, rect)
+    finally:
+        random.setstate(state)
+        for generator, oldRNG in zip(tree, rngs):
+            generator.rng = oldRNG
+    grid.compact()
+    return grid
+
+class ChunkedGeneration(object):
+    """
+    Generates a large area in square chunks, each built into its own
+    L{GenerationGrid} in a pool of worker processes, then pastes the chunks
+    together and materializes them in the main process, so that generating
+    a large world scales with the number of cores::
+
+        gen = ChunkedGeneration([(grassGenerator, None),
+                                 (forestGenerator, None)], seed=1234)
+        gen.generate(map)
+
+    Before a chunk is built, the C{random} module and the L{Generator.rng}
+    of every generator of the steps are seeded from C{seed} and the chunk's
+    position, and the C{random} module is seeded the same way again while
+    L{generate} materializes the chunk (which is when the factories of
+    L{MapObjectGenerator}s run), so each chunk comes out the same whichever
+    worker builds it, and in whatever order. The objects themselves are
+    made in the main process: the workers only decide where they go. Generators see a chunk as a grid
+    covering just that part of the map, in map coordinates; ones that look
+    at their surroundings (e.g., L{CellularAutomataGenerator}) may show
+    seams at chunk edges, while L{PerlinGenerator} without callbacks joins
+    up seamlessly.
+
+    The builder and the chunks it makes are pickled to and from the
+    workers, so the generators' factories must be picklable (module-level
+    functions or class instances, not lambdas). With C{processes=0} (or
+    where C{multiprocessing} is unavailable), chunks are built in-process.
+    """
+
+    def __init__(self, builder, chunkSize=64, seed=0, processes=None):
+        """
+        @param builder: Either a sequence of C{(generator, rect)} steps (as
+        for L{Map2D.generate}; C{rect} may be C{None}) applied to each chunk,
+        or a callable C{builder(grid, rect)} that fills in the chunk's
+        L{GenerationGrid}, whose C{Rect} is C{rect}.
+        @param chunkSize: The width and height of a chunk, in tiles.
+        @param processes: The number of worker processes; C{None} means one
+        per CPU.
+        """
+        if multiprocessing is None:
+            processes = 0
+        elif processes is None:
+            processes = multiprocessing.cpu_count()
+        self.builder = builder
+        self.chunkSize = chunkSize
+        self.seed = seed
+        self.processes = processes
+        self.__pool = None
+        self.__pending = None   # (rect, [AsyncResult or GenerationGrid])
+
+    def __repr__(self):
+        return 'ChunkedGeneration(..., chunkSize=%r, seed=%r)' % \
+                (self.chunkSize, self.seed)
+
+    def __getstate__(self):
+        raise TypeError('ChunkedGeneration instances cannot be pickled.')
+
+    def chunks(self, rect):
+        """
+        Returns a list of the C{(x, y, w, h)} chunks covering C{rect}.
+        Chunks are aligned to multiples of C{chunkSize} in map coordinates,
+        so a tile always belongs to the same chunk.
+        """
+        cs = self.chunkSize
+        chunks = []
+        for cy in xrange(rect.top // cs, (rect.bottom - 1) // cs + 1):
+            for cx in xrange(rect.left // cs, (rect.right - 1) // cs + 1):
+                r = pygame.Rect(cx*cs, cy*cs, cs, cs).clip(rect)
+                chunks.append((r.x, r.y, r.w, r.h))
+        return chunks
+
+    def chunkSeed(self, (x, y, w, h)):
+        """
+        Returns the seed for the C{random} module when building the chunk at
+        C{(x,y)}.
+        """
+        return hash((self.seed, x // self.chunkSize, y // self.chunkSize))
+
+    def dispatch(self, rect):
+        """
+        Starts building the chunks covering C{rect}, discarding any build
+        already in progress.
+        """
+        rect = pygame.Rect(rect)
+        results = []
+        for chunk in self.chunks(rect):
+            args = (self.builder, chunk, self.chunkSeed(chunk))
+            if not self.processes:
+                results.append(_buildChunk(*args))
+                continue
+            if not self.__pool:
+                self.__pool = multiprocessing.Pool(self.processes)
+            results.append(self.__pool.apply_async(_buildChunk, args))
+        self.__pending = (rect, results)
+
+    def collectChunks(self, wait=False):
+        """
+        Returns a list of the L{GenerationGrid}s of the dispatched chunks,
+        once all of them are built; until then, returns C{None}, unless
+        C{wait} is true, in which case it waits.
+        """
+        if self.__pending is None:
+            raise ValueError('ChunkedGeneration has nothing dispatched.')
+        rect, results = self.__pending
+        if not wait:
+            for r in results:
+                if not isinstance(r, GenerationGrid) and not r.ready():
+                    return None
+        self.__pending = None
+        return [isinstance(r, GenerationGrid) and r or r.get()
+                for r in results]
+
+    def collect(self, wait=False):
+        """
+        Returns the L{GenerationGrid} covering the dispatched rect, with
+        every chunk pasted in, once all of them are built; until then,
+        returns C{None}, unless C{wait} is true, in which case it waits.
+        Materializing it draws on the C{random} module as it is; see
+        L{materialize} to do so chunk by chunk, as seeded.
+        """
+        if self.__pending is None:
+            raise ValueError('ChunkedGeneration has nothing dispatched.')
+        rect = self.__pending[0]
+        chunks = self.collectChunks(wait)
+        if chunks is None:
+            return None
+        return self.__paste(rect, chunks)
+
+    def __paste(self, rect, chunks):
+        grid = GenerationGrid(rect.size, rect.topleft)
+        for chunk in chunks:
+            grid.paste(chunk)
+        return grid
+
+    def build(self, rect):
+        """
+        Builds the chunks covering C{rect}, waiting for them, and returns
+        the L{GenerationGrid} (see L{collect}).
+        """
+        self.dispatch(rect)
+        return self.collect(wait=True)
+
+    def materialize(self, map, chunks):
+        """
+        Materializes the chunk grids C{chunks} (from L{collectChunks}) into
+        C{map}, one at a time, with the C{random} module seeded for each
+        chunk, so that the objects made come out the same every time.
+        """
+        state = random.getstate()
+        try:
+            for chunk in chunks:
+                random.seed(self.chunkSeed(tuple(chunk.rect())))
+                chunk.materialize(map)
+        finally:
+            random.setstate(state)
+
+    def generate(self, map, rect=None):
+        """
+        Builds the chunks covering C{rect} (by default the whole map) and
+        materializes them into C{map}, chunk by chunk (see L{materialize}).
+
+        @return: The L{GenerationGrid}, with every chunk pasted in.
+        """
+        rect = pygame.Rect(rect or map.rect())
+        self.dispatch(rect)
+        chunks = self.collectChunks(wait=True)
+        self.materialize(map, chunks)
+        return self.__paste(rect, chunks)
+
+    def close(self):
+        """
+        Shuts down the worker processes. A build in progress is lost.
+        """
+        if self.__pool:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+        self.__pending = None
+
+#==============================================================================
+
+def _buildLevel(build, key, params, seed):
+    # Runs in the workers (or in-process): builds one level for a
+    # LevelPregenerator, with the random module seeded if asked.
+    state = random.getstate()
+    if seed is not None:
+        random.seed(seed)
+    try:
+        return build(key, params)
+    finally:
+        random.setstate(state)
+
+class LevelPregenerator(object):
+    """
+    Builds levels ahead of time in a background worker process, so that
+    moving to the next level doesn't freeze the game while it's generated.
+    While the player is on level N, call L{prepare} for the levels they
+    might go to next; when they take the stairs, L{take} hands over the
+    level, waiting only if it isn't finished yet::
+
+        pregen = LevelPregenerator(buildDungeonLevel)
+        pregen.prepare(depth + 1, params)
+        ...
+        # on the stairs:
+        level = pregen.takeMap(depth + 1, params)
+
+    The build function is called as C{build(key, params)} and may return a
+    L{Map2D}, or, cheaper to send back from the worker, a L{GenerationGrid}
+    (see L{Map2D.generate}) for L{takeMap} to materialize. It and its
+    result are pickled to and from the worker, so it must be a module-level
+    function (or picklable object) and mustn't touch the display.
+
+    A level is identified by its key (e.g., a depth); preparing a key again
+    with different params or seed cancels the build in progress. Since a
+    build can't be stopped inside a worker, cancelling one that hasn't
+    finished restarts the workers, and the other unfinished builds start
+    over; a superseded build never holds up the one replacing it. With
+    C{processes=0} (or where
+    C{multiprocessing} is unavailable), levels are built in-process, by
+    L{take}.
+    """
+
+    def __init__(self, build, processes=1):
+        """
+        @param build: The level building function; see above.
+        @param processes: The number of worker processes.
+        """
+        if multiprocessing is None:
+            processes = 0
+        self.build = build
+        self.processes = processes
+        self.__pool = None
+        self.__jobs = {}    # key -> (params, seed, AsyncResult or None)
+
+    def __repr__(self):
+        return 'LevelPregenerator(%r, processes=%r)' % (self.build,
+                self.processes)
+
+    def __getstate__(self):
+        raise TypeError('LevelPregenerator instances cannot be pickled.')
+
+    def prepare(self, key, params=None, seed=None):
+        """
+        Starts building the level C{key} with the given C{params} in the
+        background, unless it's already being built with them. If C{seed}
+        is given, the C{random} module is seeded with it first, so the same
+        level comes out every time.
+        """
+        job = self.__jobs.get(key)
+        if job is not None and job[:2] == (params, seed):
+            return
+        self.cancel(key)
+        self.__jobs[key] = (params, seed, self.__submit(key, params, seed))
+
+    def __submit(self, key, params, seed):
+        # Queues a build in the workers, or returns None to build in take
+        if not self.processes:
+            return None
+        if not self.__pool:
+            self.__pool = multiprocessing.Pool(self.processes)
+        return self.__pool.apply_async(_buildLevel,
+                (self.build, key, params, seed))
+
+    def __unfinished(self, job):
+        return job is not None and job[2] is not None and not job[2].ready()
+
+    def cancel(self, key=None):
+        """
+        Cancels the build of level C{key}, or of every level if C{key} is
+        C{None}. If a cancelled build hasn't finished, the workers are
+        stopped and restarted, and the other unfinished builds are queued
+        again from the start.
+        """
+        if key is None:
+            jobs = self.__jobs.values()
+            self.__jobs.clear()
+        else:
+            jobs = [self.__jobs.pop(key, None)]
+        if not [job for job in jobs if self.__unfinished(job)]:
+            return
+        self.__pool.terminate()
+        self.__pool.join()
+        self.__pool = None
+        for k, job in self.__jobs.items():
+            if self.__unfinished(job):
+                params, seed = job[:2]
+                self.__jobs[k] = (params, seed, self.__submit(k, params,
+                                                             seed))
+
+    def isPrepared(self, key, params=None, seed=None):
+        """
+        Returns C{True} iff level C{key} is being built with the given
+        C{params} and C{seed}.
+        """
+        job = self.__jobs.get(key)
+        return job is not None and job[:2] == (params, seed)
+
+    def ready(self, key):
+        """
+        Returns C{True} iff the build of level C{key} has finished, so that
+        L{take} won't wait.
+        """
+        job = self.__jobs.get(key)
+        return job is not None and job[2] is not None and job[2].ready()
+
+    def take(self, key, params=None, seed=None, wait=True):
+        """
+        Returns level C{key}, built with the given C{params} and C{seed}, and
+        forgets it. If it was prepared with them, its build is collected
+        (waiting for it to finish, or, unless C{wait} is true, returning
+        C{None} if it hasn't); otherwise it's built now, in-process.
+        """
+        job = self.__jobs.get(key)
+        if job is None or job[:2] != (params, seed) or job[2] is None:
+            self.__jobs.pop(key, None)
+            return _buildLevel(self.build, key, params, seed)
+        if not wait and not job[2].ready():
+            return None
+        del self.__jobs[key]
+        return job[2].get()
+
+    def takeMap(self, key, params=None, seed=None, name=None):
+        """
+        Like L{take}, but always returns a L{Map2D}: a L{GenerationGrid} is
+        materialized into a new map, called C{name} (or C{str(key)}).
+        """
+        level = self.take(key, params, seed)
+        if isinstance(level, GenerationGrid):
+            grid = level
+            level = Map2D(name or str(key), (grid.cols, grid.rows))
+            grid.materialize(level, (-grid.origin[0], -grid.origin[1]))
+        return level
+
+    def close(self):
+        """
+        Shuts down the worker processes. Builds in progress are lost.
+        """
+        if self.__pool:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+        self.__jobs.clear()
+
+#==============================================================================
+
+def _describe(thing, memo, path=()):
+    # A string describing thing the same way in every run of the game, for
+    # GenerationCache keys: plain values by repr, functions by their code,
+    # constants, defaults and closures, classes by name, and other objects
+    # by class and attributes. memo maps ids to finished descriptions;
+    # path holds the ids of the objects being described, to cut cycles.
+    if thing is None or isinstance(thing, (bool, int, long, float, complex,
+            str, unicode)):
+        return repr(thing)
+    if isinstance(thing, (type, types.ClassType)):
+        return 'class %s.%s' % (thing.__module__, thing.__name__)
+    if isinstance(thing, (types.ModuleType, types.BuiltinFunctionType,
+            random.Random)):
+        return '%s %s' % (type(thing).__name__, getattr(thing, '__name__',
+                ''))
+    if isinstance(thing, pygame.Rect):
+        return repr(thing)
+    i = id(thing)
+    if i in memo:
+        return memo[i]
+    if i in path:
+        return '...'
+    path += (i,)
+    if isinstance(thing, (list, tuple)):
+        desc = '%s(%s)' % (type(thing).__name__,
+                ', '.join([_describe(t, memo, path) for t in thing]))
+    elif isinstance(thing, (set, frozenset)):
+        desc = '%s(%s)' % (type(thing).__name__,
+                ', '.join(sorted([_describe(t, memo, path) for t in thing])))
+    elif isinstance(thing, dict):
+        desc = '{%s}' % ', '.join(sorted(['%s: %s' % (_describe(k, memo, path),
+                _describe(v, memo, path)) for k, v in thing.iteritems()]))
+    elif isinstance(thing, types.FunctionType):
+        desc = 'function %s.%s(%s, %s, %s)' % (thing.__module__,
+                thing.__name__, _describe(thing.func_code, memo, path),
+                _describe(thing.func_defaults, memo, path),
+                _describe([c.cell_contents for c in thing.func_closure or ()],
+                          memo, path))
+    elif isinstance(thing, types.CodeType):
+        desc = 'code(%s, %s, %s)' % (hashlib.sha1(thing.co_code).hexdigest(),
+                _describe(thing.co_consts, memo, path),
+                _describe(thing.co_names, memo, path))
+    elif isinstance(thing, types.MethodType):
+        owner = thing.im_self
+        if owner is None:
+            owner = thing.im_class
+        desc = 'method %s of %s' % (thing.__name__,
+                _describe(owner, memo, path))
+    else:
+        cls = type(thing)
+        desc = '%s.%s' % (cls.__module__, cls.__name__)
+        state = getattr(thing, '__dict__', None)
+        if state is not None:
+            desc += _describe(dict([(k, v) for k, v in state.iteritems()
+                                    if k != 'rng']), memo, path)
+    memo[i] = desc
+    return desc
+
+def _factoriesOf(generators):
+    # {description: factory} for the callables held by the generators (and
+    # those they use), which is where a GenerationGrid's factories come
+    # from.
+    factories = {}
+    memo = {}
+    def collect(thing):
+        if isinstance(thing, dict):
+            for k, v in sorted(thing.iteritems()):
+                collect(v)
+        elif isinstance(thing, (list, tuple)):
+            for t in thing:
+                collect(t)
+        elif callable(thing) and not isinstance(thing, Generator):
+            factories.setdefault(_describe(thing, memo), thing)
+    for generator in _generatorTree(generators):
+        collect(dict([(k, v) for k, v in generator.__dict__.iteritems()
+                      if k != 'rng']))
+    return factories
+
+class GenerationCache(object):
+    """
+    A bounded on-disk cache of generated content, so that generating the
+    same thing from the same seed again (revisiting a level, replaying a
+    daily challenge) is a fast load::
+
+        cache = GenerationCache()
+        cache.generate(map, [(caveGenerator, None),
+                             (mossGenerator, None)], seed=levelSeed)
+
+    Content is generated as for L{Map2D.generate}: a sequence of
+    C{(generator, rect)} steps applied to a L{GenerationGrid}, which is
+    what's stored, in compact form, in a file named by the key of the
+    steps, the seed and the rect generated. The key is computed from a
+    description of the generators: their classes and attributes, and the
+    code, constants and closures of the functions they're given. Globals
+    those functions use aren't followed, so if they change, give the cache
+    a new C{version}.
+
+    While the steps are applied, every generator among them (and those they
+    use) is given a C{random.Random(seed)} (see L{Generator.setRNG}), and
+    the C{random} module is seeded with C{seed} for the sake of callbacks
+    that use it; the grid is materialized with the C{random} module seeded
+    too. The previous RNGs and C{random} state are restored afterwards.
+
+    The cache's files are kept to C{maxBytes} in total, the least recently
+    used being removed first. Only generators that work on a
+    L{GenerationGrid} can be cached (not, e.g.,
+    L{RoomsAndCorridorsGenerator}), and objects they add directly, rather
+    than by factory, must be picklable; grids that can't be stored are just
+    not cached.
+
+    @ivar hits: The number of builds found in the cache.
+    @ivar misses: The number of builds that had to be generated.
+    """
+
+    suffix = '.grid'
+
+    def __init__(self, directory=None, maxBytes=64*1024*1024, version=0):
+        """
+        @param directory: Where to keep the cache's files; by default, the
+        C{gencache} directory of the gamedir.
+        @param maxBytes: The most disk space the files may take up.
+        @param version: Anything (picklable) to distinguish the cached
+        content from that of other versions of the game.
+        """
+        if directory is None:
+            directory = os.path.join(parole.conf.resource.gamedir,
+                                     'gencache')
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.version = version
+        self.hits = self.misses = 0
+
+    def __repr__(self):
+        return 'GenerationCache(%r, maxBytes=%r, version=%r)' % \
+                (self.directory, self.maxBytes, self.version)
+
+    def key(self, steps, seed, rect):
+        """
+        Returns the key (a hex string) under which generating C{rect} with
+        C{steps} from C{seed} is cached.
+        """
+        steps = [(generator, r and tuple(pygame.Rect(r)))
+                 for generator, r in steps]
+        desc = _describe((self.version, steps, seed,
+                          tuple(pygame.Rect(rect))), {})
+        return hashlib.sha1(desc).hexdigest()
+
+    def path(self, key):
+        """
+        Returns the path of the file for C{key}.
+        """
+        return os.path.join(self.directory, key + self.suffix)
+
+    def build(self, steps, seed, rect):
+        """
+        Returns the L{GenerationGrid} covering C{rect} made by applying
+        C{steps} from C{seed}: loaded from the cache if it's there,
+        otherwise generated and stored.
+        """
+        rect = pygame.Rect(rect)
+        key = self.key(steps, seed, rect)
+        grid = self.load(key, steps)
+        if grid is not None:
+            self.hits += 1
+            return grid
+        self.misses += 1
+
+        tree = _generatorTree([generator for generator, r in steps])
+        rngs = [generator.rng for generator in tree]
+        rng = random.Random(seed)
+        state = random.getstate()
+        random.seed(seed)
+        try:
+            for generator in tree:
+                generator.rng = rng
+            grid = GenerationGrid(rect.size, rect.topleft)
+            for generator, r in steps:
+                generator.apply(grid, r)
+        finally:
+            random.setstate(state)
+            for generator, oldRNG in zip(tree, rngs):
+                generator.rng = oldRNG
+        self.store(key, grid, steps)
+        return grid
+
+    def generate(self, map, steps, seed, rect=None):
+        """
+        Builds C{rect} (by default the whole map) with L{build} and
+        materializes it into C{map}.
+
+        @return: The L{GenerationGrid}.
+        """
+        grid = self.build(steps, seed, rect or map.rect())
+        state = random.getstate()
+        random.seed(seed)
+        try:
+            grid.materialize(map)
+        finally:
+            random.setstate(state)
+        return grid
+
+    def load(self, key, steps):
+        """
+        Returns the L{GenerationGrid} cached under C{key}, whose factories
+        are looked up among those of C{steps}' generators, or C{None} if
+        there isn't one (or it can't be used).
+        """
+        path = self.path(key)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                record = cPickle.loads(zlib.decompress(f.read()))
+            finally:
+                f.close()
+        except Exception, e:
+            parole.warn('Discarding bad generation cache entry %s: %s',
+                    path, e)
+            self.__remove(path)
+            return None
+        if record['key'] != key:
+            return None
+
+        factories = _factoriesOf([generator for generator, r in steps])
+        grid = GenerationGrid(record['size'], record['origin'])
+        ids = [0]
+        for kind, thing in record['palette']:
+            if kind != grid.OBJECT:
+                if thing not in factories:
+                    parole.debug('Generation cache entry %s has unknown '
+                            'factory %s', path, thing)
+                    return None
+                thing = factories[thing]
+            ids.append(grid.paletteId(kind, thing))
+        grid.depth = array.array('B', record['depth'])
+        grid.cleared = array.array('B', record['cleared'])
+        for plane in record['planes']:
+            plane = array.array(record.get('typecode', 'H'), plane)
+            if ids != range(len(ids)) or plane.typecode != grid.typecode:
+                plane = array.array(grid.typecode, [ids[id] for id in plane])
+            grid.planes.append(plane)
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return grid
+
+    def store(self, key, grid, steps):
+        """
+        Stores C{grid} under C{key}, if its factories are all among those
+        of C{steps}' generators and its objects can be pickled, then trims
+        the cache to C{maxBytes}.
+
+        @return: C{True} iff the grid was stored.
+        """
+        names = dict([(id(factory), desc) for desc, factory in
+                      _factoriesOf([generator for generator, r in
+                                    steps]).iteritems()])
+        palette = []
+        for kind, thing in grid.palette[1:]:
+            if kind != grid.OBJECT:
+                if id(thing) not in names:
+                    parole.debug('Not caching %r: unknown factory %r', grid,
+                            thing)
+                    return False
+                thing = names[id(thing)]
+            palette.append((kind, thing))
+        record = {'key': key, 'size': (grid.cols, grid.rows),
+                  'origin': grid.origin, 'palette': palette,
+                  'depth': grid.depth.tostring(),
+                  'cleared': grid.cleared.tostring(),
+                  'typecode': grid.typecode,
+                  'planes': [plane.tostring() for plane in grid.planes]}
+        try:
+            data = zlib.compress(cPickle.dumps(record, 2))
+        except (cPickle.PicklingError, TypeError), e:
+            parole.debug('Not caching %r: %s', grid, e)
+            return False
+
+        path = self.path(key)
+        tmpPath = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            f = open(tmpPath, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmpPath, path)
+        except (IOError, OSError), e:
+            parole.warn('Unable to write generation cache entry %s: %s',
+                    path, e)
+            self.__remove(tmpPath)
+            return False
+        self.trim()
+        return True
+
+    def entries(self):
+        """
+        Returns a list of C{(mtime, size, path)} for the cache's files, least
+        recently used first.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        return entries
+
+    def trim(self):
+        """
+        Removes the least recently used files until the rest fit in
+        C{maxBytes}.
+        """
+        entries = self.entries()
+        total = sum([size for mtime, size, path in entries])
+        for mtime, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            self.__remove(path)
+            total -= size
+
+    def clear(self):
+        """
+        Removes every file from the cache.
+        """
+        for mtime, size, path in self.entries():
+            self.__remove(path)
+
+    def __remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 #==============================================================================
 
 class MapObjectGenerator(Generator):
@@ -2013,6 +4545,11 @@ class MapObjectGenerator(Generator):
         rect = (rect or map.rect()).clip(map.rect())
         super(MapObjectGenerator, self).apply(map, rect)
 
+        if isinstance(map, GenerationGrid):
+            self.applyCells(map, [(x, y) for y in xrange(rect.y, rect.bottom)
+                                  for x in xrange(rect.x, rect.right)])
+            return
+
         for x in range(rect.x, rect.x + rect.w):
             for y in range(rect.y, rect.y + rect.h):
                 obj = self.makeObj()
@@ -2021,11 +4558,33 @@ class MapObjectGenerator(Generator):
                         map[x,y].clear()
                     map[x,y].add(obj)
 
+    def applyCells(self, map, cells):
+        if isinstance(map, GenerationGrid):
+            map.placeCells(cells, map.FACTORY, self.makeObj, self.clearFirst)
+            return
+        for x, y in cells:
+            obj = self.makeObj()
+            if obj and isinstance(obj, MapObject):
+                tile = map[x,y]
+                if self.clearFirst:
+                    tile.clear()
+                tile.add(obj)
+
 #==============================================================================
 
 class MapObjectAtGenerator(Generator):
     """
-    TODO
+    A C{Generator} that adds the return value of C{makeObjAt(tile)} to each
+    tile in the region it is applied to, if it's a L{MapObject}.
+
+    Applied to a L{GenerationGrid} (as by L{Map2D.generate}), the generator
+    only records C{makeObjAt}, which is called when the grid is
+    materialized. It then sees the tile as it is at that point: cleared if
+    any step cleared the cell, and otherwise holding what it held before
+    generation, but none of the objects generated for the cell, by this
+    step or any other. A C{makeObjAt} that inspects the tile's contents may
+    therefore decide differently than it would applied directly to a map;
+    such a generator should be applied to the map itself.
     """
     def __init__(self, name, makeObjAt, clearFirst=False):
         super(MapObjectAtGenerator, self).__init__(name, clearFirst)
@@ -2039,6 +4598,11 @@ class MapObjectAtGenerator(Generator):
         rect = (rect or map.rect()).clip(map.rect())
         super(MapObjectAtGenerator, self).apply(map, rect)
 
+        if isinstance(map, GenerationGrid):
+            self.applyCells(map, [(x, y) for y in xrange(rect.y, rect.bottom)
+                                  for x in xrange(rect.x, rect.right)])
+            return
+
         for x in range(rect.x, rect.x + rect.w):
             for y in range(rect.y, rect.y + rect.h):
                 obj = self.makeObjAt(map[x,y])
@@ -2047,19 +4611,80 @@ class MapObjectAtGenerator(Generator):
                         map[x,y].clear()
                     map[x,y].add(obj)
 
+    def applyCells(self, map, cells):
+        if isinstance(map, GenerationGrid):
+            # makeObjAt is called with the real tile when the grid is
+            # materialized
+            map.placeCells(cells, map.FACTORY_AT, self.makeObjAt,
+                           self.clearFirst)
+            return
+        for x, y in cells:
+            tile = map[x,y]
+            obj = self.makeObjAt(tile)
+            if obj and isinstance(obj, MapObject):
+                if self.clearFirst:
+                    tile.clear()
+                tile.add(obj)
+
 #==============================================================================
 
 class PerlinGenerator(Generator):
+    """
+    Applies C{makeObjAt(tile, noise)} to each tile of the region it's applied
+    to, adding the L{MapObject} returned, if any.
+
+    The noise can be sampled in one of two ways. If the callbacks C{pX},
+    C{pY} and C{pZ} are given, each tile's noise is L{perlin.noise} at the
+    coordinates they return for C{(tile, rect)}. Otherwise, the noise for the
+    whole region is computed at once by L{perlin.noiseGrid}, tile C{(x,y)}
+    of the map being sampled at C{(x*step, y*step, z)}, so that regions
+    applied separately join seamlessly; this is much faster for large maps,
+    and supports fractal octaves and seeds.
+    """
 
-    def __init__(self, name, makeObjAt, pX, pY, pZ, clearFirst=False):
+    def __init__(self, name, makeObjAt, pX=None, pY=None, pZ=None,
+            clearFirst=False, step=0.1, z=0.0, octaves=1, persistence=0.5,
+            lacunarity=2.0, ridged=False, seed=None):
+        """
+        The parameters after C{clearFirst} are only used when the callbacks
+        aren't given; see L{perlin.noiseGrid}. C{seed} selects the
+        permutation table (see L{perlin.permutation}).
+        """
         super(PerlinGenerator, self).__init__(name, clearFirst)
         self.makeObjAt = makeObjAt
         self.pX, self.pY, self.pZ = pX, pY, pZ
+        self.step, self.z = step, z
+        self.octaves = octaves
+        self.persistence, self.lacunarity = persistence, lacunarity
+        self.ridged = ridged
+        self.perm = perlin.permutation(seed)
+
+    def noiseGrid(self, rect):
+        """
+        Returns the noise for each tile of C{rect}, as a flat, row-major
+        C{array}, as sampled when the callbacks aren't given.
+        """
+        return perlin.noiseGrid((rect.x*self.step, rect.y*self.step),
+                (rect.w, rect.h), self.step, self.z, self.octaves,
+                self.persistence, self.lacunarity, self.ridged, self.perm)
 
     def apply(self, map, rect=None):
         rect = (rect or map.rect()).clip(map.rect())
         super(PerlinGenerator, self).apply(map, rect)
 
+        if self.pX is None:
+            noise = iter(self.noiseGrid(rect))
+            makeObjAt = self.makeObjAt
+            for y in range(rect.y, rect.y + rect.h):
+                for x in range(rect.x, rect.x + rect.w):
+                    t = map[x,y]
+                    obj = makeObjAt(t, noise.next())
+                    if obj and isinstance(obj, MapObject):
+                        if self.clearFirst:
+                            t.clear()
+                        t.add(obj)
+            return
+
         for x in range(rect.x, rect.x + rect.w):
             for y in range(rect.y, rect.y + rect.h):
                 t = map[x,y]
@@ -2106,6 +4731,65 @@ class TemplateGenerator(Generator):
     def __repr__(self):
         return "TemplateGenerator(%s, '...', ...)" % (repr(self.name),)
 
+    def subGenerators(self):
+        return _generatorsIn([self.backgroundGen, self.legend])
+
+    def compile(self):
+        """
+        Returns the compiled form of the template: C{((width, height),
+        symbols)}, where C{symbols} is a list of C{(char, offsets)} pairs, one
+        per distinct non-blank character in order of first appearance, and
+        C{offsets} lists the C{(dx, dy)} positions of that character in the
+        template. Compiled forms are cached by template text, so prefabs
+        shared between generators are compiled once.
+        """
+        key = tuple(self.templateRows)
+        compiled = _compiledTemplates.get(key)
+        if compiled is None:
+            symbols = []
+            offsets = {}
+            for dy, templateRow in enumerate(self.templateRows):
+                for dx, templateChar in enumerate(templateRow):
+                    if templateChar == ' ':
+                        continue
+                    if templateChar not in offsets:
+                        offsets[templateChar] = []
+                        symbols.append((templateChar, offsets[templateChar]))
+                    offsets[templateChar].append((dx, dy))
+            width = max([len(row) for row in self.templateRows] or [0])
+            compiled = _compiledTemplates[key] = \
+                    ((width, len(self.templateRows)), symbols)
+        return compiled
+
+    def stamp(self, map, origins, rect):
+        """
+        Applies the compiled template with its top left corner at each of
+        C{origins}, clipped to C{rect}, handing each generator all of its
+        cells, across every stamp, in one L{Generator.applyCells} call.
+        """
+        size, symbols = self.compile()
+        x0, y0, x1, y1 = rect.left, rect.top, rect.right, rect.bottom
+        for templateChar, offsets in symbols:
+            if templateChar not in self.legend:
+                parole.warn("Unknown template character %s.",
+                    repr(templateChar))
+                continue
+            generator = self.legend[templateChar]
+            if not generator:
+                continue
+            cells = [(ox + dx, oy + dy) for ox, oy in origins
+                     for dx, dy in offsets
+                     if x0 <= ox + dx < x1 and y0 <= oy + dy < y1]
+            if not cells:
+                continue
+            if type(generator) not in (tuple, list):
+                generator = [generator]
+            for g in generator:
+                if self.clearFirst:
+                    for x, y in cells:
+                        map[x,y].clear()
+                g.applyCells(map, cells)
+
     def apply(self, map, rect=None, parentRect=None):
         rect = (rect or (parentRect or map.rect())).clip(parentRect or map.rect())
         #super(TemplateGenerator, self).apply(map, rect)
@@ -2113,58 +4797,72 @@ class TemplateGenerator(Generator):
         if self.backgroundGen:
             self.backgroundGen.apply(map, rect)
 
-        y = rect.y
-        for templateRow in self.templateRows:
-            #parole.debug('templateRow: %s', templateRow)
-            # Assume clip
-            if y >= rect.y + rect.h:
-                break
-            x = rect.x
-            for templateChar in templateRow:
-                # Assume clip
-                if x >= rect.x + rect.w:
-                    break
-                if templateChar == ' ':
-                    pass
-                elif templateChar in self.legend:
-                    generator = self.legend[templateChar]
-                    if generator:
-                        if type(generator) not in (tuple, list):
-                            generator = [generator]
-                        for g in generator:
-                            if self.clearFirst:
-                                map[x,y].clear()
-                            g.apply(map, pygame.Rect((x, y), (1, 1)))
-                else:
-                    parole.warn("Unknown template character %s.",
-                        repr(templateChar))
-
-                x += 1
-            y += 1
+        # Assume clip
+        self.stamp(map, [rect.topleft], rect)
 
     def applyTiled(self, map, rect=None, parentRect=None):
         rect = (rect or (parentRect or map.rect())).clip(parentRect or map.rect())
 
-        tw = max([len(row) for row in self.templateRows])
-        th = len(self.templateRows)
+        (tw, th), symbols = self.compile()
+        if not tw or not th:
+            return
+
+        if self.backgroundGen:
+            self.backgroundGen.apply(map, rect)
 
-        y = rect.y
-        while y <= rect.y + rect.h:
-            x = rect.x
-            while x <= rect.x + rect.w:
-                self.apply(map, pygame.Rect((x,y), (tw,th)), parentRect=rect)
-                x += tw
-            y += th
+        origins = [(x, y) for y in xrange(rect.y, rect.y + rect.h + 1, th)
+                   for x in xrange(rect.x, rect.x + rect.w + 1, tw)]
+        self.stamp(map, origins, rect)
+
+# Compiled templates, by template rows; see TemplateGenerator.compile
+_compiledTemplates = {}
 
 #==============================================================================
 
 class CellularAutomataGenerator(Generator):
+    """
+    Seeds a grid of cells at random, optionally smooths it with a number of
+    generations of a birth/survival cellular automaton (the usual way to
+    turn noise into caves), and then applies a generator to each cell
+    according to how many live cells its 3x3 neighborhood (itself included)
+    holds.
+
+    The grid is kept as a list of C{array} rows of 0s and 1s, and neighbor
+    counts are computed a row at a time, as a box filter, rather than cell by
+    cell. All the cells meeting a condition are handed to its generator in
+    one L{Generator.applyCells} call.
+
+    With no smoothing generations, a given random seed gives the same grid,
+    and the same neighborhood counts, as applying the conditions cell by
+    cell would; but as the conditions' generators run one after another
+    rather than interleaved, the random choices they make come out in a
+    different order, and so does the content they generate.
+    """
+
     def __init__(self, name, seedProb, conditions, clearFirst=False,
-            seedEdges=False):
+            seedEdges=False, generations=0, birth=(5,6,7,8),
+            survival=(4,5,6,7,8)):
+        """
+        @param seedProb: The probability of each cell starting out alive.
+        @param conditions: A dictionary mapping neighborhood counts (0 to 9,
+        including the cell itself) to the generator to apply to the cells
+        with that count, after smoothing.
+        @param seedEdges: If C{True}, the grid has an extra border of cells
+        around the rectangle applied to, so that cells on its edges have a
+        full neighborhood.
+        @param generations: The number of smoothing generations.
+        @param birth: The numbers of live neighbors (of 8) that bring a dead
+        cell to life in a generation.
+        @param survival: The numbers of live neighbors (of 8) that keep a
+        live cell alive in a generation.
+        """
         super(CellularAutomataGenerator, self).__init__(name, clearFirst)
         self.seedProb = seedProb
         self.conditions = conditions
         self.seedEdges = seedEdges
+        self.generations = generations
+        self.birth = birth
+        self.survival = survival
 
     def neighborsOf(self, row, col, seedArray):
         h = len(seedArray)
@@ -2183,35 +4881,89 @@ class CellularAutomataGenerator(Generator):
             i += 1
         return neighbors
 
+    def seedGrid(self, cols, rows):
+        """
+        Returns a new random grid of C{cols} by C{rows} cells, each alive
+        with probability C{seedProb}, as a list of C{array} rows.
+        """
+        p = self.seedProb
+        rnd = self.getRNG().random
+        return [array.array('B', [rnd() <= p for j in xrange(cols)])
+                for i in xrange(rows)]
+
+    def neighborCounts(self, grid):
+        """
+        Returns the number of live cells in the 3x3 neighborhood of each cell
+        of C{grid}, the cell included, as a list of lists; cells off the
+        grid count as dead. The neighborhood is summed across, then down,
+        using whole shifted rows.
+        """
+        if not grid:
+            return []
+        zero = [0]
+        across = [[a + b + c for a, b, c in
+                   zip(zero + row[:-1].tolist(), row, row[1:].tolist() + zero)]
+                  for row in grid]
+        blank = [0] * len(across[0])
+        above = [blank] + across[:-1]
+        below = across[1:] + [blank]
+        return [[a + b + c for a, b, c in zip(up, mid, down)]
+                for up, mid, down in zip(above, across, below)]
+
+    def step(self, grid):
+        """
+        Returns the next generation of C{grid} under the birth and survival
+        rules.
+        """
+        # rule[count + 10*alive], where count includes the cell itself
+        rule = [int(n in self.birth) for n in xrange(10)] + \
+               [int(n-1 in self.survival) for n in xrange(10)]
+        return [array.array('B', [rule[n + 10*alive] for n, alive in
+                                  zip(counts, row)])
+                for counts, row in zip(self.neighborCounts(grid), grid)]
+
+    def makeGrid(self, cols, rows):
+        """
+        Returns a seeded grid of C{cols} by C{rows} cells after C{generations}
+        generations.
+        """
+        grid = self.seedGrid(cols, rows)
+        for i in xrange(self.generations):
+            grid = self.step(grid)
+        return grid
+
     def apply(self, map, rect=None):
         rect = (rect or map.rect()).clip(map.rect())
         #parole.debug('%s: applying to %r', self, rect)
         #super(CellularAutomataGenerator, self).apply(map, rect)
-        seedArray = [[random.random() <= self.seedProb for j in \
-            range(rect.w + 2*int(self.seedEdges))] for i in range(rect.h +\
-                2*int(self.seedEdges))]
-
-        y = rect.y
-        for i in range(int(self.seedEdges), rect.h + int(self.seedEdges)):
-            x = rect.x
-            for j in range(int(self.seedEdges), rect.w + int(self.seedEdges)):
-                numNeighbors = self.neighborsOf(i, j, seedArray)
-                if numNeighbors in self.conditions:
-                    gen = self.conditions[numNeighbors]
-                    if gen:
-                        if self.clearFirst:
-                            map[x,y].clear()
-                        gen.apply(map, pygame.Rect((x,y), (1,1)))
-                x += 1
-            y += 1
+        edge = int(self.seedEdges)
+        grid = self.makeGrid(rect.w + 2*edge, rect.h + 2*edge)
+        conditions = self.conditions
+
+        cellsByCount = {}
+        for i, counts in enumerate(self.neighborCounts(grid)[edge:
+                                                            edge+rect.h]):
+            y = rect.y + i
+            for j, n in enumerate(counts[edge:edge+rect.w]):
+                if conditions.get(n):
+                    cellsByCount.setdefault(n, []).append((rect.x + j, y))
+
+        for n, cells in sorted(cellsByCount.iteritems()):
+            if self.clearFirst:
+                for x, y in cells:
+                    map[x,y].clear()
+            conditions[n].applyCells(map, cells)
+
+    def subGenerators(self):
+        return _generatorsIn(self.conditions)
 
 #==============================================================================
 
-# FIXME: forceFullConnectivity
 class RoomsAndCorridorsGenerator(Generator):
     def __init__(self, name, rockAreaGenerator, roomBill, diggerClass,
             floorFunc, connectAdjacent=True, minConnectDist=1,
-            maxConnectDist=14, forceFullConnectivity=True, clearFirst=True):
+            maxConnectDist=14, forceFullConnectivity=True, clearFirst=True,
+            defineRegions=True):
         super(RoomsAndCorridorsGenerator, self).__init__(name, clearFirst)
         self.roomBill = roomBill
         self.rockAreaGenerator = rockAreaGenerator
@@ -2221,6 +4973,10 @@ class RoomsAndCorridorsGenerator(Generator):
         self.minConnectDist = minConnectDist
         self.maxConnectDist = maxConnectDist
         self.forceFullConnectivity = forceFullConnectivity
+        self.defineRegions = defineRegions
+
+    def subGenerators(self):
+        return [self.rockAreaGenerator]
 
     def apply(self, map, rect=None):
         rect = (rect or map.rect()).clip(map.rect())
@@ -2229,9 +4985,10 @@ class RoomsAndCorridorsGenerator(Generator):
         # Lay the requested rooms
         totalRequestedRooms = sum([num for (room, num) in self.roomBill])
         rooms = []
+        occupancy = spatial.OccupancyGrid(map.cols, map.rows)
         for roomType, nRooms in self.roomBill:
             for n in xrange(nRooms):
-                self.layRoom(map, rect, roomType, rooms)
+                self.layRoom(map, rect, roomType, rooms, occupancy=occupancy)
         parole.debug('Laid %d of %d requested rooms.', len(rooms),
                 totalRequestedRooms)
 
@@ -2239,28 +4996,54 @@ class RoomsAndCorridorsGenerator(Generator):
         self.connectRooms(map, rooms, self.diggerClass,
                 self.minConnectDist, self.maxConnectDist, self.connectAdjacent)
 
+        # Remember them as regions of the map
+        if self.defineRegions:
+            for room in rooms:
+                map.defineRegion(room.rect, data=room)
+
         return rooms
 
-    def layRoom(self, map, rect, roomType, rooms, tries=100):
+    def layRoom(self, map, rect, roomType, rooms, tries=100, occupancy=None):
+        """
+        Lays a room of C{roomType} at a random position in C{rect} where it
+        doesn't overlap any of C{rooms}, appends it to C{rooms} and applies
+        it to the map.
+
+        @param occupancy: A L{spatial.OccupancyGrid} of the map, with the
+        cells of C{rooms} occupied; the new room's cells are added to it. If
+        not given, one is built from C{rooms}.
+        @return: The new room, or C{None} if none fit in C{tries} attempts.
+        """
+        if occupancy is None:
+            occupancy = spatial.OccupancyGrid(map.cols, map.rows)
+            for r in rooms:
+                occupancy.occupy(r.rect)
+
         # Keep choosing a random location and size for the room until we find one
         # that doesn't intersect with existing rooms, then place it and return
+        rng = self.getRNG()
         while tries:
             tries -= 1
-            roomPos = (random.randint(0, rect.right-1),
-                       random.randint(0, rect.bottom-1))
+            roomPos = (rng.randint(rect.left, rect.right-1),
+                       rng.randint(rect.top, rect.bottom-1))
+            if occupancy.isOccupied(*roomPos):
+                # a room starting inside an existing one can't fit; don't
+                # bother making it
+                continue
             room = roomType(roomPos)
     
             if not rect.contains(room.rect):
                 # we generated a rectangle not completely enclosed by the map
                 continue
     
-            if room.rect.collidelist([r.rect for r in rooms]) != -1:
+            if not occupancy.isFree(room.rect):
                 # the generated rectangle overlaps with an existing one
                 continue
     
             rooms.append(room)
+            occupancy.occupy(room.rect)
             room.apply(map)
-            return
+            return room
     
     def __corners(self, rect):
         return (rect.topleft,
@@ -2281,133 +5064,113 @@ class RoomsAndCorridorsGenerator(Generator):
 
     def connectRooms(self, map, rooms, diggerClass, minDist, maxDist,
             adjacents=True):
-        connectedPairs = []
+        """
+        Connects each room to the rooms near it: rooms next to each other
+        (if C{adjacents}) by an opening, and rooms whose rectangles collide
+        once inflated by C{minDist} to C{maxDist} by a corridor. Then, if
+        L{forceFullConnectivity} is set, joins any groups of rooms still
+        not connected to one another with corridors between their nearest
+        rooms.
+        """
+        index = spatial.RectIndex(max(maxDist, 8))
+        for i, room in enumerate(rooms):
+            index.add(i, room.rect)
+        connectedPairs = set()  # (i,j), i < j, that we've tried to connect
+
+        # Union-find over the rooms' indices: joined[i] is a room that room
+        # i is known to be connected to, leading eventually to the
+        # representative of its group
+        joined = range(len(rooms))
+        def find(i):
+            while joined[i] != i:
+                joined[i] = joined[joined[i]]
+                i = joined[i]
+            return i
+        def union(i, j):
+            joined[find(i)] = find(j)
     
         if adjacents:
-            for room1 in rooms:
-                for room2 in rooms:
-                    if room1 is room2:
-                        continue
-                    pair1 = (room1, room2)
-                    pair2 = (room2, room1)
-                    if pair1 in connectedPairs or pair2 in connectedPairs:
+            for i, room1 in enumerate(rooms):
+                for j in index.colliding(room1.rect.inflate(4,4)):
+                    if j <= i or (i,j) in connectedPairs:
                         continue
+                    room2 = rooms[j]
     
                     if self.__adjacent(room1, room2):
-                        connectedPairs.append(pair1)
-                        connectedPairs.append(pair2)
+                        connectedPairs.add((i,j))
                         #parole.debug('adjacent: %r, %r', room1, room2)
-                        self.__connectAdjacent(map, room1, room2)
+                        if self.__connectAdjacent(map, room1, room2):
+                            union(i, j)
     
-        for room1 in rooms:
-            otherRooms = [r for r in rooms if r is not room1]
-            otherRects = [r.rect for r in rooms if r is not room1]
+        for i, room1 in enumerate(rooms):
+            # Only rooms colliding at the largest inflation can collide at a
+            # smaller one
+            near = [j for j in
+                    index.colliding(room1.rect.inflate(maxDist, maxDist))
+                    if j != i]
             for inflation in xrange(minDist, maxDist+1):
                 #parole.debug('inflation %s', inflation)
                 inflRoom1 = room1.rect.inflate(inflation, inflation)
-                for otherIdx in inflRoom1.collidelistall(otherRects):
-                    room2 = otherRooms[otherIdx]
-                    pair1 = (room1, room2)
-                    pair2 = (room2, room1)
-                    if pair1 in connectedPairs or pair2 in connectedPairs:
+                for j in near:
+                    pair = (min(i,j), max(i,j))
+                    if pair in connectedPairs or \
+                            not inflRoom1.colliderect(rooms[j].rect):
                         continue
     
-                    self.connectDistant(map, room1, room2, rooms, diggerClass())
-                    connectedPairs.append(pair1)
-                    connectedPairs.append(pair2)
-
-#        if self.forceFullConnectivity:
-#            # first find each connected component
-#            components = []
-#            
-#            def visit(pair, currentComponent):
-#                r1, r2 = pair
-#                currentComponent.append((r1,r2))
-#                currentComponent.append((r2,r1))
-#                for otherPair in connectedPairs:
-#                    if r1 in otherPair and r2 in otherPair:
-#                        continue
-#                    if (r1 in otherPair or r2 in otherPair) \
-#                            and (otherPair not in currentComponent) \
-#                            and (tuple(reversed(otherPair)) not in \
-#                            currentComponent):
-#                        visit(otherPair, currentComponent)
-#
-#            for cpair in connectedPairs:
-#                # if cpair is not in a known connected component, visit it
-#                # and add the resulting component to our list
-#                inKnownComponent = False
-#                for comp in components:
-#                    if cpair in comp:
-#                        inKnownComponent = True
-#                        break
-#                if not inKnownComponent:
-#                    currentComponent = []
-#                    visit(cpair, currentComponent)
-#                    components.append(list(currentComponent))
-#
-#            # add singleton rooms to the components list
-#            for r in rooms:
-#                inAPair = False
-#                for p in connectedPairs:
-#                    if r in p:
-#                        inAPair = True
-#                        break
-#                if not inAPair:
-#                    components.append([(r,r)])
-#
-#            parole.debug('*** JOINING %d CONNECTED COMPONENTS ***',
-#                    len(components))
-#            parole.debug('Components:\n%s', pprint.pformat(components))
-#
-#            # find the largest component
-#            targetComp = components[0]
-#            for comp in components:
-#                if len(comp) > len(targetComp):
-#                    targetComp = comp
-#
-#            # for each other component, find a room closest to a room in the
-#            # largest component, and connect them
-#            for comp in components:
-#                if comp is targetComp:
-#                    continue
-#                closestPair = (targetComp[0][0], comp[0][0])
-#                closestDist = map.dist(closestPair[0].rect.center,
-#                                       closestPair[1].rect.center)
-#                for pairInComp in comp:
-#                    for pairInTarget in targetComp:
-#                        for i,j in [(0,0),(0,1),(1,0),(1,1)]:
-#                            d = map.dist(pairInComp[i].rect.center,
-#                                         pairInTarget[j].rect.center)
-#                            if d < closestDist:
-#                                closestPair = (pairInComp[i], pairInTarget[j])
-#                                closestDist = d
-#
-#                # connect them
-#                parole.debug('Connecting across components: %r -> %r',
-#                        closestPair[0], closestPair[1])
-#                self.connectDistant(map, closestPair[0], closestPair[1], rooms,
-#                        diggerClass())
-#                connectedPairs.append(closestPair)
-#                connectedPairs.append(tuple(reversed(closestPair)))
-                # add singleton rooms to the components list
-                #singletons = []
-                #for r in rooms:
-                #    inAPair = False
-                #    for p in connectedPairs:
-                #        if r in p:
-                #            inAPair = True
-                #            break
-                #    if not inAPair:
-                #        singletons.append(r)
-                #for r in singletons:
-                #    rooms.remove(r)
-
-
+                    room2 = rooms[j]
+                    if self.connectDistant(map, room1, room2, rooms,
+                            diggerClass()):
+                        union(i, j)
+                    connectedPairs.add(pair)
+
+        if self.forceFullConnectivity and rooms:
+            groups = {}
+            for i in xrange(len(rooms)):
+                groups.setdefault(find(i), []).append(i)
+            parole.debug('*** JOINING %d CONNECTED COMPONENTS ***',
+                    len(groups))
+
+            # Each successful join leaves one group fewer, so joining every
+            # group but the largest to some other group leaves just one
+            groups = sorted(groups.values(), key=len, reverse=True)
+            for group in groups[1:]:
+                for i, j in self.__nearestOutside(map, rooms, index, group,
+                        find):
+                    parole.debug('Connecting across components: %r -> %r',
+                            rooms[i], rooms[j])
+                    if self.connectDistant(map, rooms[i], rooms[j], rooms,
+                            diggerClass()):
+                        union(i, j)
+                        break
+                else:
+                    parole.debug('Failed to connect component of %r',
+                            rooms[group[0]])
+
+    def __nearestOutside(self, map, rooms, index, group, find, maxTries=5):
+        # Up to maxTries (i, j) pairs of a room i in group and a room j in
+        # another group, nearest first, found by searching ever larger
+        # areas around the group's rooms until one holds other rooms.
+        root = find(group[0])
+        reach = max(self.maxConnectDist, 8)
+        limit = 2 * max(map.cols, map.rows)
+        while True:
+            pairs = []
+            for i in group:
+                rect = rooms[i].rect
+                cx, cy = rect.center
+                for j in index.colliding(rect.inflate(reach, reach)):
+                    if find(j) != root:
+                        ox, oy = rooms[j].rect.center
+                        pairs.append(((ox-cx)**2 + (oy-cy)**2, i, j))
+            if pairs or reach > limit:
+                break
+            reach *= 2
+        pairs.sort()
+        return [(i, j) for d2, i, j in pairs[:maxTries]]
 
     def __connectAdjacent(self, map, room1, room2):
         perim = list(self.__perimeter(room1.rect))
-        random.shuffle(perim)
+        self.getRNG().shuffle(perim)
         rm2Infl = room2.rect.inflate(2,2)
         for x,y in perim:
             if rm2Infl.collidepoint(x,y):
@@ -2423,8 +5186,9 @@ class RoomsAndCorridorsGenerator(Generator):
                                     if room2.rect.collidepoint(x3,y3):
                                         map[x3,y3].clear()
                                         map[x3,y3].add(self.floorFunc(room1))
-                            return
-                    return
+                            return True
+                    return False
+        return False
 
     def __sign(self, x):
         if x > 0:
@@ -2444,15 +5208,22 @@ class RoomsAndCorridorsGenerator(Generator):
         yield x-1, y-1
 
     def connectDistant(self, map, room1, room2, allRooms, digger):
+        """
+        Digs a corridor from C{room1} toward C{room2} with C{digger}.
+
+        @return: C{True} if the corridor reached C{room2} (or the digger
+        stopped it there), C{False} if it couldn't be dug.
+        """
         #parole.debug('Connecting distant rooms: %r, %r', room1, room2)
         p1 = room1.diggableOut()
         p2 = room2.diggableIn()
     
+        rng = self.getRNG()
         ntries = 100
         while ntries:
             ntries -= 1
-            startPos = random.choice(p1)
-            endPos = random.choice(p2)
+            startPos = rng.choice(p1)
+            endPos = rng.choice(p2)
             dPos = (self.__sign(endPos[0]-startPos[0]),
                     self.__sign(endPos[1]-startPos[1]))
             if room1.rect.collidepoint(startPos[0] + dPos[0], 
@@ -2462,16 +5233,16 @@ class RoomsAndCorridorsGenerator(Generator):
                 break
 
         if not ntries:
-            return
+            return False
     
         x, y = startPos
         try:
             digger.digTile(map, map[x,y], room1, room2, allRooms)
         except IndexError:
-            return
+            return False
 
         dx, dy = dPos
-        movingX = random.choice((True, False))
+        movingX = rng.choice((True, False))
         while (x,y) != endPos:
             if movingX:
                 nx = x+dx
@@ -2488,7 +5259,7 @@ class RoomsAndCorridorsGenerator(Generator):
                 if not digger.digTile(map, map[nx,ny], room1, room2, allRooms):
                     break
             except IndexError:
-                return
+                return False
 
             x, y = nx, ny
             if x == endPos[0] and y != endPos[1]:
@@ -2496,6 +5267,8 @@ class RoomsAndCorridorsGenerator(Generator):
             elif x != endPos[0] and y == endPos[1]:
                 movingX = True
 
+        return True
+
 #==============================================================================
 #{ Utility functions
 
@@ -0,0 +1,1367 @@
+#Python Advanced Roguelike Engine (Parole)
+#Copyright (C) 2006-2012 Max Bane
+#
+#This program is free software; you can redistribute it and/or
+#modify it under the terms of the GNU General Public License
+#as published by the Free Software Foundation; either version 2
+#of the License, or (at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Grid path-finding algorithms used by L{parole.map.Map2D}. Like the L{fov}
+module, nothing here knows about L{Tile}s or L{MapObject}s: every function
+operates on the dimensions of a grid and a flat, row-major sequence of
+blocking flags, where C{blocked[y*cols + x]} is nonzero iff the cell at
+C{(x,y)} may not be entered. Movement is 8-connected, in the same order as
+L{Map2D.neighborsOf}, and the cost of a step is its Euclidean length.
+
+Paths are returned as lists of C{(col,row)}-tuples running from the start
+position to the goal position inclusive, just like L{Map2D.getAStarPath}, or
+C{None} if no path exists.
+"""
+
+import heapq, math, array, time, zlib, os
+from collections import deque
+
+try:
+    import multiprocessing
+except ImportError:
+    # Python 2.5; PathService can only work in-process
+    multiprocessing = None
+
+SQRT2 = math.sqrt(2.0)
+
+# Same order as Map2D.neighborsOf
+DIRECTIONS = ((1,0), (-1,0), (0,1), (0,-1), (1,1), (1,-1), (-1,1), (-1,-1))
+
+#==============================================================================
+#{ Flat searches
+
+def euclidean(p1, p2):
+    """
+    Returns the Euclidean distance between two C{(x,y)} points.
+    """
+    return math.sqrt(float((p2[0]-p1[0])**2 + (p2[1]-p1[1])**2))
+
+def octile(p1, p2):
+    """
+    Returns the length of the shortest 8-connected path between two C{(x,y)}
+    points on an open grid. Never less than L{euclidean}, and still an exact
+    lower bound on the true path cost, so it makes a tighter A* heuristic.
+    """
+    dx, dy = abs(p2[0]-p1[0]), abs(p2[1]-p1[1])
+    if dx < dy:
+        dx, dy = dy, dx
+    return dx + (SQRT2 - 1.0)*dy
+
+def reconstructPath(cameFrom, node):
+    """
+    Follows a C{cameFrom} mapping (node -> predecessor) back from C{node},
+    returning the list of nodes from the origin of the search to C{node}.
+    """
+    path = [node]
+    while node in cameFrom:
+        node = cameFrom[node]
+        path.append(node)
+    path.reverse()
+    return path
+
+def gridAStar(cols, rows, blocked, start, goal, bounds=None):
+    """
+    Finds the shortest 8-connected path from C{start} to C{goal}, never
+    stepping onto a blocked cell. The start cell itself is allowed to be
+    blocked (an actor is usually standing on it), but the goal is not.
+
+    @param bounds: An optional C{(x0, y0, x1, y1)}-tuple restricting the search
+                   to cells with C{x0 <= x < x1} and C{y0 <= y < y1}.
+    @return: A list of C{(col,row)}-tuples, or C{None}.
+    """
+    if start == goal:
+        return [start]
+    x0, y0, x1, y1 = bounds or (0, 0, cols, rows)
+    gx, gy = goal
+    if not (x0 <= gx < x1 and y0 <= gy < y1) or blocked[gy*cols + gx]:
+        return None
+
+    gScore = {start: 0.0}
+    cameFrom = {}
+    closed = set()
+    counter = 0
+    openHeap = [(octile(start, goal), counter, start)]
+    while openHeap:
+        f, c, node = heapq.heappop(openHeap)
+        if node in closed:
+            continue
+        if node == goal:
+            return reconstructPath(cameFrom, goal)
+        closed.add(node)
+        x, y = node
+        g = gScore[node]
+        for dx, dy in DIRECTIONS:
+            nx, ny = x+dx, y+dy
+            if nx < x0 or nx >= x1 or ny < y0 or ny >= y1:
+                continue
+            if blocked[ny*cols + nx]:
+                continue
+            n = (nx, ny)
+            if n in closed:
+                continue
+            ng = g + ((dx and dy) and SQRT2 or 1.0)
+            if ng < gScore.get(n, ng + 1.0):
+                gScore[n] = ng
+                cameFrom[n] = node
+                counter += 1
+                heapq.heappush(openHeap, (ng + octile(n, goal), counter, n))
+    return None
+
+def gridDistances(cols, rows, blocked, source, targets, bounds=None):
+    """
+    Runs Dijkstra's algorithm outward from C{source}, returning a C{dict}
+    mapping each reachable member of C{targets} to its path cost from
+    C{source}. The search stops as soon as every target has been settled.
+    C{bounds} is as for L{gridAStar}.
+    """
+    x0, y0, x1, y1 = bounds or (0, 0, cols, rows)
+    remaining = set(targets)
+    found = {}
+    dist = {source: 0.0}
+    closed = set()
+    openHeap = [(0.0, source)]
+    while openHeap and remaining:
+        d, node = heapq.heappop(openHeap)
+        if node in closed:
+            continue
+        closed.add(node)
+        if node in remaining:
+            remaining.discard(node)
+            found[node] = d
+        x, y = node
+        for dx, dy in DIRECTIONS:
+            nx, ny = x+dx, y+dy
+            if nx < x0 or nx >= x1 or ny < y0 or ny >= y1:
+                continue
+            if blocked[ny*cols + nx]:
+                continue
+            n = (nx, ny)
+            if n in closed:
+                continue
+            nd = d + ((dx and dy) and SQRT2 or 1.0)
+            if nd < dist.get(n, nd + 1.0):
+                dist[n] = nd
+                heapq.heappush(openHeap, (nd, n))
+    return found
+
+def jumpPointSearch(cols, rows, blocked, start, goal):
+    """
+    Finds a shortest 8-connected path from C{start} to C{goal} by Jump Point
+    Search. On a grid where every step costs its Euclidean length, many
+    shortest paths are symmetric (they differ only in the order of their
+    moves); JPS only ever expands the "jump points" at which a path may have
+    to turn, scanning over the open ground between them without putting it on
+    the open list. The result is as short as that of L{gridAStar}, usually
+    after expanding an order of magnitude fewer nodes.
+
+    Diagonal steps may squeeze between two blockers, as with
+    L{Map2D.neighborsOf}. As with L{gridAStar}, the start may be blocked but
+    the goal may not.
+
+    @return: A list of C{(col,row)}-tuples, or C{None}.
+    """
+    if start == goal:
+        return [start]
+    gx, gy = goal
+    if blocked[gy*cols + gx]:
+        return None
+
+    def isOpen(x, y):
+        return 0 <= x < cols and 0 <= y < rows and not blocked[y*cols + x]
+
+    def jumpStraight(x, y, dx, dy):
+        while isOpen(x, y):
+            if x == gx and y == gy:
+                return x, y
+            if dx:
+                if (not isOpen(x, y+1) and isOpen(x+dx, y+1)) or \
+                        (not isOpen(x, y-1) and isOpen(x+dx, y-1)):
+                    return x, y
+            else:
+                if (not isOpen(x+1, y) and isOpen(x+1, y+dy)) or \
+                        (not isOpen(x-1, y) and isOpen(x-1, y+dy)):
+                    return x, y
+            x += dx
+            y += dy
+        return None
+
+    def jump(x, y, dx, dy):
+        if not (dx and dy):
+            return jumpStraight(x, y, dx, dy)
+        while isOpen(x, y):
+            if x == gx and y == gy:
+                return x, y
+            if (not isOpen(x-dx, y) and isOpen(x-dx, y+dy)) or \
+                    (not isOpen(x, y-dy) and isOpen(x+dx, y-dy)):
+                return x, y
+            if jumpStraight(x+dx, y, dx, 0) or jumpStraight(x, y+dy, 0, dy):
+                return x, y
+            x += dx
+            y += dy
+        return None
+
+    def successorDirections(x, y, parent):
+        if parent is None:
+            return DIRECTIONS
+        px, py = parent
+        dx = (x > px) - (x < px)
+        dy = (y > py) - (y < py)
+        if dx and dy:
+            dirs = [(dx, 0), (0, dy), (dx, dy)]
+            if not isOpen(x-dx, y):
+                dirs.append((-dx, dy))
+            if not isOpen(x, y-dy):
+                dirs.append((dx, -dy))
+        elif dx:
+            dirs = [(dx, 0)]
+            if not isOpen(x, y+1):
+                dirs.append((dx, 1))
+            if not isOpen(x, y-1):
+                dirs.append((dx, -1))
+        else:
+            dirs = [(0, dy)]
+            if not isOpen(x+1, y):
+                dirs.append((1, dy))
+            if not isOpen(x-1, y):
+                dirs.append((-1, dy))
+        return dirs
+
+    gScore = {start: 0.0}
+    cameFrom = {}
+    closed = set()
+    counter = 0
+    openHeap = [(octile(start, goal), counter, start)]
+    while openHeap:
+        f, c, node = heapq.heappop(openHeap)
+        if node in closed:
+            continue
+        if node == goal:
+            return expandJumps(reconstructPath(cameFrom, goal))
+        closed.add(node)
+        x, y = node
+        g = gScore[node]
+        for dx, dy in successorDirections(x, y, cameFrom.get(node)):
+            jp = jump(x+dx, y+dy, dx, dy)
+            if jp is None or jp in closed:
+                continue
+            ng = g + octile(node, jp)
+            if ng < gScore.get(jp, ng + 1.0):
+                gScore[jp] = ng
+                cameFrom[jp] = node
+                counter += 1
+                heapq.heappush(openHeap, (ng + octile(jp, goal), counter, jp))
+    return None
+
+def expandJumps(jumpPoints):
+    """
+    Expands a list of jump points, each lying on a straight or diagonal line
+    from the last, into the full list of cells stepped through.
+    """
+    path = jumpPoints[:1]
+    for (x0, y0), (x1, y1) in zip(jumpPoints, jumpPoints[1:]):
+        dx = (x1 > x0) - (x1 < x0)
+        dy = (y1 > y0) - (y1 < y0)
+        x, y = x0, y0
+        while (x, y) != (x1, y1):
+            x += dx
+            y += dy
+            path.append((x, y))
+    return path
+
+#==============================================================================
+#{ Resumable and budgeted searches
+
+def gridSuccessors(cols, rows, blocked):
+    """
+    Returns a C{successors} function for L{PathSearch} and
+    L{BidirectionalPathSearch} describing 8-connected movement over a
+    blocking grid: it yields a C{(neighbor, cost)} pair for each open
+    neighbor of a cell.
+    """
+    def successors((x, y)):
+        for dx, dy in DIRECTIONS:
+            nx, ny = x+dx, y+dy
+            if 0 <= nx < cols and 0 <= ny < rows and not blocked[ny*cols + nx]:
+                yield (nx, ny), (dx and dy) and SQRT2 or 1.0
+    return successors
+
+def gridPredecessors(cols, rows, blocked, start):
+    """
+    Returns a C{predecessors} function for L{BidirectionalPathSearch}, the
+    reverse of L{gridSuccessors}: it yields a C{(neighbor, cost)} pair for
+    each neighbor of a cell from which the cell could be entered. Blocked
+    cells have no predecessors, and the C{start} cell is a predecessor even
+    if it is blocked.
+    """
+    def predecessors((x, y)):
+        if blocked[y*cols + x]:
+            return
+        for dx, dy in DIRECTIONS:
+            nx, ny = x+dx, y+dy
+            if 0 <= nx < cols and 0 <= ny < rows and \
+                    (not blocked[ny*cols + nx] or (nx, ny) == start):
+                yield (nx, ny), (dx and dy) and SQRT2 or 1.0
+    return predecessors
+
+class PathSearch(object):
+    """
+    An A* search that can be run a little at a time, e.g. for a few
+    milliseconds per frame, until it finishes. At any point, L{bestPath}
+    gives the best path found so far: the complete path once the goal has
+    been reached, or else a partial path to the explored node that looks
+    closest to the goal. For example::
+
+        search = PathSearch(start, goal, gridSuccessors(cols, rows, blocked),
+                            octile)
+        while not search.step(maxTime=2):
+            ... # let the frame go by
+        path = search.bestPath()
+
+    @ivar done: Whether the search has finished, either by reaching the goal
+    or by running out of nodes to expand.
+    @ivar found: Whether the goal has been reached.
+    @ivar expanded: The number of nodes expanded so far.
+    """
+
+    def __init__(self, start, goal, successors, heuristic):
+        """
+        @param successors: A callable accepting a node and returning an
+        iterable of C{(neighbor, cost)}-pairs.
+        @param heuristic: A callable accepting two nodes and returning an
+        estimate of the cost between them, which must not overestimate it if
+        the path found is to be the shortest.
+        """
+        self.start, self.goal = start, goal
+        self.successors = successors
+        self.heuristic = heuristic
+        self.done = False
+        self.found = False
+        self.expanded = 0
+
+        h = heuristic(start, goal)
+        self._gScore = {start: 0.0}
+        self._cameFrom = {}
+        self._closed = set()
+        self._counter = 0
+        self._open = [(h, self._counter, start)]
+        self._best, self._bestH = start, h
+        if start == goal:
+            self.done = self.found = True
+
+    def __repr__(self):
+        return '%s(%r, %r, ...)' % (self.__class__.__name__, self.start,
+                self.goal)
+
+    def step(self, maxExpansions=None, maxTime=None):
+        """
+        Continues the search until it finishes, or until C{maxExpansions}
+        more nodes have been expanded or C{maxTime} milliseconds have passed,
+        whichever comes first. With neither limit, runs to completion.
+
+        @return: The value of L{done}.
+        """
+        deadline = maxTime is not None and time.time() + maxTime/1000.0
+        budget = maxExpansions
+        while not self.done:
+            if budget is not None:
+                if budget <= 0:
+                    break
+                budget -= 1
+            if deadline and time.time() >= deadline:
+                break
+            self._expand()
+        return self.done
+
+    def _expand(self):
+        if not self._open:
+            self.done = True
+            return
+        f, c, node = heapq.heappop(self._open)
+        if node in self._closed:
+            return
+        if node == self.goal:
+            self.done = self.found = True
+            return
+        self._closed.add(node)
+        self.expanded += 1
+        g = self._gScore[node]
+        h = f - g
+        if h < self._bestH:
+            self._best, self._bestH = node, h
+
+        goal, heuristic = self.goal, self.heuristic
+        gScore, cameFrom, closed = self._gScore, self._cameFrom, self._closed
+        for n, cost in self.successors(node):
+            if n in closed:
+                continue
+            ng = g + cost
+            if ng < gScore.get(n, ng + 1.0):
+                gScore[n] = ng
+                cameFrom[n] = node
+                self._counter += 1
+                heapq.heappush(self._open, (ng + heuristic(n, goal),
+                    self._counter, n))
+
+    def bestPath(self):
+        """
+        Returns the path to the goal if it has been found, or else the path to
+        the explored node with the smallest heuristic distance to the goal
+        (which is just C{[start]} if nothing has been explored). Returns
+        C{None} if the search is L{done} without having found the goal.
+        """
+        if self.found:
+            return reconstructPath(self._cameFrom, self.goal)
+        if self.done:
+            return None
+        return reconstructPath(self._cameFrom, self._best)
+
+class BidirectionalPathSearch(PathSearch):
+    """
+    A L{PathSearch} that searches forward from the start and backward from
+    the goal at the same time, stopping once the two searches have met along
+    a path that no unexplored node could improve upon. On long routes
+    through maze-like maps this often expands fewer nodes than a one-sided
+    search, since two small search frontiers replace one large one.
+
+    Both directions are ordered by the average of the heuristic toward the
+    goal and away from the start (the "balanced" potentials of Ikeda et al.),
+    which keeps the stopping test simple and exact: the search is over once
+    the best meeting point found is no worse than the sum of the two
+    frontiers' smallest keys.
+
+    Partial results (see L{PathSearch.bestPath}) come from the forward
+    search, so they always begin at the start.
+    """
+
+    def __init__(self, start, goal, successors, predecessors, heuristic):
+        """
+        @param predecessors: A callable accepting a node and returning an
+        iterable of C{(neighbor, cost)}-pairs, one for each neighbor from
+        which the node can be entered.
+        """
+        super(BidirectionalPathSearch, self).__init__(start, goal, successors,
+                heuristic)
+        self.predecessors = predecessors
+        self._open = [(self._potential(start), 0, start)]
+        self._gBack = {goal: 0.0}
+        self._cameBack = {}
+        self._closedBack = set()
+        self._openBack = [(-self._potential(goal), 0, goal)]
+        self._meet, self._meetCost = None, None
+
+    def _potential(self, node):
+        return 0.5*(self.heuristic(node, self.goal) - \
+                    self.heuristic(self.start, node))
+
+    def _expand(self):
+        if not self._open or not self._openBack:
+            self.done = True
+            self.found = self._meet is not None
+            return
+        if self._meet is not None and self._meetCost <= \
+                self._open[0][0] + self._openBack[0][0]:
+            # nothing left on either side can lead to a shorter path
+            self.done = self.found = True
+            return
+        if len(self._open) <= len(self._openBack):
+            self.__expandSide(self._open, self._gScore, self._cameFrom,
+                    self._closed, self._gBack, self.successors, 1.0)
+        else:
+            self.__expandSide(self._openBack, self._gBack, self._cameBack,
+                    self._closedBack, self._gScore, self.predecessors, -1.0)
+
+    def __expandSide(self, openHeap, gScore, cameFrom, closed, gOther, nbrs,
+            sign):
+        f, c, node = heapq.heappop(openHeap)
+        if node in closed:
+            return
+        closed.add(node)
+        self.expanded += 1
+        g = gScore[node]
+        if sign > 0:
+            h = self.heuristic(node, self.goal)
+            if h < self._bestH:
+                self._best, self._bestH = node, h
+
+        for n, cost in nbrs(node):
+            if n in closed:
+                continue
+            ng = g + cost
+            if ng < gScore.get(n, ng + 1.0):
+                gScore[n] = ng
+                cameFrom[n] = node
+                self._counter += 1
+                heapq.heappush(openHeap, (ng + sign*self._potential(n),
+                    self._counter, n))
+                if n in gOther and (self._meet is None or \
+                        ng + gOther[n] < self._meetCost):
+                    self._meet, self._meetCost = n, ng + gOther[n]
+
+    def bestPath(self):
+        if self.found:
+            if self.start == self.goal:
+                return [self.start]
+            path = reconstructPath(self._cameFrom, self._meet)
+            node = self._meet
+            while node in self._cameBack:
+                node = self._cameBack[node]
+                path.append(node)
+            return path
+        return super(BidirectionalPathSearch, self).bestPath()
+
+#==============================================================================
+#{ Hierarchical path-finding (HPA*)
+
+class ClusterGraph(object):
+    """
+    An abstract graph for hierarchical path-finding (HPA*) over a blocking
+    grid. The grid is partitioned into square clusters of C{clusterSize}
+    cells. Wherever movement is possible across the border between two
+    clusters, entrance nodes are placed on either side of it; the shortest
+    intra-cluster distances between the entrances of a cluster form the
+    remaining edges of the graph.
+
+    A path query searches the (small) abstract graph and then refines each
+    abstract edge into concrete steps with a search confined to a single
+    cluster, so its cost depends on the number of clusters crossed rather than
+    on the number of cells.
+
+    The graph is maintained incrementally: call L{touch} whenever the blocking
+    state of a cell changes, and the affected borders are recomputed on the
+    next query. Intra-cluster distances are only computed for clusters that a
+    search actually reaches, and are cached until the cluster changes.
+
+    @ivar blocked: The blocking sequence this graph was built over. It is
+    referenced, not copied, so changes to it must be reported via L{touch}.
+    """
+
+    # Runs of open border cells at least this long get an entrance at each end
+    # rather than a single one in the middle.
+    wideEntrance = 6
+
+    # Inflation of the abstract search's heuristic. Values above 1.0 trade a
+    # little path quality for far fewer expanded entrances on cluttered maps.
+    heuristicWeight = 1.2
+
+    def __init__(self, cols, rows, blocked, clusterSize=16):
+        if clusterSize < 2:
+            raise ValueError('clusterSize must be at least 2.')
+        self.cols, self.rows = cols, rows
+        self.blocked = blocked
+        self.clusterSize = clusterSize
+        self.clusterCols = (cols + clusterSize - 1) // clusterSize
+        self.clusterRows = (rows + clusterSize - 1) // clusterSize
+
+        self.__borders = {}     # border key -> [(a, b, cost), ...]
+        self.__nodes = {}       # cluster -> {node: refcount}
+        self.__inter = {}       # node -> {node in other cluster: cost}
+        self.__intra = {}       # cluster -> {node: {node: cost}}
+        self.__dirty = set([(cx, cy) for cx in xrange(self.clusterCols) \
+                                     for cy in xrange(self.clusterRows)])
+
+    def __repr__(self):
+        return 'ClusterGraph(%r, %r, ..., clusterSize=%r)' % (self.cols,
+                self.rows, self.clusterSize)
+
+    def clusterOf(self, (x, y)):
+        """
+        Returns the C{(cx,cy)} index of the cluster containing cell C{(x,y)}.
+        """
+        return x // self.clusterSize, y // self.clusterSize
+
+    def clusterBounds(self, (cx, cy)):
+        """
+        Returns the C{(x0, y0, x1, y1)} bounds of the given cluster.
+        """
+        cs = self.clusterSize
+        return (cx*cs, cy*cs, min(self.cols, (cx+1)*cs),
+                min(self.rows, (cy+1)*cs))
+
+    def nodesIn(self, cluster):
+        """
+        Returns a list of the entrance nodes of the given cluster.
+        """
+        self.update()
+        return self.__nodes.get(cluster, {}).keys()
+
+    def touch(self, x, y):
+        """
+        Notes that the blocking state of cell C{(x,y)} has changed. Every
+        cluster containing the cell or one of its neighbors is marked for
+        recomputation.
+        """
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                nx, ny = x+dx, y+dy
+                if 0 <= nx < self.cols and 0 <= ny < self.rows:
+                    self.__dirty.add(self.clusterOf((nx, ny)))
+
+    def update(self):
+        """
+        Recomputes the entrances on every border of every cluster marked by
+        L{touch}, and forgets the cached intra-cluster distances of any
+        cluster whose entrances changed. Called automatically by L{findPath}.
+        """
+        if not self.__dirty:
+            return
+        changed = set(self.__dirty)
+        borders = set()
+        for cluster in self.__dirty:
+            borders.update(self.__bordersOf(cluster))
+        self.__dirty.clear()
+
+        # Clusters whose node sets may change, and what they were before
+        touched = set()
+        for kind, cx, cy in borders:
+            touched.update([(cx, cy), (cx+1, cy), (cx, cy+1), (cx+1, cy+1)])
+        before = dict([(c, set(self.__nodes.get(c, ()))) for c in touched])
+
+        for key in borders:
+            for a, b, cost in self.__borders.pop(key, ()):
+                self.__unlink(a, b)
+            transitions = self.__computeBorder(key)
+            for a, b, cost in transitions:
+                self.__link(a, b, cost)
+            if transitions:
+                self.__borders[key] = transitions
+
+        for c in touched:
+            if before[c] != set(self.__nodes.get(c, ())):
+                changed.add(c)
+        for c in changed:
+            self.__intra.pop(c, None)
+
+    def prepare(self):
+        """
+        Brings the whole graph up to date, including the intra-cluster
+        distances of every cluster, so that no later query pays for them.
+        """
+        self.update()
+        for cx in xrange(self.clusterCols):
+            for cy in xrange(self.clusterRows):
+                self.__intraEdges((cx, cy))
+
+    def findPath(self, start, goal, refine=True):
+        """
+        Finds a path from C{start} to C{goal} through the abstract graph. If
+        C{refine} is true, the result is a concrete list of C{(col,row)}
+        steps; otherwise it is the list of abstract waypoints (start, entrance
+        nodes, goal) the path passes through. Returns C{None} if the goal is
+        unreachable.
+
+        The concrete path is optimal within each cluster, but as with any
+        HPA* search, the path as a whole may be slightly longer than the
+        true shortest path.
+        """
+        self.update()
+        if start == goal:
+            return [start]
+        gx, gy = goal
+        if self.blocked[gy*self.cols + gx]:
+            return None
+
+        cols, rows, blocked = self.cols, self.rows, self.blocked
+        sc, gc = self.clusterOf(start), self.clusterOf(goal)
+        if abs(sc[0]-gc[0]) <= 1 and abs(sc[1]-gc[1]) <= 1:
+            # Short hops are best served by a plain search over the (at most
+            # four) clusters involved.
+            sb, gb = self.clusterBounds(sc), self.clusterBounds(gc)
+            local = gridAStar(cols, rows, blocked, start, goal,
+                    (min(sb[0], gb[0]), min(sb[1], gb[1]),
+                     max(sb[2], gb[2]), max(sb[3], gb[3])))
+            if local:
+                return refine and local or [start, goal]
+
+        # Connect the start to the entrances of its cluster. A blocked start
+        # (someone is standing there) is left by its first step, which may
+        # already be in a neighboring cluster, so connect each open neighbor
+        # instead and remember which one each entrance was reached through.
+        sx, sy = start
+        if blocked[sy*cols + sx]:
+            sources = []
+            for dx, dy in DIRECTIONS:
+                nx, ny = sx+dx, sy+dy
+                if 0 <= nx < cols and 0 <= ny < rows and \
+                        not blocked[ny*cols + nx]:
+                    sources.append(((nx, ny), (dx and dy) and SQRT2 or 1.0))
+        else:
+            sources = [(start, 0.0)]
+        startEdges, startVia = {}, {}
+        for src, srcCost in sources:
+            cluster = self.clusterOf(src)
+            dists = gridDistances(cols, rows, blocked, src,
+                    self.__nodes.get(cluster, ()), self.clusterBounds(cluster))
+            for node, d in dists.iteritems():
+                if srcCost + d < startEdges.get(node, srcCost + d + 1.0):
+                    startEdges[node] = srcCost + d
+                    startVia[node] = src
+
+        goalEdges = gridDistances(cols, rows, blocked, goal,
+                self.__nodes.get(gc, ()), self.clusterBounds(gc))
+        if not startEdges or not goalEdges:
+            return None
+
+        waypoints = self.__abstractSearch(start, goal, startEdges, goalEdges)
+        if not waypoints or not refine:
+            return waypoints
+        via = startVia.get(waypoints[1])
+        if via is not None and via != start:
+            waypoints.insert(1, via)
+        return self.__refine(waypoints)
+
+    def __abstractSearch(self, start, goal, startEdges, goalEdges):
+        weight = self.heuristicWeight
+        gScore = {start: 0.0}
+        cameFrom = {}
+        closed = set()
+        counter = 0
+        openHeap = [(weight*octile(start, goal), counter, start)]
+        while openHeap:
+            f, c, node = heapq.heappop(openHeap)
+            if node in closed:
+                continue
+            if node == goal:
+                return reconstructPath(cameFrom, goal)
+            closed.add(node)
+            g = gScore[node]
+
+            edges = {}
+            if node == start:
+                edges.update(startEdges)
+            cluster = self.clusterOf(node)
+            if node in self.__nodes.get(cluster, ()):
+                edges.update(self.__intraEdges(cluster).get(node, {}))
+                edges.update(self.__inter.get(node, {}))
+            if node in goalEdges:
+                edges[goal] = goalEdges[node]
+
+            for n, cost in edges.iteritems():
+                if n == node or n in closed:
+                    continue
+                ng = g + cost
+                if ng < gScore.get(n, ng + 1.0):
+                    gScore[n] = ng
+                    cameFrom[n] = node
+                    counter += 1
+                    heapq.heappush(openHeap, (ng + weight*octile(n, goal),
+                        counter, n))
+        return None
+
+    def __refine(self, waypoints):
+        path = [waypoints[0]]
+        for p, q in zip(waypoints, waypoints[1:]):
+            cp = self.clusterOf(p)
+            if cp != self.clusterOf(q):
+                # an inter-cluster edge is always a single step
+                path.append(q)
+                continue
+            local = gridAStar(self.cols, self.rows, self.blocked, p, q,
+                    self.clusterBounds(cp))
+            if not local:
+                # shouldn't happen, unless blocked changed without a touch()
+                return None
+            path.extend(local[1:])
+        return path
+
+    def __intraEdges(self, cluster):
+        if cluster in self.__intra:
+            return self.__intra[cluster]
+        bounds = self.clusterBounds(cluster)
+        nodes = self.__nodes.get(cluster, {}).keys()
+        edges = dict([(n, {}) for n in nodes])
+        for i, n in enumerate(nodes):
+            others = nodes[i+1:]
+            if not others:
+                break
+            dists = gridDistances(self.cols, self.rows, self.blocked, n,
+                    others, bounds)
+            for m, d in dists.iteritems():
+                edges[n][m] = d
+                edges[m][n] = d
+        self.__intra[cluster] = edges
+        return edges
+
+    def __link(self, a, b, cost):
+        for n in (a, b):
+            refs = self.__nodes.setdefault(self.clusterOf(n), {})
+            refs[n] = refs.get(n, 0) + 1
+        self.__inter.setdefault(a, {})[b] = cost
+        self.__inter.setdefault(b, {})[a] = cost
+
+    def __unlink(self, a, b):
+        for n in (a, b):
+            cluster = self.clusterOf(n)
+            refs = self.__nodes[cluster]
+            refs[n] -= 1
+            if not refs[n]:
+                del refs[n]
+                if not refs:
+                    del self.__nodes[cluster]
+        for n, m in ((a, b), (b, a)):
+            nbrs = self.__inter[n]
+            del nbrs[m]
+            if not nbrs:
+                del self.__inter[n]
+
+    def __bordersOf(self, (cx, cy)):
+        # Border keys: ('v', cx, cy) lies between clusters (cx,cy) and
+        # (cx+1,cy); ('h', cx, cy) between (cx,cy) and (cx,cy+1); ('c', cx, cy)
+        # is the corner shared by (cx,cy), (cx+1,cy), (cx,cy+1), (cx+1,cy+1).
+        ccols, crows = self.clusterCols, self.clusterRows
+        for bx in (cx-1, cx):
+            if 0 <= bx < ccols-1:
+                yield ('v', bx, cy)
+        for by in (cy-1, cy):
+            if 0 <= by < crows-1:
+                yield ('h', cx, by)
+        for bx in (cx-1, cx):
+            for by in (cy-1, cy):
+                if 0 <= bx < ccols-1 and 0 <= by < crows-1:
+                    yield ('c', bx, by)
+
+    def __computeBorder(self, (kind, cx, cy)):
+        cs, cols, blocked = self.clusterSize, self.cols, self.blocked
+        def isOpen(x, y):
+            return not blocked[y*cols + x]
+
+        if kind == 'c':
+            X, Y = (cx+1)*cs, (cy+1)*cs
+            transitions = []
+            for a, b in (((X-1, Y-1), (X, Y)), ((X, Y-1), (X-1, Y))):
+                if isOpen(*a) and isOpen(*b):
+                    transitions.append((a, b, SQRT2))
+            return transitions
+
+        # Express the border in terms of (along, across) coordinates, so that
+        # one piece of code handles both orientations.
+        if kind == 'v':
+            across = (cx+1)*cs - 1
+            lo, hi = cy*cs, min(self.rows, (cy+1)*cs)
+            cell = lambda along, acr: (acr, along)
+        else:
+            across = (cy+1)*cs - 1
+            lo, hi = cx*cs, min(self.cols, (cx+1)*cs)
+            cell = lambda along, acr: (along, acr)
+        def openAt(along, acr):
+            return isOpen(*cell(along, acr))
+
+        transitions = []
+
+        # Runs of cells that are open on both sides of the border
+        runStart = None
+        for i in xrange(lo, hi+1):
+            crossable = i < hi and openAt(i, across) and openAt(i, across+1)
+            if crossable and runStart is None:
+                runStart = i
+            elif not crossable and runStart is not None:
+                runEnd = i - 1
+                if runEnd - runStart + 1 < self.wideEntrance:
+                    picks = [(runStart + runEnd) // 2]
+                else:
+                    picks = [runStart, runEnd]
+                for p in picks:
+                    transitions.append((cell(p, across), cell(p, across+1),
+                        1.0))
+                runStart = None
+
+        # Diagonal steps squeezing between two blockers aren't covered by any
+        # run, so each one gets a transition of its own.
+        for i in xrange(lo, hi):
+            if not openAt(i, across) or openAt(i, across+1):
+                continue
+            for j in (i-1, i+1):
+                if lo <= j < hi and openAt(j, across+1) and \
+                        not openAt(j, across):
+                    transitions.append((cell(i, across), cell(j, across+1),
+                        SQRT2))
+        return transitions
+
+#==============================================================================
+#{ Connectivity
+
+class ConnectivityIndex(object):
+    """
+    Labels the 8-connected components of the open cells of a blocking grid,
+    so that whether one cell can be reached from another is answered by
+    comparing two labels instead of by searching.
+
+    The labeling is computed on first use and then kept up to date
+    incrementally: call L{touch} whenever a cell's blocking state changes.
+    Opening a cell merges the components around it in near-constant time.
+    Blocking one only costs anything if the cell's open neighbors aren't
+    connected to each other around it (a corridor or a doorway); then the
+    components on each side are explored in parallel, and the exploration
+    stops as soon as they are found to meet elsewhere or the smallest of them
+    is used up, so the cost is proportional to the part of the map that was
+    actually cut off.
+
+    @ivar labels: The raw component label of each cell, flat and row-major;
+    0 for blocked cells. Labels of merged components are resolved by
+    L{componentOf}.
+    """
+
+    # Offsets around a cell, in ring order
+    RING = ((0,-1), (1,-1), (1,0), (1,1), (0,1), (-1,1), (-1,0), (-1,-1))
+
+    def __init__(self, cols, rows, blocked):
+        self.cols, self.rows = cols, rows
+        self.blocked = blocked
+        self.labels = None
+        self.__parent = {}
+        self.__nextLabel = 1
+
+    def __repr__(self):
+        return 'ConnectivityIndex(%r, %r, ...)' % (self.cols, self.rows)
+
+    def copy(self, blocked):
+        """
+        Returns an independent copy of this index over C{blocked}, which must
+        currently hold the same blocking flags (e.g., a copy of this index's
+        C{blocked}).
+        """
+        other = ConnectivityIndex(self.cols, self.rows, blocked)
+        if self.labels is not None:
+            other.labels = self.labels[:]
+            other.__parent = self.__parent.copy()
+            other.__nextLabel = self.__nextLabel
+        return other
+
+    def rebuild(self):
+        """
+        Relabels every cell from scratch.
+        """
+        cols, rows, blocked = self.cols, self.rows, self.blocked
+        self.labels = array.array('l', [0]) * (cols*rows)
+        self.__parent = {}
+        self.__nextLabel = 1
+        for i in xrange(cols*rows):
+            if not blocked[i] and not self.labels[i]:
+                self.__flood([(i % cols, i // cols)], self.__newLabel())
+
+    def touch(self, x, y):
+        """
+        Notes that the blocking state of cell C{(x,y)} has changed.
+        """
+        if self.labels is None:
+            return
+        i = y*self.cols + x
+        if not self.blocked[i] and not self.labels[i]:
+            self.__opened(x, y)
+        elif self.blocked[i] and self.labels[i]:
+            self.labels[i] = 0
+            self.__closed(x, y)
+
+    def componentOf(self, (x, y)):
+        """
+        Returns the label of the component containing the open cell C{(x,y)},
+        or 0 if the cell is blocked. Two cells are connected iff their labels
+        are equal.
+        """
+        if self.labels is None:
+            self.rebuild()
+        return self.__find(self.labels[y*self.cols + x])
+
+    def reachable(self, start, goal):
+        """
+        Returns C{True} iff a path exists from C{start} to C{goal}. As with
+        the searches in this module, the start may be blocked (in which case
+        it is left through any open neighbor) but the goal may not.
+        """
+        if start == goal:
+            return True
+        target = self.componentOf(goal)
+        if not target:
+            return False
+        if self.componentOf(start) == target:
+            return True
+        sx, sy = start
+        if self.blocked[sy*self.cols + sx]:
+            for dx, dy in DIRECTIONS:
+                nx, ny = sx+dx, sy+dy
+                if 0 <= nx < self.cols and 0 <= ny < self.rows and \
+                        self.componentOf((nx, ny)) == target:
+                    return True
+        return False
+
+    def componentSizes(self):
+        """
+        Returns a C{dict} mapping the label of each component to the number of
+        cells in it.
+        """
+        if self.labels is None:
+            self.rebuild()
+        sizes = {}
+        find = self.__find
+        for label in self.labels:
+            if label:
+                root = find(label)
+                sizes[root] = sizes.get(root, 0) + 1
+        return sizes
+
+    def __newLabel(self):
+        label = self.__nextLabel
+        self.__nextLabel += 1
+        return label
+
+    def __find(self, label):
+        parent = self.__parent
+        root = label
+        while root in parent:
+            root = parent[root]
+        # path compression
+        while label != root:
+            nxt = parent[label]
+            parent[label] = root
+            label = nxt
+        return root
+
+    def __openNeighbors(self, x, y):
+        cols, rows, blocked = self.cols, self.rows, self.blocked
+        for dx, dy in DIRECTIONS:
+            nx, ny = x+dx, y+dy
+            if 0 <= nx < cols and 0 <= ny < rows and not blocked[ny*cols + nx]:
+                yield nx, ny
+
+    def __flood(self, seeds, label):
+        labels, cols = self.labels, self.cols
+        queue = deque()
+        for x, y in seeds:
+            if labels[y*cols + x] != label:
+                labels[y*cols + x] = label
+                queue.append((x, y))
+        while queue:
+            x, y = queue.popleft()
+            for nx, ny in self.__openNeighbors(x, y):
+                if labels[ny*cols + nx] != label:
+                    labels[ny*cols + nx] = label
+                    queue.append((nx, ny))
+
+    def __opened(self, x, y):
+        roots = set([self.componentOf(n) for n in self.__openNeighbors(x, y)])
+        roots.discard(0)
+        if not roots:
+            self.labels[y*self.cols + x] = self.__newLabel()
+            return
+        root = roots.pop()
+        for other in roots:
+            self.__parent[other] = root
+        self.labels[y*self.cols + x] = root
+
+    def __closed(self, x, y):
+        # Group the open cells around (x,y) by whether they touch each other
+        # without going through (x,y). If there's only one group, nothing can
+        # have been cut off.
+        cols, rows, blocked = self.cols, self.rows, self.blocked
+        ring = []
+        for dx, dy in self.RING:
+            nx, ny = x+dx, y+dy
+            if 0 <= nx < cols and 0 <= ny < rows and not blocked[ny*cols + nx]:
+                ring.append((nx, ny))
+        groups = []
+        for cell in ring:
+            touching = [g for g in groups if [c for c in g \
+                if abs(c[0]-cell[0]) <= 1 and abs(c[1]-cell[1]) <= 1]]
+            merged = [cell]
+            for g in touching:
+                merged.extend(g)
+                groups.remove(g)
+            groups.append(merged)
+        if len(groups) <= 1:
+            return
+
+        # Explore outward from each group in turn, one cell at a time. Groups
+        # whose explorations meet are merged; a group whose exploration runs
+        # out has been cut off from the rest, and gets a label of its own.
+        owner = {}
+        merged = {}
+        frontiers = {}
+        for g, seeds in enumerate(groups):
+            frontiers[g] = deque(seeds)
+            for cell in seeds:
+                owner[cell] = g
+        def findGroup(g):
+            while g in merged:
+                g = merged[g]
+            return g
+
+        active = set(frontiers)
+        while len(active) > 1:
+            for g in list(active):
+                if g not in active:
+                    continue
+                frontier = frontiers[g]
+                if not frontier:
+                    cut = [c for c, o in owner.iteritems() \
+                            if findGroup(o) == g]
+                    label = self.__newLabel()
+                    for cx, cy in cut:
+                        self.labels[cy*cols + cx] = label
+                    active.discard(g)
+                    if len(active) <= 1:
+                        break
+                    continue
+                cx, cy = frontier.popleft()
+                for n in self.__openNeighbors(cx, cy):
+                    o = owner.get(n)
+                    if o is None:
+                        owner[n] = g
+                        frontier.append(n)
+                    else:
+                        o = findGroup(o)
+                        if o != g:
+                            merged[o] = g
+                            frontier.extend(frontiers.pop(o))
+                            active.discard(o)
+
+#==============================================================================
+#{ Path-finding service
+
+class PathFuture(object):
+    """
+    The pending result of a path request made to a L{PathService}.
+
+    @ivar start: The requested start position.
+    @ivar goal: The requested goal position.
+    """
+
+    def __init__(self, start, goal):
+        self.start, self.goal = start, goal
+        self._done = False
+        self._path = None
+
+    def __repr__(self):
+        return 'PathFuture(%r, %r, done=%r)' % (self.start, self.goal,
+                self._done)
+
+    def done(self):
+        """
+        Returns C{True} once the result is available.
+        """
+        return self._done
+
+    def result(self):
+        """
+        Returns the path found (a list of C{(col,row)}-tuples, possibly
+        partial if the request had an expansion budget), or C{None} if there
+        is no path. Raises C{RuntimeError} if the request isn't L{done} yet.
+        """
+        if not self._done:
+            raise RuntimeError('Path request %r->%r has not completed.' % \
+                    (self.start, self.goal))
+        return self._path
+
+    def _setResult(self, path):
+        self._path = path
+        self._done = True
+
+class PathService(object):
+    """
+    Runs batches of path requests in a pool of worker processes, against a
+    read-only snapshot of a map's move blockers, so that the path-finding
+    for a large turn's worth of monsters can use every core while the main
+    process gets on with the frame. A typical turn looks like::
+
+        service.publish(map)        # after the map has changed
+        futures = [service.request(m.pos, m.target) for m in monsters]
+        service.dispatch()
+        ...
+        # on the next frame(s):
+        service.collect()
+        for m, f in zip(monsters, futures):
+            if f.done():
+                m.path = f.result()
+
+    Requests are answered by L{jumpPointSearch}, or, if given an expansion
+    budget, by a L{PathSearch} that may return a partial path, so results are
+    the same as those of the corresponding L{Map2D.getAStarPath} options.
+
+    With C{processes=0} (or where C{multiprocessing} is unavailable), every
+    request is instead answered in-process, in order, as soon as it is
+    dispatched: deterministic, and convenient for tests and replays.
+
+    A snapshot is sent to the workers compressed, with each batch, and
+    decompressed by each worker at most once per L{publish}. Alternatively,
+    given a L{map.SharedMapSnapshot}, the workers read its C{'moveBlockers'}
+    layer directly from shared memory, and L{publish} only rewrites the
+    regions of the map that have changed. Don't L{publish} while dispatched
+    requests are still pending in that case, since they read the same
+    memory.
+    """
+
+    def __init__(self, processes=None, batchSize=32, shared=None):
+        """
+        @param processes: The number of worker processes; C{None} means one
+        per CPU, and C{0} means answer requests in-process.
+        @param batchSize: The number of requests sent to a worker at a time.
+        @param shared: An optional L{map.SharedMapSnapshot} (or anything
+        with C{cols}, C{rows}, C{publish}, C{version} and C{layer}) for the
+        workers to read instead of receiving compressed snapshots.
+        """
+        if multiprocessing is None:
+            processes = 0
+        elif processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.batchSize = batchSize
+        self.shared = shared
+        self.__pool = None
+        self.__snapshot = None
+        self.__publications = 0
+        self.__queued = []      # [(future, maxExpansions)]
+        self.__pending = []     # [(AsyncResult, [future])]
+
+    def __repr__(self):
+        return 'PathService(processes=%r)' % (self.processes,)
+
+    def __getstate__(self):
+        raise TypeError('PathService instances cannot be pickled.')
+
+    def publish(self, map):
+        """
+        Takes a snapshot of the move blockers of C{map} (a L{Map2D}, or
+        anything with C{cols}, C{rows} and C{moveBlockers} attributes), to be
+        used for all requests dispatched from now on. Requests already
+        dispatched keep using the snapshot they were dispatched with, unless
+        the service has a L{shared} snapshot, which is simply brought up to
+        date.
+        """
+        self.__publications += 1
+        if self.shared is not None:
+            self.shared.publish(map)
+            self.__snapshot = (None, self.shared.cols, self.shared.rows,
+                               None, None)
+            return
+        blocked = map.moveBlockers
+        self.__snapshot = ((os.getpid(), id(self), self.__publications),
+                map.cols, map.rows, blocked.typecode,
+                zlib.compress(blocked.tostring(), 1))
+
+    def request(self, start, goal, maxExpansions=None):
+        """
+        Queues a request for a path from C{start} to C{goal}, to be sent to
+        the workers by the next L{dispatch}.
+
+        @return: A L{PathFuture} for the result.
+        """
+        future = PathFuture(start, goal)
+        self.__queued.append((future, maxExpansions))
+        return future
+
+    def dispatch(self):
+        """
+        Sends all queued requests to the workers, in batches.
+        """
+        if not self.__queued:
+            return
+        if self.__snapshot is None:
+            raise ValueError('PathService has no map snapshot; '
+                             'call publish() first.')
+        queued, self.__queued = self.__queued, []
+        for i in xrange(0, len(queued), self.batchSize):
+            batch = queued[i:i+self.batchSize]
+            futures = [f for f, budget in batch]
+            requests = [(f.start, f.goal, budget) for f, budget in batch]
+            if not self.processes:
+                for f, path in zip(futures, _answerPathRequests(
+                        self.__snapshot, requests, self.shared)):
+                    f._setResult(path)
+                continue
+            if not self.__pool:
+                self.__pool = multiprocessing.Pool(self.processes,
+                        _attachSharedSnapshot, (self.shared,))
+            result = self.__pool.apply_async(_answerPathRequests,
+                    (self.__snapshot, requests))
+            self.__pending.append((result, futures))
+
+    def collect(self, wait=False):
+        """
+        Fills in the results of every dispatched batch that has finished,
+        without blocking unless C{wait} is true, in which case it waits for
+        all of them.
+
+        @return: A list of the L{PathFuture}s completed by this call.
+        """
+        completed = []
+        stillPending = []
+        for result, futures in self.__pending:
+            if wait or result.ready():
+                for f, path in zip(futures, result.get()):
+                    f._setResult(path)
+                completed.extend(futures)
+            else:
+                stillPending.append((result, futures))
+        self.__pending = stillPending
+        return completed
+
+    def pending(self):
+        """
+        Returns the number of requests dispatched but not yet collected.
+        """
+        return sum([len(futures) for result, futures in self.__pending])
+
+    def close(self):
+        """
+        Shuts down the worker processes. Uncollected results are lost.
+        """
+        if self.__pool:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+        self.__pending = []
+
+# A worker's most recently decoded snapshot: (key, blocked)
+_workerSnapshot = (None, None)
+
+# The SharedMapSnapshot a worker inherited from its PathService, if any
+_workerShared = None
+
+def _attachSharedSnapshot(shared):
+    # Pool initializer: remembers the worker's shared snapshot.
+    global _workerShared
+    if shared is not None:
+        shared.validate()
+    _workerShared = shared
+
+def _answerPathRequests(snapshot, requests, shared=None):
+    # Runs in the workers (or in-process): answers a batch of
+    # (start, goal, maxExpansions) requests against a published snapshot.
+    global _workerSnapshot
+    key, cols, rows, typecode, data = snapshot
+    if key is None:
+        # The blockers are in shared memory
+        blocked = (shared or _workerShared).layer('moveBlockers')
+    else:
+        if _workerSnapshot[0] != key:
+            blocked = array.array(typecode)
+            blocked.fromstring(zlib.decompress(data))
+            _workerSnapshot = (key, blocked)
+        blocked = _workerSnapshot[1]
+
+    paths = []
+    for start, goal, maxExpansions in requests:
+        gx, gy = goal
+        if not (0 <= gx < cols and 0 <= gy < rows):
+            paths.append(None)
+        elif maxExpansions is None:
+            paths.append(jumpPointSearch(cols, rows, blocked, start, goal))
+        else:
+            search = PathSearch(start, goal,
+                    gridSuccessors(cols, rows, blocked), octile)
+            search.step(maxExpansions)
+            paths.append(search.bestPath())
+    return paths
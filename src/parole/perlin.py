@@ -16,18 +16,22 @@
 #Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 Implements perlin noise. Provides a line-for-line Python transcription of Kevin
-Perlin's reference implementation (Java) of improved Perlin noise.
+Perlin's reference implementation (Java) of improved Perlin noise, and
+L{noiseGrid}, which evaluates the same noise (optionally fractal) over a whole
+grid of points at once.
 """
-import math
+import math, array, random
 
 def noise(x, y, z):
     """
     Returns the perlin noise at the given floating point coordinates.
     """
     # Find unit cube that contains point
-    X = int(x) & 255
-    Y = int(y) & 255
-    Z = int(z) & 255
+    # (Floored, as in the reference, not truncated toward 0, which would
+    # pick the wrong cube for negative coordinates.)
+    X = int(math.floor(x)) & 255
+    Y = int(math.floor(y)) & 255
+    Z = int(math.floor(z)) & 255
     
     # Find relative x,y,z of point in cube
     x -= math.floor(x)
@@ -63,9 +67,11 @@ def __lerp(t, a, b):
 def __grad(hash, x, y, z):
     # Conver low 4 bits of hash code into 12 gradient directions
     h = hash & 15
-    u = h < 8 and x or y
-    v = h < 4 and y or ((h==12 or h==14) and x or z)
-    return ((h&1) == 0 and u or -u) + ((h&2) == 0 and v or -v)
+    # (Conditional expressions, not and/or, which would pick the wrong
+    # branch whenever a coordinate is 0.)
+    u = x if h < 8 else y
+    v = y if h < 4 else (x if h == 12 or h == 14 else z)
+    return (u if (h&1) == 0 else -u) + (v if (h&2) == 0 else -v)
 
 __p = range(512)
 __permutation = [ 151,160,137,91,90,15,
@@ -86,3 +92,132 @@ __permutation = [ 151,160,137,91,90,15,
 for i in xrange(256):
     __p[i] =  __p[256+i] = __permutation[i]
 
+
+#==============================================================================
+#{ Noise over grids
+
+# The gradient selected by the low 4 bits of a hash, as in the reference
+# implementation
+GRADIENTS = ((1,1,0), (-1,1,0), (1,-1,0), (-1,-1,0),
+             (1,0,1), (-1,0,1), (1,0,-1), (-1,0,-1),
+             (0,1,1), (0,-1,1), (0,1,-1), (0,-1,-1),
+             (1,1,0), (0,-1,1), (-1,1,0), (0,-1,-1))
+
+# The cube corners, in the order their contributions are blended
+CORNERS = ((0,0,0), (1,0,0), (0,1,0), (1,1,0),
+           (0,0,1), (1,0,1), (0,1,1), (1,1,1))
+
+def permutation(seed=None):
+    """
+    Returns a permutation table for L{noiseGrid}: a shuffling of
+    C{range(256)}, repeated twice. With no C{seed}, it's the reference
+    implementation's table, the one L{noise} uses; otherwise, it's shuffled
+    by a C{random.Random(seed)}, so that the same seed always gives the same
+    noise.
+    """
+    if seed is None:
+        table = list(__permutation)
+    else:
+        table = range(256)
+        random.Random(seed).shuffle(table)
+    return table + table
+
+def __fadeList(ts):
+    return [t * t * t * (t * (t * 6 - 15) + 10) for t in ts]
+
+def __gridOctave(x0, y0, step, z, cols, rows, p):
+    # One octave of noise at (x0 + i*step, y0 + j*step, z), as a list.
+    # Everything that depends only on the column, the row or the cube is
+    # computed once; each point then costs 8 multiply-adds and 7 lerps.
+    floor = math.floor
+    xs = [x0 + i*step for i in xrange(cols)]
+    colX = [int(floor(x)) & 255 for x in xs]
+    colF = [x - floor(x) for x in xs]
+    colU = __fadeList(colF)
+    Z = int(floor(z)) & 255
+    zf = z - floor(z)
+    w = __fadeList([zf])[0]
+
+    values = []
+    for j in xrange(rows):
+        y = y0 + j*step
+        Y = int(floor(y)) & 255
+        yf = y - floor(y)
+        v = __fadeList([yf])[0]
+        # For each cube along the row, the contribution of each corner as
+        # a*xf + k, where xf is the point's offset within the cube
+        cubes = {}
+        for X, xf, u in zip(colX, colF, colU):
+            c = cubes.get(X)
+            if c is None:
+                A, B = p[X]+Y, p[X+1]+Y
+                AA, AB, BA, BB = p[A]+Z, p[A+1]+Z, p[B]+Z, p[B+1]+Z
+                hashes = (p[AA], p[BA], p[AB], p[BB],
+                          p[AA+1], p[BA+1], p[AB+1], p[BB+1])
+                c = []
+                for h, (dx, dy, dz) in zip(hashes, CORNERS):
+                    gx, gy, gz = GRADIENTS[h & 15]
+                    c.append(gx)
+                    c.append(gy*(yf - dy) + gz*(zf - dz) - gx*dx)
+                c = cubes[X] = tuple(c)
+            a0, k0, a1, k1, a2, k2, a3, k3, a4, k4, a5, k5, a6, k6, a7, k7 = c
+            n0 = a0*xf + k0
+            n1 = a2*xf + k2
+            n2 = a4*xf + k4
+            n3 = a6*xf + k6
+            n0 += u*(a1*xf + k1 - n0)
+            n1 += u*(a3*xf + k3 - n1)
+            n2 += u*(a5*xf + k5 - n2)
+            n3 += u*(a7*xf + k7 - n3)
+            n0 += v*(n1 - n0)
+            n2 += v*(n3 - n2)
+            values.append(n0 + w*(n2 - n0))
+    return values
+
+def noiseGrid((x0, y0), (cols, rows), step=1.0, z=0.0, octaves=1,
+        persistence=0.5, lacunarity=2.0, ridged=False, perm=None, out=None,
+        typecode='d'):
+    """
+    Evaluates noise at each point of a C{cols}-by-C{rows} grid whose first
+    point is C{(x0, y0)} and whose points are C{step} apart, all at depth
+    C{z}, in one call.
+
+    With more than one octave, the result is fractal: each octave is
+    C{lacunarity} times the frequency and C{persistence} times the amplitude
+    of the one before, and the sum is divided by the total amplitude. Plain
+    fractional Brownian motion (the default) ranges over about [-1, 1] like
+    L{noise}; C{ridged} noise sums C{(1 - |n|)**2} instead, for ranges of
+    sharp crests (mountains, canyons), and ranges over [0, 1].
+
+    @param perm: A permutation table from L{permutation}; the reference
+    table by default.
+    @param out: An C{array} of at least C{cols*rows} elements to fill in
+    place, e.g., C{array.array('f', ...)} for single precision; if not given,
+    a new C{array} with the given C{typecode} is returned.
+    @return: The values, as a flat, row-major C{array} (C{out}, if given).
+    """
+    if octaves < 1:
+        raise ValueError('noiseGrid needs at least one octave, not %r.' %
+                octaves)
+    if perm is None:
+        perm = __p
+    freq, amp, totalAmp = 1.0, 1.0, 0.0
+    total = None
+    for octave in xrange(octaves):
+        values = __gridOctave(x0*freq, y0*freq, step*freq, z*freq, cols,
+                              rows, perm)
+        if ridged:
+            values = [(1.0 - abs(n))**2 for n in values]
+        if total is None:
+            total = [amp*n for n in values]
+        else:
+            total = [t + amp*n for t, n in zip(total, values)]
+        totalAmp += amp
+        freq *= lacunarity
+        amp *= persistence
+    if octaves > 1:
+        total = [t / totalAmp for t in total]
+    if out is None:
+        return array.array(typecode, total)
+    out[:len(total)] = array.array(out.typecode, total)
+    return out
@@ -0,0 +1,331 @@
+#Python Advanced Roguelike Engine (Parole)
+#Copyright (C) 2006-2012 Max Bane
+#
+#This program is free software; you can redistribute it and/or
+#modify it under the terms of the GNU General Public License
+#as published by the Free Software Foundation; either version 2
+#of the License, or (at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Labeling of the cells of a grid by region (room, cave, corridor system),
+used by L{parole.map.Map2D.regionIndex}. As in L{pathfind}, the grid is
+described by its dimensions and a flat, row-major sequence of blocking
+flags.
+"""
+
+import array
+from collections import deque
+
+# Regions are 4-connected, so that rooms touching only at a corner are
+# separate.
+STEPS = ((1,0), (-1,0), (0,1), (0,-1))
+
+#==============================================================================
+
+class Region(object):
+    """
+    A region of a L{RegionIndex}.
+
+    @ivar id: The region's label, as stored in L{RegionIndex.labels}.
+    @ivar name: An optional name given when the region was defined.
+    @ivar data: Optional user data given when the region was defined (e.g.,
+    the room object of a generator).
+    @ivar explicit: C{True} if the region was defined with
+    L{RegionIndex.defineRegion}, C{False} if it was found automatically.
+    @ivar size: The number of cells in the region.
+    @ivar bounds: C{(x0, y0, x1, y1)}, inclusive, containing every cell of
+    the region. Not shrunk when an automatic region loses cells, so it may
+    be larger than necessary.
+    """
+
+    def __init__(self, id, name=None, data=None, explicit=False):
+        self.id = id
+        self.name = name
+        self.data = data
+        self.explicit = explicit
+        self.size = 0
+        self.bounds = None
+
+    def __repr__(self):
+        return 'Region(%r, name=%r, size=%r)' % (self.id, self.name,
+                self.size)
+
+    def _include(self, x0, y0, x1=None, y1=None):
+        # Grows bounds to include the cell (x0,y0), or the box to (x1,y1)
+        if x1 is None:
+            x1, y1 = x0, y0
+        if self.bounds is not None:
+            bx0, by0, bx1, by1 = self.bounds
+            x0, y0, x1, y1 = min(bx0, x0), min(by0, y0), max(bx1, x1), \
+                    max(by1, y1)
+        self.bounds = (x0, y0, x1, y1)
+
+class RegionIndex(object):
+    """
+    Labels every cell of a grid with the L{Region} containing it, for
+    constant-time answers to "which room is the player in?". Regions come
+    from two sources:
+
+        - Explicit regions, defined with L{defineRegion} (e.g., by a map
+          generator, for each room it lays). Their cells are theirs whether
+          blocked or not.
+        - Automatic regions: the 4-connected areas of unblocked cells not in
+          any explicit region.
+
+    Call L{touch} whenever a cell becomes blocked or unblocked (a door
+    closes, a wall is dug out); automatic regions are merged or split to
+    match, at a cost proportional to the smaller of the regions involved.
+
+    @ivar labels: The id of the L{Region} containing each cell, or 0 for
+    blocked cells outside explicit regions, as a flat, row-major C{array}.
+    Rebuilt lazily after regions are defined; use L{regionAt} rather than
+    reading it directly.
+    @ivar regions: A dictionary mapping ids to L{Region}s.
+    """
+
+    def __init__(self, cols, rows, blocked):
+        self.cols, self.rows = cols, rows
+        self.blocked = blocked
+        self.labels = array.array('l', [0]) * (cols*rows)
+        self.regions = {}
+        self.__nextId = 1
+        self.__zones = []   # [(region, [cell indices])], in definition order
+        self.__stale = True
+
+    def __newRegion(self, name=None, data=None, explicit=False):
+        region = Region(self.__nextId, name, data, explicit)
+        self.__nextId += 1
+        self.regions[region.id] = region
+        return region
+
+    def defineRegion(self, cells, name=None, data=None):
+        """
+        Defines an explicit region. Cells already in another explicit region
+        are taken from it.
+
+        @param cells: A pygame C{Rect} or a sequence of C{(x,y)} cells; cells
+        outside the grid are ignored.
+        @return: The new L{Region}.
+        """
+        cols, rows = self.cols, self.rows
+        if hasattr(cells, 'colliderect'):
+            r = cells
+            cells = [(x, y) for y in xrange(r.top, r.bottom)
+                     for x in xrange(r.left, r.right)]
+        indices = [y*cols + x for x, y in cells
+                   if 0 <= x < cols and 0 <= y < rows]
+        region = self.__newRegion(name, data, True)
+        self.__zones.append((region, indices))
+        self.__stale = True
+        return region
+
+    def removeRegion(self, region):
+        """
+        Removes an explicit region; its cells go back to being labeled
+        automatically.
+        """
+        self.__zones = [z for z in self.__zones if z[0] is not region]
+        del self.regions[region.id]
+        self.__stale = True
+
+    def rebuild(self):
+        """
+        Relabels every cell from scratch. Called automatically when needed.
+        """
+        cols, rows, blocked = self.cols, self.rows, self.blocked
+        labels = self.labels = array.array('l', [0]) * (cols*rows)
+        self.regions = {}
+        for region, indices in self.__zones:
+            self.regions[region.id] = region
+            for i in indices:
+                labels[i] = region.id
+        for region, indices in self.__zones:
+            # Keep only the cells a later region didn't take
+            indices[:] = [i for i in indices if labels[i] == region.id]
+            region.size, region.bounds = len(indices), None
+            if indices:
+                xs = [i % cols for i in indices]
+                # (in whatever order defineRegion was given them)
+                region._include(min(xs), min(indices) // cols,
+                                max(xs), max(indices) // cols)
+        for i in xrange(cols*rows):
+            if not labels[i] and not blocked[i]:
+                region = self.__newRegion()
+                self.__fill(i % cols, i // cols, 0, region)
+        self.__stale = False
+
+    def __fill(self, x, y, old, region):
+        # Relabels the 4-connected cells labeled old (and unblocked, if old
+        # is 0) reachable from (x,y) as region.
+        cols, rows, blocked, labels = self.cols, self.rows, self.blocked, \
+                self.labels
+        new = region.id
+        labels[y*cols + x] = new
+        x0, y0, x1, y1 = x, y, x, y
+        size = 1
+        stack = [(x, y)]
+        while stack:
+            x, y = stack.pop()
+            for dx, dy in STEPS:
+                nx, ny = x+dx, y+dy
+                if 0 <= nx < cols and 0 <= ny < rows:
+                    j = ny*cols + nx
+                    if labels[j] == old and (old or not blocked[j]):
+                        labels[j] = new
+                        size += 1
+                        if nx < x0: x0 = nx
+                        elif nx > x1: x1 = nx
+                        if ny < y0: y0 = ny
+                        elif ny > y1: y1 = ny
+                        stack.append((nx, ny))
+        region.size += size
+        region._include(x0, y0, x1, y1)
+
+    def regionAt(self, x, y):
+        """
+        Returns the L{Region} containing cell C{(x,y)}, or C{None} if it's
+        blocked and outside any explicit region.
+        """
+        if self.__stale:
+            self.rebuild()
+        return self.regions.get(self.labels[y*self.cols + x])
+
+    def cellsOf(self, region):
+        """
+        Returns a list of the C{(x,y)} cells in C{region}.
+        """
+        if self.__stale:
+            self.rebuild()
+        if region.bounds is None:
+            return []
+        cols, labels, rid = self.cols, self.labels, region.id
+        x0, y0, x1, y1 = region.bounds
+        return [(x, y) for y in xrange(y0, y1+1) for x in xrange(x0, x1+1)
+                if labels[y*cols + x] == rid]
+
+    def touch(self, x, y):
+        """
+        Notifies the index that cell C{(x,y)} has become blocked or
+        unblocked.
+        """
+        if self.__stale:
+            return
+        i = y*self.cols + x
+        label = self.labels[i]
+        if label and self.regions[label].explicit:
+            return
+        if self.blocked[i]:
+            if label:
+                self.__closed(x, y, label)
+        elif not label:
+            self.__opened(x, y)
+
+    def __autoNeighbors(self, x, y, label=None):
+        # The unblocked 4-neighbors of (x,y) in automatic regions (or with
+        # the given label), as [(label, (nx,ny))].
+        cols, rows, labels, regions = self.cols, self.rows, self.labels, \
+                self.regions
+        found = []
+        for dx, dy in STEPS:
+            nx, ny = x+dx, y+dy
+            if 0 <= nx < cols and 0 <= ny < rows:
+                l = labels[ny*cols + nx]
+                if l and (l == label or
+                          (label is None and not regions[l].explicit)):
+                    found.append((l, (nx, ny)))
+        return found
+
+    def __opened(self, x, y):
+        neighbors = self.__autoNeighbors(x, y)
+        if not neighbors:
+            region = self.__newRegion()
+        else:
+            # Merge everything into the largest neighboring region
+            region = max([self.regions[l] for l, p in neighbors],
+                         key=lambda r: r.size)
+            for l, (nx, ny) in neighbors:
+                if l != region.id and l in self.regions:
+                    del self.regions[l]
+                    self.__fill(nx, ny, l, region)
+        self.labels[y*self.cols + x] = region.id
+        region.size += 1
+        region._include(x, y)
+
+    def __closed(self, x, y, label):
+        cols, labels = self.cols, self.labels
+        region = self.regions[label]
+        labels[y*cols + x] = 0
+        region.size -= 1
+        starts = [p for l, p in self.__autoNeighbors(x, y, label)]
+        if not starts:
+            if not region.size:
+                del self.regions[label]
+            return
+        if len(starts) == 1:
+            return
+
+        # Breadth-first searches from each neighbor, in lockstep, merging
+        # when they meet, until at most one is still going: every search
+        # that ran out first found a separate piece of the region.
+        owner = {}                          # cell -> search
+        merged = range(len(starts))         # search -> the search it joined
+        def find(s):
+            while merged[s] != s:
+                s = merged[s]
+            return s
+        queues = {}
+        for s, p in enumerate(starts):
+            if p in owner:
+                merged[s] = find(owner[p])
+            else:
+                owner[p] = s
+                queues[s] = deque([p])
+        rows = self.rows
+        finished = []
+        while len(queues) > 1:
+            for s in queues.keys():
+                if s not in queues:
+                    continue
+                queue = queues[s]
+                if not queue:
+                    del queues[s]
+                    finished.append(s)
+                    continue
+                cx, cy = queue.popleft()
+                for dx, dy in STEPS:
+                    nx, ny = cx+dx, cy+dy
+                    if not (0 <= nx < cols and 0 <= ny < rows) or \
+                            labels[ny*cols + nx] != label:
+                        continue
+                    p = (nx, ny)
+                    o = owner.get(p)
+                    if o is None:
+                        owner[p] = s
+                        queue.append(p)
+                    else:
+                        o = find(o)
+                        if o != s:
+                            merged[o] = s
+                            queue.extend(queues.pop(o, ()))
+        # The search still going (or, if all finished, the last) keeps the
+        # old label; every other finished search's piece is relabeled.
+        if queues:
+            keep = queues.keys()[0]
+        else:
+            keep = finished.pop()
+        for s in finished:
+            if find(s) == keep:
+                continue
+            piece = self.__newRegion()
+            sx, sy = starts[s]
+            self.__fill(sx, sy, label, piece)
+            region.size -= piece.size
@@ -0,0 +1,205 @@
+#Python Advanced Roguelike Engine (Parole)
+#Copyright (C) 2006-2012 Max Bane
+#
+#This program is free software; you can redistribute it and/or
+#modify it under the terms of the GNU General Public License
+#as published by the Free Software Foundation; either version 2
+#of the License, or (at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Registries of the objects on a map by kind, for per-turn systems (AI,
+regeneration, status effects) that need to visit every object of some kind
+without walking the map's L{Tile}s. See L{parole.map.Map2D.objectRegistry}.
+"""
+
+import array
+from spatial import objectKeys
+
+#==============================================================================
+
+def objectX(obj):
+    return obj.pos[0]
+
+def objectY(obj):
+    return obj.pos[1]
+
+def objectLayer(obj):
+    return obj.layer
+
+def objectBlocksLOS(obj):
+    return obj.blocksLOS and 1 or 0
+
+def objectBlocksMove(obj):
+    return obj.blocksMove and 1 or 0
+
+# (name, typecode, getter)
+defaultColumns = [('x', 'i', objectX),
+                  ('y', 'i', objectY),
+                  ('layer', 'i', objectLayer),
+                  ('blocksLOS', 'b', objectBlocksLOS),
+                  ('blocksMove', 'b', objectBlocksMove)]
+
+class KindTable(object):
+    """
+    The objects of one kind in an L{ObjectRegistry}, stored densely: the
+    list L{objects} together with one C{array} per column, where element
+    C{i} of each column holds that attribute of C{objects[i]}. Removing an
+    object moves the last one into its slot, so the order is arbitrary but
+    there are never any holes.
+
+    @ivar objects: The objects of this kind.
+    @ivar columns: A dictionary mapping column names to C{array}s.
+    """
+
+    def __init__(self, columnSpecs):
+        self.columnSpecs = columnSpecs
+        self.objects = []
+        self.columns = dict([(name, array.array(typecode))
+                             for name, typecode, getter in columnSpecs])
+        self.__slots = {}   # obj -> index into objects
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, obj):
+        return obj in self.__slots
+
+    def add(self, obj):
+        self.__slots[obj] = len(self.objects)
+        self.objects.append(obj)
+        for name, typecode, getter in self.columnSpecs:
+            self.columns[name].append(getter(obj))
+
+    def remove(self, obj):
+        slot = self.__slots.pop(obj)
+        last = self.objects.pop()
+        lastSlot = len(self.objects)
+        for name, typecode, getter in self.columnSpecs:
+            col = self.columns[name]
+            val = col.pop()
+            if slot != lastSlot:
+                col[slot] = val
+        if slot != lastSlot:
+            self.objects[slot] = last
+            self.__slots[last] = slot
+
+    def refresh(self, obj):
+        slot = self.__slots[obj]
+        for name, typecode, getter in self.columnSpecs:
+            self.columns[name][slot] = getter(obj)
+
+class ObjectRegistry(object):
+    """
+    Keeps the objects on a map in a L{KindTable} per key (class or tag; see
+    L{spatial.objectKeys}), so that, e.g., every C{Monster} can be visited
+    with::
+
+        for monster in registry.members(Monster):
+            monster.act()
+
+    or, touching only the hot attributes, column by column::
+
+        table = registry.table(Monster)
+        for x, y in zip(table.columns['x'], table.columns['y']):
+            ...
+
+    An object's keys are computed when it's added; its columns are
+    recomputed whenever the containing L{Map2D} sees it change (being
+    moved, or having its C{layer}, C{blocksLOS} or C{blocksMove} set), and
+    by L{refresh}.
+    """
+
+    def __init__(self, keyFunc=objectKeys, columns=None):
+        """
+        @param keyFunc: A callable returning the keys to file an object
+        under.
+        @param columns: A list of C{(name, typecode, getter)} column
+        specifications, where C{getter(obj)} returns the value to store.
+        Defaults to L{defaultColumns}: C{x}, C{y}, C{layer}, C{blocksLOS}
+        and C{blocksMove}.
+        """
+        self.keyFunc = keyFunc
+        if columns is None:
+            columns = defaultColumns
+        self.columnSpecs = list(columns)
+        self.__tables = {}  # key -> KindTable
+        self.__keys = {}    # obj -> keys
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def __contains__(self, obj):
+        return obj in self.__keys
+
+    def add(self, obj):
+        """
+        Registers C{obj} under each of its keys.
+        """
+        if obj in self.__keys:
+            self.remove(obj)
+        keys = self.keyFunc(obj)
+        for key in keys:
+            table = self.__tables.get(key)
+            if table is None:
+                table = self.__tables[key] = KindTable(self.columnSpecs)
+            table.add(obj)
+        self.__keys[obj] = keys
+
+    def remove(self, obj):
+        """
+        Unregisters C{obj}. Raises C{KeyError} if it isn't registered.
+        """
+        for key in self.__keys.pop(obj):
+            table = self.__tables[key]
+            table.remove(obj)
+            if not table:
+                del self.__tables[key]
+
+    def refresh(self, obj):
+        """
+        Recomputes the column values of C{obj}, if it's registered.
+        """
+        for key in self.__keys.get(obj, ()):
+            self.__tables[key].refresh(obj)
+
+    def keys(self):
+        """
+        Returns a list of the keys that have any objects registered.
+        """
+        return self.__tables.keys()
+
+    def table(self, key):
+        """
+        Returns the L{KindTable} of the objects registered under C{key}, or
+        an empty one. The table is live: don't add or remove objects (e.g.,
+        move them on the map) while iterating over it; use L{members} for
+        that.
+        """
+        table = self.__tables.get(key)
+        if table is None:
+            return KindTable(self.columnSpecs)
+        return table
+
+    def members(self, key):
+        """
+        Returns a new list of the objects registered under C{key}, which is
+        safe to iterate over while objects come and go.
+        """
+        table = self.__tables.get(key)
+        return table and list(table.objects) or []
+
+    def count(self, key):
+        """
+        Returns the number of objects registered under C{key}.
+        """
+        table = self.__tables.get(key)
+        return table and len(table) or 0
@@ -1005,6 +1005,253 @@ class ShaderGrid(Shader):
         super(ShaderGrid, self).update(blitDirtyOnly=True)
         #parole.debug('ShaderGrid.update: time = %s', parole.time() - time)
 
+#==============================================================================
+
+def _cellsOutside(rect, other):
+    # Yields the (col,row) cells of rect that aren't in other, strip by strip
+    clip = rect.clip(other)
+    for row in xrange(rect.top, rect.bottom):
+        if clip.top <= row < clip.bottom:
+            for col in xrange(rect.left, clip.left):
+                yield col, row
+            for col in xrange(clip.right, rect.right):
+                yield col, row
+        else:
+            for col in xrange(rect.left, rect.right):
+                yield col, row
+
+class GridView(Shader):
+    """
+    A scrollable view of a grid of equally sized shaders: what a
+    L{ShaderGrid} inside a L{ScrollView} displays, but without an image of
+    the whole grid. Only a window of cells around the view (the visible
+    cells plus C{margin} cells on each side) is kept drawn, and only the
+    shaders in it are updated: a shader outside the window isn't made a
+    child of the C{GridView}, so touching it costs nothing until it is
+    scrolled into view. Scrolling within the margin just shows a different
+    part of the window; scrolling further shifts the pixels already drawn
+    and draws only the cells exposed.
+
+    Cells are indexed and assigned like those of a L{ShaderGrid}::
+
+        view[col, row] = shader
+
+    @ivar margin: The number of cells beyond the view on each side to keep
+    drawn.
+    """
+
+    def __init__(self, size, gridSize, tileSize, margin=4, offset=(0,0),
+            name=None):
+        self.__gridSize = gridSize
+        self.__tileSize = tileSize
+        self.__cells = [None] * (gridSize[0]*gridSize[1])
+        self.__offset = (0,0)
+        self.__surface = None
+        self.__window = None    # Rect of the cells drawn on __surface
+        self.__redraw = set()   # cells in the window to draw next update
+        self.margin = margin
+        Shader.__init__(self, name or 'GridView', size)
+        self.offset = offset
+
+    def __getstate__(self):
+        parole.warn('Pickling GridView!')
+        state = super(GridView, self).__getstate__()
+        state['_GridView__surface'] = None
+        state['_GridView__window'] = None
+        return state
+
+    @parole.Property
+    def gridSize():
+        def fget(self):
+            return self.__gridSize
+
+    @parole.Property
+    def tileSize():
+        def fget(self):
+            return self.__tileSize
+
+    @parole.Property
+    def offset():
+        """
+        The position in grid pixels of the upper left corner of the view.
+        """
+        def fget(self):
+            return self.__offset
+        def fset(self, val):
+            vx, vy = val
+            val = (max(0,vx), max(0,vy))
+            if val != self.__offset:
+                self.__offset = val
+                self.touch()
+
+    def __getitem__(self, coords):
+        if type(coords) is not tuple or len(coords) != 2 or \
+                type(coords[0]) is not int or type(coords[1]) is not int:
+            raise TypeError('coords must be a tuple of 2 integers')
+        col, row = coords
+        return self.__cells[row*self.__gridSize[0] + col]
+
+    def __setitem__(self, coords, value):
+        if type(coords) is not tuple or len(coords) != 2 or \
+                type(coords[0]) is not int or type(coords[1]) is not int:
+            raise TypeError('coords must be a tuple of 2 integers')
+        if not (isinstance(value, Shader) or value is None):
+            raise TypeError('value must be a Shader object (or None)')
+        col, row = coords
+        i = row*self.__gridSize[0] + col
+        oldShader = self.__cells[i]
+        if oldShader is value:
+            return
+        self.__cells[i] = value
+        if self.__window and self.__window.collidepoint(col, row):
+            if oldShader:
+                self.__detach(oldShader)
+            if value:
+                self.__attach(value, col, row)
+            self.__redraw.add(coords)
+            self.touch()
+
+    def clearCells(self):
+        """
+        Empties every cell of the grid.
+        """
+        window = self.__window
+        if window:
+            for row in xrange(window.top, window.bottom):
+                for col in xrange(window.left, window.right):
+                    sdr = self[col,row]
+                    if sdr:
+                        self.__detach(sdr)
+        self.__cells = [None] * len(self.__cells)
+        self.__window = None
+        self.touch()
+
+    def posOf(self, coords):
+        tileWidth, tileHeight = self.tileSize
+        return (coords[0]*tileWidth, coords[1]*tileHeight)
+
+    def rectOf(self, coords):
+        return Rect(self.posOf(coords), self.tileSize)
+
+    def contentsSize(self):
+        """
+        The size in pixels of the whole grid.
+        """
+        return (self.__gridSize[0]*self.__tileSize[0],
+                self.__gridSize[1]*self.__tileSize[1])
+
+    def visibleRect(self):
+        """
+        The rectangle of grid pixels in view.
+        """
+        return Rect(self.offset, self.size).clip(Rect((0,0),
+            self.contentsSize()))
+
+    def visibleCells(self):
+        """
+        The rectangle of cells (partly or wholly) in view.
+        """
+        tileWidth, tileHeight = self.tileSize
+        view = self.visibleRect()
+        left, top = view.left / tileWidth, view.top / tileHeight
+        if not (view.width and view.height):
+            return Rect(left, top, 0, 0)
+        return Rect(left, top, (view.right-1)/tileWidth - left + 1,
+                    (view.bottom-1)/tileHeight - top + 1)
+
+    def scrollPixels(self, dx, dy):
+        cSize = self.contentsSize()
+        self.offset = (min(max(self.offset[0]+dx, 0),
+                           max(cSize[0]-self.width, 0)),
+                       min(max(self.offset[1]+dy, 0), cSize[1]-self.height))
+
+    def __attach(self, sdr, col, row):
+        # Make the grid a parent of sdr, so that touching it touches us
+        sdr.parents.add(self)
+        self.positionOf[sdr] = self.posOf((col, row))
+
+    def __detach(self, sdr):
+        sdr.parents.discard(self)
+        self.dirtyPasses.remove(sdr)
+        self.positionOf.pop(sdr, None)
+
+    def __placeWindow(self, visible):
+        # Moves the window, if need be, so that it contains the visible
+        # cells, queueing the cells that become exposed to be drawn
+        cols, rows = self.__gridSize
+        tileWidth, tileHeight = self.__tileSize
+        margin = self.margin
+        width = min(cols, (self.width+tileWidth-1)/tileWidth + 1 + 2*margin)
+        height = min(rows,
+                (self.height+tileHeight-1)/tileHeight + 1 + 2*margin)
+        old = self.__window
+        if old and old.size == (width, height) and old.contains(visible):
+            return
+
+        new = Rect(max(0, min(visible.left - margin, cols - width)),
+                   max(0, min(visible.top - margin, rows - height)),
+                   width, height)
+        if old and old.size == new.size and old.colliderect(new):
+            # Shift what's already drawn, and draw only what's exposed
+            self.__surface.scroll((old.left - new.left)*tileWidth,
+                                  (old.top - new.top)*tileHeight)
+        else:
+            # Nothing drawn can be reused: start afresh on a new surface
+            self.__surface = pygame.Surface((width*tileWidth,
+                height*tileHeight)).convert_alpha()
+            if old:
+                for col, row in _cellsOutside(old, Rect(0,0,0,0)):
+                    sdr = self[col,row]
+                    if sdr:
+                        self.__detach(sdr)
+            old = Rect(0,0,0,0)
+        for col, row in _cellsOutside(old, new):
+            sdr = self[col,row]
+            if sdr:
+                self.__detach(sdr)
+        self.__redraw = set([c for c in self.__redraw
+                             if new.collidepoint(c)])
+        for col, row in _cellsOutside(new, old):
+            sdr = self[col,row]
+            if sdr:
+                self.__attach(sdr, col, row)
+            self.__redraw.add((col, row))
+        self.__window = new
+
+    def __drawCell(self, col, row):
+        tileWidth, tileHeight = self.__tileSize
+        pos = ((col - self.__window.left)*tileWidth,
+               (row - self.__window.top)*tileHeight)
+        display.clearSurface(self.__surface, Rect(pos, self.__tileSize))
+        sdr = self[col,row]
+        if sdr:
+            sdr.update()
+            self.__surface.blit(sdr.image, pos, Rect((0,0), self.__tileSize))
+
+    def update(self, parent=None):
+        if not self.dirty:
+            return
+        self.clean()
+
+        visible = self.visibleRect()
+        if not (visible.width and visible.height):
+            self.image = pygame.Surface(visible.size).convert_alpha()
+            return
+        self.__placeWindow(self.visibleCells())
+
+        # Redraw the cells of the shaders touched since the last update
+        tileWidth, tileHeight = self.__tileSize
+        for sdr in self.dirtyPasses:
+            x, y = self.positionOf[sdr]
+            self.__redraw.add((x/tileWidth, y/tileHeight))
+        self.dirtyPasses.empty()
+        for col, row in self.__redraw:
+            self.__drawCell(col, row)
+        self.__redraw.clear()
+
+        window = self.__window
+        self.image = self.__surface.subsurface(visible.move(
+            -window.left*tileWidth, -window.top*tileHeight))
 
 #==============================================================================
 #{ Passes
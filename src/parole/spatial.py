@@ -0,0 +1,358 @@
+#Python Advanced Roguelike Engine (Parole)
+#Copyright (C) 2006-2012 Max Bane
+#
+#This program is free software; you can redistribute it and/or
+#modify it under the terms of the GNU General Public License
+#as published by the Free Software Foundation; either version 2
+#of the License, or (at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Spatial indexing of the objects on a map, used by L{parole.map.Map2D} to
+answer "what's near here?" queries without looking at every L{Tile}, and of
+the rectangles (rooms) laid by map generators.
+"""
+
+import math, heapq
+
+#==============================================================================
+
+def objectKeys(obj):
+    """
+    Returns the keys under which L{SpatialIndex} files an object by default:
+    its class and every base class but C{object}, plus each of the object's
+    C{tags}, if it has any.
+    """
+    keys = list(type(obj).__mro__[:-1])
+    keys.extend(getattr(obj, 'tags', ()))
+    return keys
+
+class SpatialIndex(object):
+    """
+    Keeps track of where objects are on a grid, in square buckets of cells,
+    separately for each of the keys (classes or tags) an object is filed
+    under, so that finding, say, every C{Monster} within a radius only looks
+    at buckets that actually contain C{Monster}s. Positions are C{(x,y)}
+    tuples; distances are Euclidean, like L{Map2D.dist}.
+
+    An object's keys are computed once, when it is L{add}ed, so an object
+    whose tags change must be removed and added again.
+    """
+
+    def __init__(self, bucketSize=8, keyFunc=objectKeys):
+        """
+        @param bucketSize: The width and height of a bucket, in cells.
+        @param keyFunc: A callable returning the keys to file an object
+        under.
+        """
+        self.bucketSize = bucketSize
+        self.keyFunc = keyFunc
+        self.__buckets = {}     # key -> {(bx,by): set(objs)}
+        self.__where = {}       # obj -> (pos, keys)
+
+    def __len__(self):
+        return len(self.__where)
+
+    def __contains__(self, obj):
+        return obj in self.__where
+
+    def add(self, obj, pos):
+        """
+        Files C{obj} at C{pos}. If it's already in the index, it's moved.
+        """
+        if obj in self.__where:
+            self.remove(obj)
+        keys = self.keyFunc(obj)
+        bs = self.bucketSize
+        b = (pos[0]//bs, pos[1]//bs)
+        buckets = self.__buckets
+        for key in keys:
+            keyBuckets = buckets.get(key)
+            if keyBuckets is None:
+                keyBuckets = buckets[key] = {}
+            objs = keyBuckets.get(b)
+            if objs is None:
+                objs = keyBuckets[b] = set()
+            objs.add(obj)
+        self.__where[obj] = (tuple(pos), keys)
+
+    def remove(self, obj):
+        """
+        Removes C{obj} from the index. Raises C{KeyError} if it isn't there.
+        """
+        pos, keys = self.__where.pop(obj)
+        bs = self.bucketSize
+        b = (pos[0]//bs, pos[1]//bs)
+        buckets = self.__buckets
+        for key in keys:
+            keyBuckets = buckets[key]
+            objs = keyBuckets[b]
+            objs.discard(obj)
+            if not objs:
+                del keyBuckets[b]
+                if not keyBuckets:
+                    del buckets[key]
+
+    def positionOf(self, obj):
+        """
+        Returns the position at which C{obj} is filed.
+        """
+        return self.__where[obj][0]
+
+    def count(self, key):
+        """
+        Returns the number of objects filed under C{key}.
+        """
+        return sum([len(objs) for objs in
+                    self.__buckets.get(key, {}).itervalues()])
+
+    def __bucketsIn(self, key, x0, y0, x1, y1):
+        # The (bucket, objs) pairs of key's buckets overlapping the cells
+        # x0 <= x <= x1, y0 <= y <= y1; looks the buckets up one by one
+        # or scans key's occupied buckets, whichever is fewer.
+        keyBuckets = self.__buckets.get(key)
+        if not keyBuckets:
+            return []
+        bs = self.bucketSize
+        bx0, by0, bx1, by1 = x0//bs, y0//bs, x1//bs, y1//bs
+        if (bx1 - bx0 + 1)*(by1 - by0 + 1) <= len(keyBuckets):
+            found = []
+            for by in xrange(by0, by1+1):
+                for bx in xrange(bx0, bx1+1):
+                    objs = keyBuckets.get((bx,by))
+                    if objs:
+                        found.append(((bx,by), objs))
+            return found
+        return [(b, objs) for b, objs in keyBuckets.iteritems()
+                if bx0 <= b[0] <= bx1 and by0 <= b[1] <= by1]
+
+    def inRect(self, key, (x, y, w, h)):
+        """
+        Returns a list of the objects filed under C{key} whose positions lie
+        in the rectangle C{(x, y, w, h)} (a pygame C{Rect} will do).
+        """
+        where = self.__where
+        x1, y1 = x + w - 1, y + h - 1
+        found = []
+        for b, objs in self.__bucketsIn(key, x, y, x1, y1):
+            for obj in objs:
+                ox, oy = where[obj][0]
+                if x <= ox <= x1 and y <= oy <= y1:
+                    found.append(obj)
+        return found
+
+    def inRadius(self, key, (cx, cy), radius):
+        """
+        Returns a list of the objects filed under C{key} within distance
+        C{radius} of C{(cx,cy)}.
+        """
+        where = self.__where
+        r = int(math.floor(radius))
+        r2 = radius*radius
+        found = []
+        for b, objs in self.__bucketsIn(key, cx-r, cy-r, cx+r, cy+r):
+            for obj in objs:
+                ox, oy = where[obj][0]
+                if (ox-cx)**2 + (oy-cy)**2 <= r2:
+                    found.append(obj)
+        return found
+
+    def nearest(self, key, (cx, cy), k=1, maxDist=None):
+        """
+        Returns a list of up to C{k} objects filed under C{key}, nearest
+        first, no farther than C{maxDist} (if given) from C{(cx,cy)}.
+        Searches rings of buckets outward from C{(cx,cy)} until no unsearched
+        bucket could hold anything nearer than what's been found.
+        """
+        keyBuckets = self.__buckets.get(key)
+        if not keyBuckets or k < 1:
+            return []
+        where, bs = self.__where, self.bucketSize
+        cbx, cby = cx//bs, cy//bs
+        # The farthest ring that could hold anything: beyond it, every
+        # occupied bucket has been searched.
+        lastRing = max([max(abs(bx - cbx), abs(by - cby))
+                        for bx, by in keyBuckets])
+        if maxDist is not None:
+            lastRing = min(lastRing, int(maxDist)//bs + 1)
+
+        best = []   # heap of (-dist2, pos, n, obj), the k nearest so far
+        n = 0
+        ring = 0
+        while ring <= lastRing:
+            if ring == 0:
+                cells = [(cbx, cby)]
+            elif 8*ring > len(keyBuckets):
+                # Cheaper to search every remaining occupied bucket at once
+                cells = [(bx, by) for bx, by in keyBuckets
+                         if max(abs(bx - cbx), abs(by - cby)) >= ring]
+                lastRing = ring
+            else:
+                cells = [(cbx + d, cby - ring) for d in
+                         xrange(-ring, ring+1)] + \
+                        [(cbx + d, cby + ring) for d in
+                         xrange(-ring, ring+1)] + \
+                        [(cbx - ring, cby + d) for d in
+                         xrange(-ring+1, ring)] + \
+                        [(cbx + ring, cby + d) for d in
+                         xrange(-ring+1, ring)]
+            for b in cells:
+                for obj in keyBuckets.get(b, ()):
+                    ox, oy = where[obj][0]
+                    d2 = (ox-cx)**2 + (oy-cy)**2
+                    if maxDist is not None and d2 > maxDist*maxDist:
+                        continue
+                    n += 1
+                    entry = (-d2, (ox, oy), -n, obj)
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+            if len(best) == k:
+                # Nothing outside the searched square of buckets is nearer
+                # than its nearest edge.
+                edge = min(cx - (cbx - ring)*bs + 1,
+                           (cbx + ring + 1)*bs - cx,
+                           cy - (cby - ring)*bs + 1,
+                           (cby + ring + 1)*bs - cy)
+                if -best[0][0] <= edge*edge:
+                    break
+            ring += 1
+        best.sort(reverse=True)
+        return [obj for d2, pos, n, obj in best]
+
+class RectIndex(object):
+    """
+    Keeps track of rectangles (e.g., the rooms of a map generator) in square
+    buckets of cells, each rectangle filed in every bucket it overlaps, so
+    that finding the rectangles near a given one only looks at the buckets
+    around it. Rectangles are pygame C{Rect}s, and collide as with
+    C{Rect.colliderect}: rectangles that merely share an edge don't.
+    """
+
+    def __init__(self, bucketSize=16):
+        """
+        @param bucketSize: The width and height of a bucket, in cells.
+        """
+        self.bucketSize = bucketSize
+        self.__buckets = {}     # (bx,by) -> [items]
+        self.__rects = {}       # item -> rect
+        self.__serials = {}     # item -> order of addition
+        self.__nextSerial = 0
+
+    def __len__(self):
+        return len(self.__rects)
+
+    def __contains__(self, item):
+        return item in self.__rects
+
+    def __span(self, rect):
+        # The (bx0, by0, bx1, by1) range of buckets overlapping rect
+        bs = self.bucketSize
+        return (rect.left//bs, rect.top//bs, (rect.right-1)//bs,
+                (rect.bottom-1)//bs)
+
+    def add(self, item, rect):
+        """
+        Files C{item} under the rectangle C{rect}.
+        """
+        if item in self.__rects:
+            self.remove(item)
+        bx0, by0, bx1, by1 = self.__span(rect)
+        buckets = self.__buckets
+        for by in xrange(by0, by1+1):
+            for bx in xrange(bx0, bx1+1):
+                items = buckets.get((bx,by))
+                if items is None:
+                    items = buckets[bx,by] = []
+                items.append(item)
+        self.__rects[item] = rect
+        self.__serials[item] = self.__nextSerial
+        self.__nextSerial += 1
+
+    def remove(self, item):
+        """
+        Removes C{item} from the index. Raises C{KeyError} if it isn't there.
+        """
+        bx0, by0, bx1, by1 = self.__span(self.__rects.pop(item))
+        del self.__serials[item]
+        buckets = self.__buckets
+        for by in xrange(by0, by1+1):
+            for bx in xrange(bx0, bx1+1):
+                items = buckets[bx,by]
+                items.remove(item)
+                if not items:
+                    del buckets[bx,by]
+
+    def rectOf(self, item):
+        """
+        Returns the rectangle C{item} is filed under.
+        """
+        return self.__rects[item]
+
+    def colliding(self, rect):
+        """
+        Returns a list of the items whose rectangles collide with C{rect},
+        in the order they were added.
+        """
+        if rect.w <= 0 or rect.h <= 0:
+            return []
+        bx0, by0, bx1, by1 = self.__span(rect)
+        buckets, rects = self.__buckets, self.__rects
+        found = {}
+        for by in xrange(by0, by1+1):
+            for bx in xrange(bx0, bx1+1):
+                for item in buckets.get((bx,by), ()):
+                    if item not in found and rect.colliderect(rects[item]):
+                        found[item] = True
+        return sorted(found, key=self.__serials.__getitem__)
+
+class OccupancyGrid(object):
+    """
+    A bitmap of the occupied cells of a grid, for placing non-overlapping
+    rectangles: whether a rectangle is free costs one scan per row of it,
+    whatever has been placed so far.
+    """
+
+    def __init__(self, cols, rows):
+        self.cols, self.rows = cols, rows
+        self.cells = bytearray(cols*rows)
+
+    def isFree(self, rect):
+        """
+        Returns C{True} iff C{rect} lies within the grid and none of its
+        cells is occupied.
+        """
+        cols = self.cols
+        x0, y0, x1, y1 = rect.left, rect.top, rect.right, rect.bottom
+        if x0 < 0 or y0 < 0 or x1 > cols or y1 > self.rows:
+            return False
+        cells = self.cells
+        for y in xrange(y0, y1):
+            if cells.find('\x01', y*cols + x0, y*cols + x1) != -1:
+                return False
+        return True
+
+    def isOccupied(self, x, y):
+        return self.cells[y*self.cols + x] != 0
+
+    def occupy(self, rect):
+        """
+        Marks the cells of C{rect}, clipped to the grid, as occupied.
+        """
+        cols = self.cols
+        x0, x1 = max(rect.left, 0), min(rect.right, cols)
+        if x1 <= x0:
+            return
+        row = bytearray('\x01') * (x1 - x0)
+        cells = self.cells
+        for y in xrange(max(rect.top, 0), min(rect.bottom, self.rows)):
+            cells[y*cols + x0:y*cols + x1] = row
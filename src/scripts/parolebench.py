@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+Benchmarks the built-in map generators headlessly, across a sweep of map
+sizes and seeds, and reports generation throughput (tiles per second), peak
+memory and object counts as JSON, optionally compared against a baseline
+from an earlier run::
+
+    parolebench.py --sizes 32,64,128,256 --output bench.json
+    ...
+    parolebench.py --sizes 32,64,128,256 --baseline bench.json
+
+Each case (generator, size, seed) runs in a fresh Python process, so that
+its peak memory is its own. A case's time covers applying the generator to
+an empty L{parole.map.Map2D}, not creating the map. C{objects} is the net
+number of garbage-collected objects (map objects, tiles' shaders and so on)
+the case left alive, C{peakMemoryKB} the process's peak resident set size
+(where the platform reports it).
+
+For each generator, C{exponent} is the slope of log(time) against
+log(tiles) over the sizes run: about 1 for generation linear in the map's
+area. With C{--baseline}, a generator and size whose median throughput fell
+by more than C{--tolerance} is reported as a regression, and the exit
+status is 1.
+"""
+
+import os, sys, gc, time, math, random, platform, subprocess
+from optparse import OptionParser, SUPPRESS_HELP
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    import resource
+except ImportError:
+    resource = None
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+#==============================================================================
+#{ The generators
+
+def setup():
+    # Everything needed to make MapObjects without starting the engine
+    import pygame
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    import parole.map
+    parole.map.AsciiTile.font = pygame.font.Font(None, 12)
+    return parole.map
+
+def makeObject(pmap, char, blocks=False):
+    return pmap.MapObject(0, pmap.AsciiTile(char, (200, 200, 200)),
+            blocksLOS=blocks, blocksMove=blocks)
+
+class BenchRoom(object):
+    # The minimum a RoomsAndCorridorsGenerator room needs
+    def __init__(self, pos):
+        import pygame
+        self.rect = pygame.Rect(pos, (random.randint(5, 12),
+                                      random.randint(5, 10)))
+
+    def apply(self, map):
+        inner = self.rect.inflate(-2, -2)
+        for y in xrange(inner.top, inner.bottom):
+            for x in xrange(inner.left, inner.right):
+                map[x,y].clear()
+
+    def diggable(self):
+        r = self.rect
+        return [(x, y) for x in xrange(r.left+1, r.right-1)
+                for y in (r.top, r.bottom-1)] + \
+               [(x, y) for y in xrange(r.top+1, r.bottom-1)
+                for x in (r.left, r.right-1)]
+
+    diggableOut = diggableIn = diggable
+
+class BenchDigger(object):
+    def digTile(self, map, tile, srcRoom, destRoom, allRooms):
+        tile.clear()
+        return not destRoom.rect.collidepoint(tile.col, tile.row)
+
+def objectGenerator(pmap, seed, size):
+    return pmap.MapObjectGenerator('floor',
+            lambda: makeObject(pmap, '.'))
+
+def perlinGenerator(pmap, seed, size):
+    return pmap.PerlinGenerator('water',
+            lambda tile, noise: noise > 0.2 and makeObject(pmap, '~') or None,
+            octaves=3, seed=seed)
+
+def cellularAutomataGenerator(pmap, seed, size):
+    wall = pmap.MapObjectGenerator('wall',
+            lambda: makeObject(pmap, '#', True))
+    return pmap.CellularAutomataGenerator('caves', 0.45,
+            dict([(n, wall) for n in xrange(5, 10)]), generations=3)
+
+def templateGenerator(pmap, seed, size):
+    wall = pmap.MapObjectGenerator('wall',
+            lambda: makeObject(pmap, '#', True))
+    floor = pmap.MapObjectGenerator('floor', lambda: makeObject(pmap, '.'))
+    return pmap.TemplateGenerator('huts',
+            '#####  \n#...#  \n#....  \n#...#  \n#####  \n       ',
+            {'#': wall, '.': floor})
+
+def roomsAndCorridorsGenerator(pmap, seed, size):
+    rock = pmap.MapObjectGenerator('rock',
+            lambda: makeObject(pmap, '#', True))
+    # About one room per 400 tiles
+    return pmap.RoomsAndCorridorsGenerator('dungeon', rock,
+            [(BenchRoom, max(1, size*size // 400))], BenchDigger,
+            lambda room: makeObject(pmap, '.'), defineRegions=False)
+
+# name -> (makeGenerator(pmap, seed, size), how to apply it)
+generators = {
+    'MapObjectGenerator':           (objectGenerator, 'apply'),
+    'PerlinGenerator':              (perlinGenerator, 'apply'),
+    'CellularAutomataGenerator':    (cellularAutomataGenerator, 'apply'),
+    'TemplateGenerator':            (templateGenerator, 'applyTiled'),
+    'RoomsAndCorridorsGenerator':   (roomsAndCorridorsGenerator, 'apply'),
+}
+generatorNames = ['MapObjectGenerator', 'PerlinGenerator',
+        'CellularAutomataGenerator', 'TemplateGenerator',
+        'RoomsAndCorridorsGenerator']
+
+#==============================================================================
+#{ Running cases
+
+def peakMemoryKB():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024   # bytes there, kilobytes elsewhere
+    return peak
+
+def runCase(name, size, seed):
+    """
+    Runs one case in this process and returns its result dictionary.
+    """
+    pmap = setup()
+    makeGenerator, method = generators[name]
+    random.seed(seed)
+    generator = makeGenerator(pmap, seed, size)
+    generator.setRNG(random.Random(seed))
+    map = pmap.Map2D('bench', (size, size))
+
+    gc.collect()
+    objectsBefore = len(gc.get_objects())
+    start = time.time()
+    getattr(generator, method)(map)
+    seconds = time.time() - start
+    objects = len(gc.get_objects()) - objectsBefore
+
+    return {'generator': name, 'size': size, 'seed': seed,
+            'tiles': size*size, 'seconds': seconds, 'objects': objects,
+            'peakMemoryKB': peakMemoryKB()}
+
+def spawnCase(name, size, seed):
+    """
+    Runs one case in a new process and returns its result dictionary.
+    """
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                             '--case', '%s:%d:%d' % (name, size, seed)],
+                            stdout=subprocess.PIPE)
+    out = proc.communicate()[0]
+    if proc.returncode:
+        raise RuntimeError('Case %s %dx%d seed %d failed.' % (name, size,
+                size, seed))
+    return json.loads(out.strip().splitlines()[-1])
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n//2]
+    return (values[n//2 - 1] + values[n//2]) / 2.0
+
+def summarize(cases):
+    """
+    Groups case results by generator and size: the median time over the
+    seeds, the throughput it gives, and the largest peak memory.
+    """
+    groups = {}
+    for case in cases:
+        groups.setdefault((case['generator'], case['size']), []).append(case)
+    results = []
+    for (name, size), group in sorted(groups.iteritems(),
+            key=lambda item: (generatorNames.index(item[0][0]), item[0][1])):
+        seconds = median([c['seconds'] for c in group])
+        peaks = [c['peakMemoryKB'] for c in group
+                 if c['peakMemoryKB'] is not None]
+        results.append({
+            'generator': name,
+            'size': size,
+            'tiles': size*size,
+            'seeds': [c['seed'] for c in group],
+            'seconds': seconds,
+            'minSeconds': min([c['seconds'] for c in group]),
+            'tilesPerSecond': size*size / max(seconds, 1e-9),
+            'objects': median([c['objects'] for c in group]),
+            'peakMemoryKB': peaks and max(peaks) or None,
+        })
+    return results
+
+def exponents(results):
+    """
+    Returns, for each generator run at two sizes or more, the least-squares
+    slope of log(seconds) against log(tiles).
+    """
+    points = {}
+    for r in results:
+        points.setdefault(r['generator'], []).append(
+                (math.log(r['tiles']), math.log(max(r['seconds'], 1e-9))))
+    slopes = {}
+    for name, pts in points.iteritems():
+        if len(pts) < 2:
+            continue
+        mx = sum([x for x, y in pts]) / len(pts)
+        my = sum([y for x, y in pts]) / len(pts)
+        sxx = sum([(x - mx)**2 for x, y in pts])
+        if sxx:
+            slopes[name] = sum([(x - mx)*(y - my) for x, y in pts]) / sxx
+    return slopes
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the throughput of each generator and size against those in
+    C{baseline} (an earlier report), returning a list of comparisons.
+    """
+    before = dict([((r['generator'], r['size']), r)
+                   for r in baseline.get('results', [])])
+    comparisons = []
+    for r in results:
+        b = before.get((r['generator'], r['size']))
+        if b is None:
+            continue
+        ratio = r['tilesPerSecond'] / max(b['tilesPerSecond'], 1e-9)
+        comparisons.append({
+            'generator': r['generator'],
+            'size': r['size'],
+            'baselineTilesPerSecond': b['tilesPerSecond'],
+            'tilesPerSecond': r['tilesPerSecond'],
+            'ratio': ratio,
+            'regression': ratio < 1.0 - tolerance,
+        })
+    return comparisons
+
+#==============================================================================
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--generators', default=','.join(generatorNames),
+            help='comma-separated generators to run [default: all]')
+    parser.add_option('--sizes', default='32,64,128,256',
+            help='comma-separated map widths (maps are square) '
+                 '[default: %default]')
+    parser.add_option('--seeds', default='1,2,3',
+            help='comma-separated seeds [default: %default]')
+    parser.add_option('--baseline', metavar='FILE',
+            help='an earlier report to compare against')
+    parser.add_option('--tolerance', type='float', default=0.2,
+            help='the drop in throughput counted as a regression '
+                 '[default: %default]')
+    parser.add_option('--output', metavar='FILE',
+            help='write the report here instead of to standard output')
+    parser.add_option('--in-process', action='store_true',
+            dest='inProcess', help="run every case in this process (peak "
+            "memory is then the whole run's)")
+    parser.add_option('--case', help=SUPPRESS_HELP)
+    (options, args) = parser.parse_args()
+
+    if options.case:
+        name, size, seed = options.case.split(':')
+        print json.dumps(runCase(name, int(size), int(seed)))
+        return 0
+
+    names = [n for n in options.generators.split(',') if n]
+    for name in names:
+        if name not in generators:
+            parser.error('unknown generator: %s' % name)
+    sizes = [int(s) for s in options.sizes.split(',') if s]
+    seeds = [int(s) for s in options.seeds.split(',') if s]
+
+    run = options.inProcess and runCase or spawnCase
+    cases = []
+    for name in names:
+        for size in sizes:
+            for seed in seeds:
+                cases.append(run(name, size, seed))
+                sys.stderr.write('%s %dx%d seed %d: %.3fs\n' % (name, size,
+                        size, seed, cases[-1]['seconds']))
+
+    results = summarize(cases)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': sizes,
+        'seeds': seeds,
+        'results': results,
+        'exponents': exponents(results),
+    }
+    regressions = []
+    if options.baseline:
+        f = open(options.baseline)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        report['comparison'] = compare(results, baseline, options.tolerance)
+        regressions = [c for c in report['comparison'] if c['regression']]
+        for c in regressions:
+            sys.stderr.write('REGRESSION: %s %dx%d: %.0f -> %.0f tiles/s\n' %
+                    (c['generator'], c['size'], c['size'],
+                     c['baselineTilesPerSecond'], c['tilesPerSecond']))
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            f.write(text + '\n')
+        finally:
+            f.close()
+    else:
+        print text
+    return regressions and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
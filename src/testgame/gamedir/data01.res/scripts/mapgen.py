@@ -26,7 +26,9 @@ def makeOutdoorMap(data):
     COLS, ROWS = 96, 64
     map = parole.map.Map2D('Test Map', (COLS, ROWS))
 
-    # Populate map with objects
+    # Populate map with objects. The generators are applied to a compact
+    # grid first, and only what survives the later ones is added to the map.
+    steps = []
 
     # Grass (cellular automata)
     grassGenerator = \
@@ -51,7 +53,7 @@ def makeOutdoorMap(data):
     }
     grassAreaGenerator =  parole.map.CellularAutomataGenerator("grassAreaGenerator",
             0.90, grassConditions, seedEdges=True)
-    grassAreaGenerator.apply(map)
+    steps.append((grassAreaGenerator, None))
 
     # Flowers (cellular automata)
     baseRoseR, baseRoseG, baseRoseB = colors['DarkRed']
@@ -68,7 +70,7 @@ def makeOutdoorMap(data):
     }
     roseAreaGenerator = parole.map.CellularAutomataGenerator("roseGenerator",
             0.35, roseConditions) 
-    roseAreaGenerator.apply(map)
+    steps.append((roseAreaGenerator, None))
 
     # Trees
     baseTreeRGB = colors['ForestGreen']
@@ -86,7 +88,7 @@ def makeOutdoorMap(data):
     }
     forestGenerator = parole.map.CellularAutomataGenerator("forestGenerator",
             0.25, forestConditions)
-    forestGenerator.apply(map)
+    steps.append((forestGenerator, None))
 
     # Road (cellular automata)
     baseRoadR, baseRoadG, baseRoadB = colors['SaddleBrown']
@@ -110,7 +112,7 @@ def makeOutdoorMap(data):
     roadAreaGenerator = parole.map.CellularAutomataGenerator("roadGenerator",
             0.50, roadConditions, seedEdges=True, clearFirst=True)
     # road stretches across map centered at y=9, with a height of 5
-    roadAreaGenerator.apply(map, pygame.Rect((0,7), (COLS,5)))
+    steps.append((roadAreaGenerator, pygame.Rect((0,7), (COLS,5))))
 
     # Rectangular room
     floorGenerator = parole.map.MapObjectGenerator("floorGenerator", 
@@ -146,7 +148,7 @@ def makeOutdoorMap(data):
         }
     roomGenerator = parole.map.TemplateGenerator("roomGenerator",
             roomTemplate, roomLegend, clearFirst=True)
-    map.applyGenerator(roomGenerator, pygame.Rect((25,12), (20,20)))
+    steps.append((roomGenerator, pygame.Rect((25,12), (20,20))))
 
     # perlin water
     waterGenerator = parole.map.PerlinGenerator("waterGenerator",
@@ -157,9 +159,11 @@ def makeOutdoorMap(data):
             lambda t, r: float(t.col - r.x) / r.w,
             lambda t, r: float(t.row - r.y) / r.h,
             lambda t, r: random.random(), clearFirst=True)
-    map.applyGenerator(waterGenerator, pygame.Rect((25, 35), (20, 20)))
+    steps.append((waterGenerator, pygame.Rect((25, 35), (20, 20))))
     data['waterGenerator'] = waterGenerator
 
+    map.generate(steps)
+
 
     tree = TestMapObject('a tree', 50, parole.map.AsciiTile('^',
         interpolateRGB(baseTreeRGB, autumnTreeRGB, max(0.0, min(1.0,